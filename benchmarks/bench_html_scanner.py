@@ -0,0 +1,118 @@
+"""Compare the anchor scanner used by PyPIParser with the previous HTMLParser based parser
+
+Uses a synthetic index page and optionally pages recorded by bench_index_parsers.py:
+
+	python benchmarks/bench_html_scanner.py --links 5000 --links 20000 /tmp/pynixreq-index-pages/*.html
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import time
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Text, Tuple
+
+from packaging.specifiers import SpecifierSet
+from packaging.version import Version, parse as version_parse
+
+from pynixreq.pypiparser import SDIST_EXTS, IndexParser, PyPIParser
+
+WHEEL_TAGS = ('cp36-cp36m-manylinux1_x86_64', 'cp37-cp37m-manylinux1_x86_64', 'cp37-cp37m-win_amd64', 'cp37-cp37m-macosx_10_9_x86_64')
+
+
+class HTMLParserEngine(HTMLParser):
+	"""the HTMLParser based parser pynixreq used before, eagerly parsing every sdist link"""
+
+	def __init__(self, index_url: Text, base_name: Text) -> None:
+		super().__init__()
+		self.helper = IndexParser(index_url, base_name)
+		self.candidates: Dict[Version, Tuple[Text, Optional[Text], Optional[Text], SpecifierSet]] = {}
+		self._attrs: List[Tuple[Text, Text]] = None
+		self._data: Text = None
+
+	def process_package(self) -> None:
+		base, ext = self.helper.splitext(self._data)
+		if ext not in SDIST_EXTS:
+			return
+
+		attrs = dict(self._attrs)
+		version = version_parse(self.helper.get_version(base))
+		url = self.helper.get_url(attrs['href'])
+		hash_type, hash = self.helper.get_hash(attrs['href'])
+		requires_python = SpecifierSet(attrs.get('data-requires-python', ""))
+
+		if version in self.candidates:
+			old_ext = self.helper.splitext(self.candidates[version][0])[1]
+			if SDIST_EXTS.index(old_ext) < SDIST_EXTS.index(ext):
+				return
+
+		self.candidates[version] = (url, hash_type, hash, requires_python)
+
+	def handle_starttag(self, tag: Text, attrs: List[Tuple[Text, Text]]) -> None:
+		if tag == 'a':
+			self._attrs = attrs
+
+	def handle_endtag(self, tag: Text) -> None:
+		if tag == 'a':
+			self.process_package()
+			self._attrs = None
+			self._data = None
+
+	def handle_data(self, data: Text) -> None:
+		if self._attrs is not None:
+			self._data = data if self._data is None else self._data + data
+
+
+def synthetic_page(name: Text, links: int) -> Text:
+	"""index page with one sdist and several wheels per release"""
+	lines = ['<!DOCTYPE html>', '<html><head><title>Links for %s</title></head><body>' % name]
+	per_release = 1 + len(WHEEL_TAGS)
+
+	for release in range(links // per_release):
+		version = f'{release // 100}.{release // 10 % 10}.{release % 10}'
+		files = [f'{name}-{version}.tar.gz'] + [f'{name}-{version}-{tag}.whl' for tag in WHEEL_TAGS]
+		for filename in files:
+			digest = hashlib.sha256(filename.encode()).hexdigest()
+			lines.append(f'<a href="../../packages/{digest[:2]}/{digest[2:4]}/{filename}#sha256={digest}" data-requires-python="&gt;=3.6">{filename}</a><br/>')
+
+	lines.append('</body></html>')
+	return '\n'.join(lines)
+
+
+def measure(engine, name: Text, text: Text, rounds: int) -> Tuple[float, int]:
+	best = float('inf')
+	for _ in range(rounds):
+		start = time.perf_counter()
+		parser = engine('https://pypi.org/simple/%s/' % name, name)
+		parser.feed(text)
+		parser.close()
+		best = min(best, time.perf_counter() - start)
+
+	return best, len(parser.candidates)
+
+
+def main(argv: List[Text] = None) -> None:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--links', type=int, action='append', help='Number of links on a synthetic page')
+	parser.add_argument('--rounds', type=int, default=5)
+	parser.add_argument('pages', nargs='*', help='Recorded HTML index pages named <project>.html')
+	args = parser.parse_args(argv)
+
+	pages = [(f'synthetic-{links}', 'example', synthetic_page('example', links)) for links in args.links or [5000]]
+	for filename in args.pages:
+		name = os.path.splitext(os.path.basename(filename))[0]
+		with open(filename, encoding='utf-8') as fp:
+			pages.append((name, name, fp.read()))
+
+	print(f'{"page":<20} {"links":>7} {"sdists":>7} {"HTMLParser [ms]":>16} {"scanner [ms]":>13} {"speedup":>8}')
+	for label, name, text in pages:
+		old_time, old_count = measure(HTMLParserEngine, name, text, args.rounds)
+		new_time, new_count = measure(PyPIParser, name, text, args.rounds)
+		assert old_count == new_count, f'{label}: engines disagree'
+
+		print(f'{label:<20} {text.count("<a "):>7} {new_count:>7} {old_time * 1000:>16.2f} {new_time * 1000:>13.2f} {old_time / new_time:>7.1f}x')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,120 @@
+"""Compare the HTML (PEP 503) and JSON (PEP 691) simple index parsers on recorded index pages
+
+Pages are recorded from the index on the first run and reused afterwards:
+
+	python benchmarks/bench_index_parsers.py --pages /tmp/pages boto3 botocore grpcio
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import urllib.request
+from html.parser import HTMLParser
+from typing import Any, Callable, Dict, List, Text, Tuple
+
+from pynixreq.pypi import PyPI
+from pynixreq.pypiparser import CONTENT_TYPE_JSON, IndexParser, PyPIJSONParser, PyPIParser
+
+FORMATS = {
+	'html': ('text/html', PyPIParser),
+	'json': (CONTENT_TYPE_JSON, PyPIJSONParser),
+}
+
+
+class AnchorCollector(HTMLParser):
+	"""collect anchors of an HTML index page as PEP 691 file entries"""
+
+	def __init__(self) -> None:
+		super().__init__()
+		self.files: List[Dict[Text, Any]] = []
+		self._file: Dict[Text, Any] = None
+
+	def handle_starttag(self, tag: Text, attrs: List[Tuple[Text, Text]]) -> None:
+		if tag == 'a':
+			attrs = dict(attrs)
+			url, _, fragment = attrs['href'].partition('#')
+			hashes = dict([fragment.split('=', 1)]) if '=' in fragment else {}
+			self._file = {'url': url, 'hashes': hashes, 'requires-python': attrs.get('data-requires-python')}
+
+	def handle_data(self, data: Text) -> None:
+		if self._file is not None:
+			self._file['filename'] = data
+
+	def handle_endtag(self, tag: Text) -> None:
+		if tag == 'a' and self._file is not None:
+			self.files.append(self._file)
+			self._file = None
+
+
+def html_to_json(name: Text, html: Text) -> Text:
+	collector = AnchorCollector()
+	collector.feed(html)
+	collector.close()
+
+	return json.dumps({'meta': {'api-version': '1.0'}, 'name': name, 'files': collector.files})
+
+
+def record(index: Text, name: Text, directory: Text) -> Dict[Text, Tuple[Text, Text]]:
+	"""record index pages in both formats, deriving JSON from HTML for indexes that only serve HTML"""
+	pages = {}
+	url = PyPI.get_url(index, name)
+
+	for fmt, (content_type, _) in FORMATS.items():
+		filename = os.path.join(directory, f'{name}.{fmt}')
+		if not os.path.exists(filename):
+			request = urllib.request.Request(url, headers={'Accept': content_type})
+			with urllib.request.urlopen(request) as response:
+				text = response.read().decode('utf-8')
+				if response.headers.get_content_type() != content_type:
+					text = html_to_json(name, text)
+
+			with open(filename, 'w', encoding='utf-8') as fp:
+				fp.write(text)
+
+		with open(filename, encoding='utf-8') as fp:
+			pages[fmt] = (url, fp.read())
+
+	return pages
+
+
+def measure(parser_class: Callable[[Text, Text], IndexParser], url: Text, name: Text, text: Text, rounds: int) -> Tuple[float, IndexParser]:
+	best = float('inf')
+	for _ in range(rounds):
+		start = time.perf_counter()
+		parser = parser_class(url, name)
+		parser.feed(text)
+		parser.close()
+		best = min(best, time.perf_counter() - start)
+
+	return best, parser
+
+
+def main(argv: List[Text] = None) -> None:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--index-url', default='https://pypi.org/simple')
+	parser.add_argument('--pages', default=os.path.join(tempfile.gettempdir(), 'pynixreq-index-pages'), help='Directory with recorded index pages')
+	parser.add_argument('--rounds', type=int, default=5)
+	parser.add_argument('projects', nargs='+')
+	args = parser.parse_args(argv)
+
+	os.makedirs(args.pages, exist_ok=True)
+
+	print(f'{"project":<20} {"files":>7} {"html [ms]":>10} {"json [ms]":>10} {"speedup":>8}')
+	for name in args.projects:
+		pages = record(args.index_url, name, args.pages)
+		results = {fmt: measure(FORMATS[fmt][1], url, name, text, args.rounds) for fmt, (url, text) in pages.items()}
+
+		html_time, html_parser = results['html']
+		json_time, json_parser = results['json']
+		assert [c.to_json() for c in html_parser.candidates.values()] == [c.to_json() for c in json_parser.candidates.values()], \
+			f'{name}: parsers disagree'
+
+		files = pages['html'][1].count('<a ')
+		print(f'{name:<20} {files:>7} {html_time * 1000:>10.2f} {json_time * 1000:>10.2f} {html_time / json_time:>7.1f}x')
+
+
+if __name__ == '__main__':
+	main()
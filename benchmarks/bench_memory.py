@@ -0,0 +1,111 @@
+"""Measure memory held by candidates and their metadata for a large graph
+
+Every index page of the graph is parsed into candidates and every candidate gets metadata
+parsed from its requirement strings, as if a resolution had looked at all of them. Memory
+is traced by tracemalloc, the run time is measured without it in a fresh process:
+
+	python benchmarks/bench_memory.py --save before.json
+	python benchmarks/bench_memory.py --compare before.json
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Text
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_index import GRAPHS, Graph, simple_page  # noqa: E402
+
+COLUMNS = ('held', 'peak', 'blocks', 'objects', 'time')
+
+
+def load(graph: Graph, pages: Dict[Text, Text]) -> Dict[Text, Any]:
+	from pynixreq.data import CandidateInfo
+	from pynixreq.pypiparser import get_parser
+
+	projects = {}
+	for name, page in pages.items():
+		parser = get_parser('text/html', f'https://example.com/simple/{name}/', name)
+		parser.feed(page)
+		parser.close()
+		for version, candidate in parser.candidates.items():
+			candidate.info = CandidateInfo.from_json({'setup': [], 'test': [], 'install': graph[name][version], 'extras': {}})
+		projects[name] = parser.candidates
+
+	return projects
+
+
+def pages_of(graph: Graph) -> Dict[Text, Text]:
+	return {name: simple_page(name, versions).decode() for name, versions in graph.items()}
+
+
+def child(name: Text) -> None:
+	graph, _ = GRAPHS[name]()
+	pages = pages_of(graph)
+	start = time.perf_counter()
+	load(graph, pages)
+	print(time.perf_counter() - start)
+
+
+def measure(name: Text) -> Dict[Text, Any]:
+	graph, _ = GRAPHS[name]()
+	pages = pages_of(graph)
+
+	gc.collect()
+	objects = len(gc.get_objects())
+	tracemalloc.start()
+	before = tracemalloc.take_snapshot()
+	projects = load(graph, pages)
+	gc.collect()
+	held, peak = tracemalloc.get_traced_memory()
+	blocks = sum(stat.count_diff for stat in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+	tracemalloc.stop()
+	objects = len(gc.get_objects()) - objects
+
+	output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name], stdout=subprocess.PIPE, check=True).stdout
+	elapsed = float(output.decode().splitlines()[-1])
+
+	return {
+		'projects': len(projects),
+		'candidates': sum(len(candidates) for candidates in projects.values()),
+		'held': held / 2 ** 20,
+		'peak': peak / 2 ** 20,
+		'blocks': blocks,
+		'objects': objects,
+		'time': elapsed,
+	}
+
+
+def main(argv: List[Text] = None) -> None:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--graph', choices=sorted(GRAPHS), default='popular', help='Graph to load (default: %(default)s)')
+	parser.add_argument('--save', help='Write results to a JSON file')
+	parser.add_argument('--compare', help='JSON file with results of an earlier run')
+	args = parser.parse_args(argv)
+
+	result = measure(args.graph)
+
+	print(f'{"projects":>8} {"candidates":>10} {"held [MB]":>10} {"peak [MB]":>10} {"blocks":>9} {"objects":>9} {"time [s]":>9}')
+	print(f'{result["projects"]:>8} {result["candidates"]:>10} {result["held"]:>10.1f} {result["peak"]:>10.1f} {result["blocks"]:>9} {result["objects"]:>9} {result["time"]:>9.3f}')
+	if args.compare:
+		with open(args.compare) as fp:
+			baseline = json.load(fp)
+		print('vs baseline: ' + ' '.join(f'{column} {result[column] / baseline[column]:.2f}x' for column in COLUMNS if baseline[column]))
+
+	if args.save:
+		with open(args.save, 'w') as fp:
+			json.dump(result, fp, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+	if sys.argv[1:2] == ['--child']:
+		child(sys.argv[2])
+	else:
+		main()
@@ -0,0 +1,137 @@
+"""Measure DependencySolver.run end to end on synthetic graphs, offline
+
+Graphs are served by a local simple index and metadata is built by stub nix tools put on
+PATH, which can simulate slow builds with --latency. Every resolution runs in a fresh
+process, so peak RSS belongs to it alone. Results can be saved and compared to a run of
+another version:
+
+	python benchmarks/bench_resolver.py --graph wide --graph conflicts --save before.json
+	python benchmarks/bench_resolver.py --graph wide --graph conflicts --compare before.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Text
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_index import GRAPHS, FakeIndex, save_graph, spawns, write_stub_tools  # noqa: E402
+
+COLUMNS = ('packages', 'wall', 'http', 'spawns', 'rss')
+
+
+async def resolve(roots: List[Text], config: Dict[Text, Any]) -> Dict[Text, Any]:
+	"""resolution measured inside the child process"""
+	from pynixreq.compile_requirements import DependencySolver
+	from pynixreq.data import RequirementWrapper, TargetDetails
+
+	solver = DependencySolver([RequirementWrapper.from_requirement(root) for root in roots], TargetDetails('3'), config)
+	start = time.perf_counter()
+	error = None
+	try:
+		await solver.run()
+	except Exception as e:
+		error = f'{type(e).__name__}: {e}'.splitlines()[0]
+	wall = time.perf_counter() - start
+	await solver.context.close()
+
+	return {
+		'packages': len(solver.packages),
+		'wall': wall,
+		# kilobytes on Linux
+		'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+		'error': error,
+	}
+
+
+def child(argv: List[Text]) -> None:
+	roots, config = json.loads(argv[0]), json.loads(argv[1])
+	print(json.dumps(asyncio.get_event_loop().run_until_complete(resolve(roots, config))))
+
+
+def measure(name: Text, args: argparse.Namespace, tools: Text) -> Dict[Text, Any]:
+	graph, roots = GRAPHS[name]()
+	best: Optional[Dict[Text, Any]] = None
+
+	with tempfile.TemporaryDirectory() as directory, FakeIndex(graph, metadata=args.metadata) as index:
+		graph_file = os.path.join(directory, 'graph.json')
+		save_graph(graph, graph_file)
+
+		config = {
+			'index-url': index.url,
+			'no-cache': True,
+			'greedy': args.greedy,
+			'nix-batch-size': args.batch_size,
+			'nix-jobs': args.nix_jobs,
+		}
+		for _ in range(args.rounds):
+			out = tempfile.mkdtemp(dir=directory)
+			env = dict(os.environ, PATH=f'{tools}{os.pathsep}{os.environ["PATH"]}', STUB_GRAPH=graph_file, STUB_OUT=out, STUB_LATENCY=str(args.latency))
+			index.reset()
+			output = subprocess.run(
+				[sys.executable, os.path.abspath(__file__), '--child', json.dumps(roots), json.dumps(config)],
+				env=env, stdout=subprocess.PIPE, check=True,
+			).stdout
+			result = json.loads(output.decode().splitlines()[-1])
+			result.update(http=index.requests, spawns=spawns(out))
+
+			if best is None or result['wall'] < best['wall']:
+				best = result
+
+	best['versions'] = sum(len(versions) for versions in graph.values())
+	return best
+
+
+def main(argv: List[Text] = None) -> None:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--graph', choices=sorted(GRAPHS), action='append', help='Graph to resolve (default: all)')
+	parser.add_argument('--latency', type=float, default=0.0, help='Seconds every stub nix tool sleeps')
+	parser.add_argument('--metadata', action='store_true', help='Serve PEP 658 metadata instead of building it')
+	parser.add_argument('--greedy', action='store_true')
+	parser.add_argument('--batch-size', type=int, default=8)
+	parser.add_argument('--nix-jobs', type=int, default=4)
+	parser.add_argument('--rounds', type=int, default=1, help='Resolutions per graph, the fastest is reported')
+	parser.add_argument('--save', help='Write results to a JSON file')
+	parser.add_argument('--compare', help='JSON file with results of an earlier run')
+	args = parser.parse_args(argv)
+
+	with tempfile.TemporaryDirectory() as tools:
+		write_stub_tools(tools)
+
+		baseline = {}
+		if args.compare:
+			with open(args.compare) as fp:
+				baseline = json.load(fp)
+
+		print(f'{"graph":<14} {"versions":>8} {"packages":>8} {"wall [s]":>9} {"http":>6} {"spawns":>7} {"rss [MB]":>9}  {"vs baseline" if baseline else ""}')
+		results = {}
+		for name in args.graph or sorted(GRAPHS):
+			result = results[name] = measure(name, args, tools)
+			line = f'{name:<14} {result["versions"]:>8} {result["packages"]:>8} {result["wall"]:>9.3f} {result["http"]:>6} {result["spawns"]:>7} {result["rss"]:>9.1f}'
+			if name in baseline:
+				line += '  ' + ' '.join(
+					f'{column} {result[column] / baseline[name][column]:.2f}x' for column in COLUMNS
+					if column != 'packages' and baseline[name][column]
+				)
+			if result['error']:
+				line += f'  ({result["error"]})'
+			print(line)
+
+	if args.save:
+		with open(args.save, 'w') as fp:
+			json.dump(results, fp, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+	if sys.argv[1:2] == ['--child']:
+		child(sys.argv[2:])
+	else:
+		main()
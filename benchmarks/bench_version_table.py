@@ -0,0 +1,93 @@
+"""Compare candidate filtering with VersionTable against sorting and calling SpecifierSet.contains
+
+Projects with thousands of releases are generated, every specifier is applied the way the
+resolver does it during a resolution: many times against the same project.
+
+	python benchmarks/bench_version_table.py --releases 1000 --releases 5000 --lookups 200
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from typing import Callable, List, Text, Tuple
+
+from packaging.specifiers import SpecifierSet
+
+from pynixreq.data import Candidate
+from pynixreq.versions import VersionTable
+
+SPECIFIERS = ('', '>=2.0', '>=1.5,<3', '~=4.2', '==3.1.*', '>=1.0,!=2.0.1,!=2.1.*,<5', '==4.2.5', '<0.2')
+
+
+def synthetic_project(releases: int, seed: int = 0) -> List[Candidate]:
+	"""project with final releases plus some pre- and post-releases"""
+	rng = random.Random(seed)
+	candidates = []
+	for release in range(releases):
+		version = f'{release // 200}.{release // 20 % 10}.{release % 20}'
+		roll = rng.random()
+		if roll < 0.1:
+			version += f'rc{rng.randint(0, 3)}'
+		elif roll < 0.15:
+			version += f'.post{rng.randint(1, 3)}'
+		candidates.append(Candidate('example', version, f'https://example.org/example-{version}.tar.gz', 'sha256', '0' * 64))
+
+	return candidates
+
+
+def sort_and_contains(candidates: List[Candidate], specifier: SpecifierSet) -> List[Candidate]:
+	"""filtering as done by _pick_package_version before VersionTable"""
+	return [
+		candidate for candidate in sorted(candidates, reverse=True)
+		if not (candidate.version.is_devrelease or candidate.version.is_prerelease) and specifier.contains(candidate.version)
+	]
+
+
+def measure(function: Callable[[], List[Candidate]], rounds: int) -> Tuple[float, List[Candidate]]:
+	best = float('inf')
+	for _ in range(rounds):
+		start = time.perf_counter()
+		result = function()
+		best = min(best, time.perf_counter() - start)
+
+	return best, result
+
+
+def main(argv: List[Text] = None) -> None:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument('--releases', type=int, action='append', help='Number of releases of a synthetic project')
+	parser.add_argument('--lookups', type=int, default=100, help='Number of times every specifier is applied')
+	parser.add_argument('--rounds', type=int, default=3)
+	args = parser.parse_args(argv)
+
+	print(f'{"releases":>8} {"specifier":<28} {"matches":>7} {"contains [ms]":>14} {"table [ms]":>11} {"speedup":>8}')
+	for releases in args.releases or [1000, 5000]:
+		candidates = synthetic_project(releases)
+		for candidate in candidates:
+			candidate.version  # parse versions up front, both approaches share them
+
+		start = time.perf_counter()
+		table = VersionTable(candidates)
+		build = time.perf_counter() - start
+
+		for text in SPECIFIERS:
+			specifier = SpecifierSet(text)
+
+			def old() -> List[Candidate]:
+				return [sort_and_contains(candidates, specifier) for _ in range(args.lookups)][-1]
+
+			def new() -> List[Candidate]:
+				return [table.matching(specifier, allow_prereleases=False) for _ in range(args.lookups)][-1]
+
+			old_time, old_result = measure(old, args.rounds)
+			new_time, new_result = measure(new, args.rounds)
+			assert [x.version for x in old_result] == [x.version for x in new_result], f'{text}: results differ'
+
+			print(f'{releases:>8} {text or "<any>":<28} {len(new_result):>7} {old_time * 1000:>14.2f} {new_time * 1000:>11.2f} {old_time / new_time:>7.1f}x')
+
+		print(f'{releases:>8} {"(building the table)":<28} {"":>7} {"":>14} {build * 1000:>11.2f}')
+
+
+if __name__ == '__main__':
+	main()
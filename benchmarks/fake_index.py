@@ -0,0 +1,267 @@
+"""Synthetic dependency graphs, a local simple index serving them and stub nix tools
+
+A graph maps project names to versions and their requirements. The index serves a PEP 503
+page per project with an sdist per version (and optionally PEP 658 metadata), the stub
+nix-build answers metadata builds from the same graph, so a resolution runs offline.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import random
+import stat
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Text, Tuple
+
+# project -> version -> requirements
+Graph = Dict[Text, Dict[Text, List[Text]]]
+
+
+def wide(packages: int = 200, versions: int = 5, seed: int = 0) -> Tuple[Graph, List[Text]]:
+	"""many independent projects required by the root, each with a few dependencies"""
+	rng = random.Random(seed)
+	graph: Graph = {}
+	for i in range(packages):
+		graph[f'w{i}'] = {
+			f'{v}.0': [f'w{j}>={rng.randint(1, versions)}.0' for j in rng.sample(range(i + 1, packages), min(2, packages - i - 1))]
+			for v in range(1, versions + 1)
+		}
+
+	return graph, [f'w{i}' for i in range(0, packages, 4)]
+
+
+def deep(depth: int = 100, versions: int = 5) -> Tuple[Graph, List[Text]]:
+	"""chain of projects, each requiring the next one"""
+	graph: Graph = {
+		f'd{i}': {f'{v}.0': [f'd{i + 1}>={v}.0'] if i + 1 < depth else [] for v in range(1, versions + 1)}
+		for i in range(depth)
+	}
+	return graph, ['d0']
+
+
+def conflicts(packages: int = 40, versions: int = 10, seed: int = 0) -> Tuple[Graph, List[Text]]:
+	"""newest versions of every project pin others to the oldest version the root accepts
+
+	Picking newest versions leads to conflicts the resolver has to back out of, the graph is
+	solvable with every project at the second oldest version the root accepts."""
+	rng = random.Random(seed)
+	half = versions // 2
+	graph: Graph = {f'c{i}': {} for i in range(packages)}
+	for i in range(packages):
+		for v in range(1, versions + 1):
+			targets = rng.sample([j for j in range(packages) if j != i], 2)
+			if v > half + 1:
+				graph[f'c{i}'][f'{v}.0'] = [f'c{j}<{half + 1}.0' for j in targets]
+			else:
+				graph[f'c{i}'][f'{v}.0'] = [f'c{j}>=1.0' for j in targets]
+
+	return graph, [f'c{i}>={half}.0' for i in range(packages)]
+
+
+def many_versions(packages: int = 20, versions: int = 3000, seed: int = 0) -> Tuple[Graph, List[Text]]:
+	"""few projects with thousands of releases each"""
+	rng = random.Random(seed)
+	graph: Graph = {}
+	for i in range(packages):
+		releases = [f'{n // 100}.{n % 100}' for n in range(1, versions + 1)]
+		graph[f'm{i}'] = {
+			release: [f'm{j}>={rng.choice(releases[:versions // 2])}' for j in range(i + 1, min(i + 3, packages))]
+			for release in releases
+		}
+
+	return graph, [f'm{i}' for i in range(0, packages, 5)]
+
+
+def popular(packages: int = 1200, versions: int = 10, seed: int = 0) -> Tuple[Graph, List[Text]]:
+	"""many projects sharing requirements on a few popular ones, like six or setuptools on PyPI"""
+	rng = random.Random(seed)
+	common = max(packages // 30, 1)
+	specifiers = ['', '>=1.0', '>=2.0', '>=1.0,<100', '!=3.0']
+	graph: Graph = {f'p{i}': {f'{v}.0': [] for v in range(1, versions + 1)} for i in range(common)}
+	for i in range(common, packages):
+		graph[f'p{i}'] = {
+			f'{v}.0': [f'p{j}{rng.choice(specifiers)}' for j in rng.sample(range(common), 3)]
+				+ ([f'p{i + 1}>=1.0'] if i + 1 < packages and i % 10 else [])
+			for v in range(1, versions + 1)
+		}
+
+	return graph, [f'p{i}' for i in range(common, packages, 10)]
+
+
+GRAPHS = {
+	'wide': wide,
+	'deep': deep,
+	'conflicts': conflicts,
+	'many-versions': many_versions,
+	'popular': popular,
+}
+
+
+def sdist(name: Text, version: Text) -> bytes:
+	return f'{name}-{version} sdist'.encode()
+
+
+def simple_page(name: Text, versions: Iterable[Text], metadata: bool = False) -> bytes:
+	"""PEP 503 page listing an sdist of every version"""
+	attribute = ' data-core-metadata="true"' if metadata else ''
+	links = ''.join(
+		f'<a href="/files/{name}-{version}.tar.gz#sha256={hashlib.sha256(sdist(name, version)).hexdigest()}"{attribute}>{name}-{version}.tar.gz</a><br/>\n'
+		for version in versions
+	)
+	return f'<html><body>\n{links}</body></html>'.encode()
+
+
+def core_metadata(name: Text, version: Text, requirements: List[Text]) -> Text:
+	return f'Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n' + ''.join(f'Requires-Dist: {x}\n' for x in requirements)
+
+
+class FakeIndex:
+	"""Simple index serving a graph from a background thread, counting the requests it gets"""
+
+	def __init__(self, graph: Graph, metadata: bool = False) -> None:
+		self.graph = graph
+		self.metadata = metadata
+		self.requests = 0
+		self._lock = threading.Lock()
+		self._pages = {name: simple_page(name, graph[name], metadata) for name in graph}
+
+		index = self
+
+		class Handler(BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+
+			def log_message(self, *args) -> None:
+				pass
+
+			def do_GET(self) -> None:
+				with index._lock:
+					index.requests += 1
+				status, body = index.respond(self.path)
+				self.send_response(status)
+				self.send_header('Content-Type', 'text/html' if self.path.startswith('/simple/') else 'application/octet-stream')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+		self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+		self.server.daemon_threads = True
+		self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+	@property
+	def url(self) -> Text:
+		return f'http://127.0.0.1:{self.server.server_address[1]}/simple'
+
+	def respond(self, path: Text) -> Tuple[int, bytes]:
+		parts = path.split('/')
+		if path.startswith('/simple/') and parts[2] in self._pages:
+			return 200, self._pages[parts[2]]
+
+		if path.startswith('/files/'):
+			filename = parts[2]
+			if filename.endswith('.tar.gz.metadata') and self.metadata:
+				name, version = filename[:-len('.tar.gz.metadata')].rsplit('-', 1)
+				return 200, core_metadata(name, version, self.graph[name][version]).encode()
+			if filename.endswith('.tar.gz'):
+				name, version = filename[:-len('.tar.gz')].rsplit('-', 1)
+				return 200, sdist(name, version)
+
+		return 404, b''
+
+	def reset(self) -> None:
+		with self._lock:
+			self.requests = 0
+
+	def __enter__(self) -> FakeIndex:
+		self._thread.start()
+		return self
+
+	def __exit__(self, *args) -> None:
+		self.server.shutdown()
+		self.server.server_close()
+
+
+NIX_BUILD = '''
+import json, os, sys, time
+out = os.environ['STUB_OUT']
+with open(os.path.join(out, 'spawns'), 'a') as fp:
+	fp.write('nix-build\\n')
+time.sleep(float(os.environ.get('STUB_LATENCY', '0')))
+graph = json.load(open(os.environ['STUB_GRAPH']))
+args = sys.argv[1:]
+
+if 'environment' in args:
+	from packaging.markers import default_environment
+	path = os.path.join(out, 'environment.json')
+	json.dump(default_environment(), open(path, 'w'))
+	print(path)
+	sys.exit(0)
+
+names = [args[i + 2] for i, arg in enumerate(args) if arg == '--argstr' and args[i + 1] == 'name']
+for i, arg in enumerate(args):
+	if arg == '--arg' and args[i + 1] == 'batch':
+		names.extend(candidate['name'] for candidate in json.load(open(args[i + 2])))
+
+for name_version in names:
+	name, version = name_version.rsplit('-', 1)
+	path = os.path.join(out, '%032x-%s-setup.py-metadata' % (abs(hash(name_version)), name_version))
+	json.dump({
+		'metadata': {'name': name, 'version': version},
+		'requirements': {'install': graph[name][version], 'setup': [], 'test': [], 'extras': {}},
+	}, open(path, 'w'))
+	print(path)
+'''
+
+NIX_PREFETCH_URL = '''
+import os, sys, time
+with open(os.path.join(os.environ['STUB_OUT'], 'spawns'), 'a') as fp:
+	fp.write('nix-prefetch-url\\n')
+time.sleep(float(os.environ.get('STUB_LATENCY', '0')))
+print('0' * 52)
+print('/nix/store/' + '0' * 32 + '-' + os.path.basename(sys.argv[-2] if len(sys.argv) > 2 else sys.argv[-1]))
+'''
+
+NIX_HASH = '''
+import os, time
+with open(os.path.join(os.environ['STUB_OUT'], 'spawns'), 'a') as fp:
+	fp.write('nix-hash\\n')
+time.sleep(float(os.environ.get('STUB_LATENCY', '0')))
+print('0' * 103)
+'''
+
+NIX = '''
+print('max-jobs = 4')
+'''
+
+STUBS = {
+	'nix-build': NIX_BUILD,
+	'nix-prefetch-url': NIX_PREFETCH_URL,
+	'nix-hash': NIX_HASH,
+	'nix': NIX,
+}
+
+
+def write_stub_tools(directory: Text) -> None:
+	"""put executables named like nix tools into directory, they read STUB_GRAPH, STUB_OUT and STUB_LATENCY"""
+	os.makedirs(directory, exist_ok=True)
+	for name, source in STUBS.items():
+		path = os.path.join(directory, name)
+		with open(path, 'w') as fp:
+			fp.write(f'#!{sys.executable}\n{source.lstrip()}')
+		os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def spawns(out: Text) -> int:
+	"""number of stub tool processes started since out was created"""
+	try:
+		with open(os.path.join(out, 'spawns')) as fp:
+			return len(fp.read().split())
+	except FileNotFoundError:
+		return 0
+
+
+def save_graph(graph: Graph, filename: Text) -> None:
+	with open(filename, 'w') as fp:
+		json.dump(graph, fp)
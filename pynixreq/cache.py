@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Text
+
+from packaging.utils import canonicalize_name
+from .data import Candidate, CandidateInfo
+
+# entries written in another format are fetched again, 2: all wheels of a release are kept
+INDEX_FORMAT = 2
+# format of metadata rows, part of their mode along with the version of the metadata extractor
+METADATA_FORMAT = 1
+
+
+def default_cache_dir() -> Text:
+	return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'pynixreq')
+
+
+def write_atomic(filename: Text, data: Any) -> None:
+	"""write JSON data so concurrent readers never see a partially written file"""
+	directory = os.path.dirname(filename)
+	os.makedirs(directory, exist_ok=True)
+
+	fd, tmp_name = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+	try:
+		with os.fdopen(fd, 'w') as fp:
+			json.dump(data, fp, sort_keys=True)
+		os.replace(tmp_name, filename)
+	except BaseException:
+		os.unlink(tmp_name)
+		raise
+
+
+@dataclass
+class IndexEntry:
+	"""parsed simple-index page together with the validators needed to revalidate it"""
+	url: Text
+	candidates: Dict[Text, Candidate]
+	etag: Optional[Text] = None
+	last_modified: Optional[Text] = None
+	fetched: float = 0.0
+
+	def is_fresh(self, ttl: float) -> bool:
+		return time.time() - self.fetched < ttl
+
+	def to_json(self) -> Dict[Text, Any]:
+		return {
+			'format': INDEX_FORMAT,
+			'url': self.url,
+			'etag': self.etag,
+			'last_modified': self.last_modified,
+			'fetched': self.fetched,
+			'candidates': [candidate.to_json() for candidate in self.candidates.values()],
+		}
+
+	@classmethod
+	def from_json(cls, data: Dict[Text, Any]) -> IndexEntry:
+		if data.get('format') != INDEX_FORMAT:
+			raise ValueError(f'Index cache entry has format {data.get("format")}')
+		candidates = (Candidate.from_json(candidate) for candidate in data['candidates'])
+		return cls(data['url'], {candidate.raw_version: candidate for candidate in candidates}, data['etag'], data['last_modified'], data['fetched'])
+
+
+class IndexCache:
+	"""On-disk cache of simple-index pages keyed by index URL and canonical project name"""
+
+	def __init__(self, directory: Text, ttl: float = 0) -> None:
+		self.directory = os.path.join(directory, 'index')
+		self.ttl = ttl
+
+	def _filename(self, index_url: Text, name: Text) -> Text:
+		key = hashlib.sha256(f'{index_url.rstrip("/")}\0{canonicalize_name(name)}'.encode()).hexdigest()
+		return os.path.join(self.directory, key[:2], f'{key}.json')
+
+	def get(self, index_url: Text, name: Text) -> Optional[IndexEntry]:
+		try:
+			with open(self._filename(index_url, name)) as fp:
+				return IndexEntry.from_json(json.load(fp))
+		except (OSError, ValueError, KeyError):
+			return None
+
+	def put(self, index_url: Text, name: Text, entry: IndexEntry) -> None:
+		write_atomic(self._filename(index_url, name), entry.to_json())
+
+	def touch(self, index_url: Text, name: Text, entry: IndexEntry) -> None:
+		"""mark entry as revalidated by the index"""
+		entry.fetched = time.time()
+		self.put(index_url, name, entry)
+
+
+class MetadataCache:
+	"""Persistent store of candidate metadata keyed by sdist hash, python target and metadata mode
+
+	Rows are stored under the version of the code which extracted the metadata, so metadata
+	extracted by older code isn't used.
+
+	The database is used in WAL mode, so several pynixreq processes can share it."""
+
+	def __init__(self, directory: Text) -> None:
+		os.makedirs(directory, exist_ok=True)
+
+		self.connection = sqlite3.connect(os.path.join(directory, 'metadata.sqlite'), timeout=60, isolation_level=None)
+		self.connection.execute('PRAGMA journal_mode=WAL')
+		self.connection.execute('CREATE TABLE IF NOT EXISTS metadata (hash TEXT, python TEXT, mode TEXT, info TEXT, PRIMARY KEY (hash, python, mode))')
+
+	@staticmethod
+	def _key(candidate: Candidate) -> Optional[Text]:
+		if candidate.hash_type is None or candidate.hash is None:
+			return None
+
+		return f'{candidate.hash_type}:{candidate.hash}'
+
+	@staticmethod
+	def _mode(mode: Text, version: Text) -> Text:
+		return f'{mode}:{version}:{METADATA_FORMAT}'
+
+	def get(self, candidate: Candidate, python_version: Text, mode: Text, version: Text) -> Optional[CandidateInfo]:
+		key = self._key(candidate)
+		if key is None:
+			return None
+
+		row = self.connection.execute('SELECT info FROM metadata WHERE hash = ? AND python = ? AND mode = ?', (key, python_version, self._mode(mode, version))).fetchone()
+		return CandidateInfo.from_json(json.loads(row[0])) if row else None
+
+	def put(self, candidate: Candidate, python_version: Text, mode: Text, version: Text, info: CandidateInfo) -> None:
+		key = self._key(candidate)
+		if key is None:
+			return
+
+		self.connection.execute('INSERT OR REPLACE INTO metadata (hash, python, mode, info) VALUES (?, ?, ?, ?)',
+			(key, python_version, self._mode(mode, version), json.dumps(info.to_json(), sort_keys=True)))
+
+	def close(self) -> None:
+		self.connection.close()
+
+
+class HashCache:
+	"""Persistent map of source URLs to hashes computed by downloading them
+
+	Entries remember the hash published by the index, so a file replaced on the index is
+	hashed again."""
+
+	def __init__(self, directory: Text) -> None:
+		os.makedirs(directory, exist_ok=True)
+
+		self.connection = sqlite3.connect(os.path.join(directory, 'hashes.sqlite'), timeout=60, isolation_level=None)
+		self.connection.execute('PRAGMA journal_mode=WAL')
+		self.connection.execute('CREATE TABLE IF NOT EXISTS hashes (url TEXT PRIMARY KEY, source TEXT, hashes TEXT)')
+
+	def get(self, url: Text, source: Text) -> Optional[Dict[Text, Text]]:
+		row = self.connection.execute('SELECT source, hashes FROM hashes WHERE url = ?', (url,)).fetchone()
+		return json.loads(row[1]) if row and row[0] == source else None
+
+	def put(self, url: Text, source: Text, hashes: Dict[Text, Text]) -> None:
+		self.connection.execute('INSERT OR REPLACE INTO hashes (url, source, hashes) VALUES (?, ?, ?)', (url, source, json.dumps(hashes, sort_keys=True)))
+
+	def close(self) -> None:
+		self.connection.close()
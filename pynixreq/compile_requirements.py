@@ -1,80 +1,140 @@
 from __future__ import annotations
 
+import asyncio
+import logging
 from logging import getLogger
-from typing import Dict, FrozenSet, Generator, Iterable, Iterator, Set, Text
+from typing import Any, Awaitable, Dict, FrozenSet, Generator, Iterable, Iterator, List, Optional, Set, Text, TypeVar
 
+from packaging.specifiers import SpecifierSet
 from packaging.version import Version
 
-from . import nix
-from .data import Candidate, CandidateInfo, Dependency, DependencyMode, PackageTuple, RequirementWrapper, TargetDetails
-from .pypi import PyPI
+from . import trace
+from .constraints import ROOT, ConstraintIndex
+from .context import SharedContext
+from .data import Candidate, CandidateInfo, DependencyMode, PackageTuple, RequirementWrapper, TargetDetails
+from .lock import Lock
+from .metadata import MetadataProvider, NixBuildProvider
+from .resolver import Resolver
+from .versions import VersionTable
 
 BLOCKED_HASHES = ['md5']
 
+T = TypeVar('T')
+
 log = getLogger(__name__)
 
 
 class DependencySolver:
-	def __init__(self, requirements: Iterable[RequirementWrapper], target: TargetDetails) -> None:
+	def __init__(self, requirements: Iterable[RequirementWrapper], target: TargetDetails, config: Optional[Dict[str, Any]] = None, context: Optional[SharedContext] = None) -> None:
 		self.starting_requirements = frozenset(requirements)
 		self.target = target
+		self.config = config or {}
+		# solvers of other targets resolved in the same run share the context
+		self.context = context or SharedContext(self.config)
 
 		self._requirements: Dict[Text, PackageTuple] = {}
+		self.constraints = ConstraintIndex()
+		self._unpicked: Set[Text] = set()
 
-		self.pypi = PyPI({})
+		self.pypi = self.context.pypi
 		self.environment: Dict[Text, Text] = None
+		self.nix = self.context.nix
 
-		self._versions: Dict[Text, Dict[Version, Candidate]] = {}
+		self._versions: Dict[Text, VersionTable] = {}
 		self._candidates: Dict[Text, Dict[Version, CandidateInfo]] = {}
-		self._dependencies: Dict[Text, Dependency] = {}
+
+		self.metadata_cache = self.context.metadata_cache
+		self.hasher = self.context.hasher
+		self.metadata_providers: List[MetadataProvider] = []
+		self.metadata_requests = 0
+		# candidates of this solver each provider returned metadata of, providers are shared by solvers
+		self.metadata_provided: Dict[Text, int] = {}
+		self.metadata_builds = 0
+
+		# pins of the previous resolution, packages in _unlocked are resolved again
+		self.lock: Optional[Lock] = self.config.get('lock')
+		self._unlocked: Set[Text] = set()
 
 	async def initialize(self):
 		assert self.environment is None
 		self.environment = await self._get_environment()
+		self.metadata_providers = self._create_metadata_providers()
 		self.starting_requirements = frozenset(self._evaluate_markers(self.starting_requirements))
+		self._add_constraints(ROOT, None, self.starting_requirements)
+
+		if self.lock is not None:
+			self._unlocked = self.lock.unlocked(self.starting_requirements)
+			log.info('Using %d pins of the lock file, %d packages are resolved again', len(self.lock.packages) - len(self._unlocked), len(self._unlocked))
+
+	def _add_constraints(self, requester: Text, version: Optional[Version], requirements: Iterable[RequirementWrapper]) -> None:
+		for requirement in requirements:
+			self.constraints.add(requester, version, requirement)
+			if requirement.key not in self._requirements:
+				self._unpicked.add(requirement.key)
 
 	@property
 	def requirements(self) -> FrozenSet[RequirementWrapper]:
 		assert self.environment is not None
-		requirements = {}
+		return self.constraints.requirements()
 
-		for requirement in self.starting_requirements:
-			if requirement.key in requirements:
-				requirements[requirement.key] &= requirement
-			else:
-				requirements[requirement.key] = requirement
-
-		for package_tuple in self._requirements.values():
-			for requirement in package_tuple.requirements:
-				if not requirement.key in requirements:
-					requirements[requirement.key] = requirement
-					continue
-
-				requirements[requirement.key] &= requirement
-
-		return frozenset(requirements.values())
+	@property
+	def packages(self) -> Dict[Text, PackageTuple]:
+		return self._requirements
 
 	@property
 	def candidates(self):
 		return [candidate.candidate for candidate in self._requirements.values()]
 
+	def _create_metadata_providers(self) -> List[MetadataProvider]:
+		providers: List[MetadataProvider] = []
+
+		# published metadata doesn't contain setup and test requirements
+		if not self.config.get('build-metadata') and not self.target.mode & (DependencyMode.SETUP | DependencyMode.TEST):
+			providers.extend(self.context.published_metadata_providers(self.target.python_version, self.environment))
+
+		providers.append(self.context.nix_metadata_provider(self.target.python_version, self.config.get('nix-batch-size', 1)))
+		return providers
+
 	async def _get_environment(self) -> Dict[Text, Text]:
-		return await nix.get_environment(self.target.python_version)
+		return await self.context.get_environment(self.target.python_version)
 
 	def _evaluate_markers(self, requirements: Iterable[RequirementWrapper]) -> Iterator[RequirementWrapper]:
 		"""Remove all requirements that don't classify according to markers"""
 		assert self.environment is not None
 		return (x for x in requirements if not x.marker or x.marker.evaluate(self.environment))
 
-	async def _pick_package_version(self, requirement: RequirementWrapper) -> Generator[Candidate, None, None]:
-		candidates = await self.pypi.get_package_versions(requirement.name)
+	async def get_version_table(self, requirement: RequirementWrapper, complete: bool = False) -> VersionTable:
+		"""return candidates of a project sorted by version, the index is only asked once
 
-		for candidate in sorted(candidates.values(), reverse=True):
-			if not self.target.pre_release and (candidate.version.is_devrelease or candidate.version.is_prerelease):
-				continue
+		Pinned packages get a table with just the pin until a complete one is requested."""
+		table = self._versions.get(requirement.key)
+		if table is not None and (table.complete or not complete):
+			return table
+
+		pinned = self.lock.pinned(requirement.key) if self.lock is not None and requirement.key not in self._unlocked else None
+		if pinned is not None and not complete:
+			table = VersionTable([pinned], complete=False)
+		else:
+			candidates = await self.context.get_package_versions(requirement.name)
+			if pinned is not None and pinned.raw_version in candidates:
+				# metadata of the pinned version is still known
+				candidates[pinned.raw_version].info = candidates[pinned.raw_version].info or pinned.info
+			table = VersionTable(candidates.values())
 
-			if requirement.specifier.contains(candidate.version):
-				yield candidate
+		self._versions[requirement.key] = table
+		return table
+
+	def matching_candidates(self, table: VersionTable, specifier: SpecifierSet) -> List[Candidate]:
+		return table.matching(specifier, allow_prereleases=self.target.pre_release)
+
+	async def _pick_package_version(self, requirement: RequirementWrapper) -> Generator[Candidate, None, None]:
+		table = await self.get_version_table(requirement)
+		candidates = self.matching_candidates(table, requirement.specifier)
+		if not candidates and not table.complete:
+			candidates = self.matching_candidates(await self.get_version_table(requirement, complete=True), requirement.specifier)
+
+		for candidate in candidates:
+			yield candidate
 
 	def _get_dependencies(self, requirement: RequirementWrapper, candidate_info: CandidateInfo) -> FrozenSet[RequirementWrapper]:
 		new_dependencies = set()  # type: Set[RequirementWrapper]
@@ -96,60 +156,149 @@ class DependencySolver:
 
 		return frozenset(self._evaluate_markers(new_dependencies))
 
+	async def _gather(self, coroutines: List[Awaitable[T]]) -> List[T]:
+		"""await coroutines concurrently, or one after another in serial mode"""
+		if self.config.get('serial'):
+			return [await coroutine for coroutine in coroutines]
+
+		return await asyncio.gather(*coroutines)
+
+	async def _fix_hash(self, candidate: Candidate) -> None:
+		"""make sure the candidate has an usable hash"""
+		if candidate.hash is None:
+			# find-links candidates are hashed once they are needed
+			log.debug('Candidate %s %s has no hash; calculating one ...', candidate.name, candidate.version)
+			hash_type, hash = await self.hasher.nix_hash(candidate)
+			candidate.update_hash(hash_type, hash)
+		elif candidate.hash_type in BLOCKED_HASHES:
+			log.info('Candidate %s %s has blacklisted hash: %s; calculating a new one ...', candidate.name, candidate.version, candidate.hash_type)
+			hash_type, hash = await self.hasher.nix_hash(candidate)
+			candidate.update_hash(hash_type, hash)
+
+	async def _pick_candidate(self, requirement: RequirementWrapper) -> Optional[Candidate]:
+		"""pick a candidate for the requirement and make sure it has an usable hash"""
+		log.debug('Processing requirement: %s', requirement.name)
+		async for candidate in self._pick_package_version(requirement):
+			log.debug('Picked version: %s %s', candidate.name, candidate.version)
+			await self._fix_hash(candidate)
+			return candidate
+
+		return None
+
 	async def run_once(self):
 		assert self.environment is not None
 		changed = False
 
-		requirements = sorted(self._evaluate_markers(self.requirements), key=lambda x: x.key)
+		if log.isEnabledFor(logging.DEBUG):
+			log.debug("Current constraints:")
+			for key in sorted(self.constraints):
+				selected = self._requirements[key].candidate.version if key in self._requirements else 'not selected yet'
+				log.debug('  %s [%s]', self.constraints.requirement(key), selected)
 
-		log.debug("Current constraints:")
-		for requirement in requirements:
-			selected = self._requirements[requirement.key].candidate.version if requirement.key in self._requirements else 'not selected yet'
-			log.debug('  %s [%s]', requirement, selected)
-
-		for requirement in requirements:
-			if requirement.key in self._requirements:
-				continue
+		# Every requirement in a pass is resolved against the same set of constraints, so the
+		# frontier can be processed concurrently and merged in sorted order afterwards.
+		frontier = [self.constraints.requirement(key) for key in sorted(self._unpicked)]
 
-			log.debug('Processing requirement: %s', requirement.name)
-			async for candidate in self._pick_package_version(requirement):
-				log.debug('Picked version: %s', candidate.version)
-				if candidate.hash_type in BLOCKED_HASHES:
-					log.info('Candidate %s %s has blacklisted hash: %s; calculating a new one ...', candidate.name, candidate.version, candidate.hash_type)
-					hash_type, hash, _ = await nix.nix_hash(candidate)
-					candidate.update_hash(hash_type, hash)
+		picked = await self._gather([self._pick_candidate(requirement) for requirement in frontier])
+		selected = [(requirement, candidate) for requirement, candidate in zip(frontier, picked) if candidate is not None]
+		candidates_info = await self.get_candidates_info([candidate for _, candidate in selected])
 
-				candidate_info = await nix.get_package_dependencies(self.target.python_version, candidate)
-				dependencies = self._get_dependencies(requirement, candidate_info)
+		for (requirement, candidate), candidate_info in zip(selected, candidates_info):
+			dependencies = self._get_dependencies(requirement, candidate_info)
 
-				self._requirements[requirement.key] = PackageTuple(candidate, dependencies)
-				if dependencies:
-					log.debug('New dependencies: %s', ", ".join(sorted(map(lambda x: str(x), dependencies))))
-					changed = True
-				break
+			self._requirements[requirement.key] = PackageTuple(candidate, dependencies)
+			self._unpicked.discard(requirement.key)
+			self._add_constraints(requirement.key, candidate.version, dependencies)
+			if dependencies:
+				log.debug('New dependencies of %s: %s', requirement.name, ", ".join(sorted(map(lambda x: str(x), dependencies))))
+				changed = True
 
 		return changed
 
+	def _get_known_metadata(self, candidate: Candidate) -> Optional[CandidateInfo]:
+		"""return metadata of a candidate if it was already obtained in this or an earlier run"""
+		if candidate.info is None:
+			candidate.info = self._candidates.get(candidate.name, {}).get(candidate.version)
+
+		if candidate.info is None and self.metadata_cache:
+			for mode, version in dict.fromkeys((provider.mode, provider.version) for provider in self.metadata_providers):
+				candidate_info = self.metadata_cache.get(candidate, self.target.python_version, mode, version)
+				if candidate_info is not None:
+					log.debug('Using cached metadata of %s %s', candidate.name, candidate.version)
+					self._remember_metadata(candidate, candidate_info)
+					break
+
+		return candidate.info
+
+	def _remember_metadata(self, candidate: Candidate, candidate_info: CandidateInfo, provider: Optional[MetadataProvider] = None) -> None:
+		self._candidates.setdefault(candidate.name, {})[candidate.version] = candidate_info
+		candidate.info = candidate_info
+
+		if provider is not None and self.metadata_cache:
+			self.metadata_cache.put(candidate, self.target.python_version, provider.mode, provider.version, candidate_info)
+
 	async def get_candidate_info(self, candidate: Candidate) -> CandidateInfo:
-		"""run setup.py of a candidate to obtain its dependencies"""
+		"""obtain dependencies of a candidate"""
+		return (await self.get_candidates_info([candidate]))[0]
+
+	async def get_candidates_info(self, candidates: List[Candidate]) -> List[CandidateInfo]:
+		"""obtain dependencies of several candidates, asking metadata providers in order"""
+		missing = [candidate for candidate in candidates if self._get_known_metadata(candidate) is None]
+		self.metadata_requests += len(missing)
+
+		for provider in self.metadata_providers:
+			accepted = [candidate for candidate in missing if provider.accepts(candidate)]
+			if isinstance(provider, NixBuildProvider):
+				# fetchurl refuses md5, the sdist needs its usable hash before it is built
+				await self._gather([self._fix_hash(candidate) for candidate in accepted])
+				# metadata is cached under the new hash
+				accepted = [candidate for candidate in accepted if self._get_known_metadata(candidate) is None]
+				missing = [candidate for candidate in missing if candidate.info is None]
+			if not accepted:
+				continue
 
-		if candidate.info is None:
-			if candidate.name not in self._candidates:
-				self._candidates[candidate.name] = {}
+			with trace.span('metadata', provider=provider.name, python=self.target.python_version, candidates=len(accepted)):
+				candidates_info = await provider.get_many(accepted)
 
-			if candidate.version not in self._candidates[candidate.name]:
-				self._candidates[candidate.name][candidate.version] = await nix.get_package_dependencies(self.target.python_version, candidate)
+			for candidate, candidate_info in zip(accepted, candidates_info):
+				if candidate_info is not None:
+					log.debug('Obtained metadata of %s %s from %s', candidate.name, candidate.version, provider.name)
+					self._remember_metadata(candidate, candidate_info, provider)
 
-			candidate.info = self._candidates[candidate.name][candidate.version]
+			provided = sum(1 for candidate_info in candidates_info if candidate_info is not None)
+			self.metadata_provided[provider.name] = self.metadata_provided.get(provider.name, 0) + provided
+			if isinstance(provider, NixBuildProvider):
+				self.metadata_builds += provided
 
-		return candidate.info
+			missing = [candidate for candidate in missing if candidate.info is None]
 
-	async def run(self):
-		await self.initialize()
+		assert not missing, "Last metadata provider is expected to either succeed or raise an exception"
+		return [candidate.info for candidate in candidates]
 
+	async def run_greedy(self):
+		"""pick the newest matching candidate of every requirement until no new requirements appear"""
 		run = 0
 		while True:
 			run += 1
 			log.info(f'Run #{run}')
-			if not await self.run_once():
-				break
+			with trace.span('solver.pass', python=self.target.python_version, number=run, unpicked=len(self._unpicked)):
+				if not await self.run_once():
+					break
+
+	async def run_backtracking(self):
+		"""resolve requirements with the backtracking resolver, revisiting choices which lead to conflicts"""
+		self._requirements = await Resolver(self).resolve(self._evaluate_markers(self.starting_requirements))
+		await self._gather([self._fix_hash(candidate) for candidate in self.candidates])
+
+	async def run(self):
+		with trace.span('solver.run', python=self.target.python_version):
+			await self.initialize()
+
+			if self.config.get('greedy'):
+				await self.run_greedy()
+			else:
+				await self.run_backtracking()
+
+		log.info('Selected %d packages for python%s, metadata of %d candidates was requested, %d metadata builds were needed', len(self._requirements), self.target.python_version, self.metadata_requests, self.metadata_builds)
+		for provider in self.metadata_providers:
+			log.info('  metadata from %s: %d', provider.name, self.metadata_provided.get(provider.name, 0))
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from typing import Dict, FrozenSet, Iterator, Optional, Text
+
+from packaging.version import Version
+
+from .data import Dependency, RequirementWrapper
+
+# requester of the starting requirements
+ROOT = ''
+
+
+class ConstraintIndex:
+	"""Requirements of all requesters merged per package
+
+	The index is keyed by canonical package name and is updated one requirement at a time, so
+	picking or dropping a candidate only touches the edges it adds or removes. The combined
+	specifier of a package is maintained by its Dependency and available without walking the
+	graph."""
+
+	def __init__(self) -> None:
+		self._dependencies: Dict[Text, Dependency] = {}
+
+	def __contains__(self, key: Text) -> bool:
+		return key in self._dependencies
+
+	def __iter__(self) -> Iterator[Text]:
+		return iter(self._dependencies)
+
+	def __len__(self) -> int:
+		return len(self._dependencies)
+
+	def __getitem__(self, key: Text) -> Dependency:
+		return self._dependencies[key]
+
+	def get(self, key: Text) -> Optional[Dependency]:
+		return self._dependencies.get(key)
+
+	def items(self):
+		return self._dependencies.items()
+
+	def add(self, requester: Text, version: Optional[Version], requirement: RequirementWrapper) -> Dependency:
+		"""record requirement of a requester, requirements of a requester on the same package are merged"""
+		dependency = self._dependencies.get(requirement.key)
+		if dependency is None:
+			dependency = self._dependencies[requirement.key] = Dependency(requirement.name, {})
+
+		if requester in dependency.specifiers:
+			_, specifier = dependency.specifiers[requester]
+			extras = dependency.extras.get(requester, frozenset())
+			dependency.remove_specifiers(requester)
+			dependency.add_specifiers(requester, version, specifier & requirement.specifier, extras | requirement.extras)
+		else:
+			dependency.add_specifiers(requester, version, requirement.specifier, requirement.extras)
+
+		return dependency
+
+	def remove(self, requester: Text, key: Text) -> None:
+		"""drop requirement of a requester, the package is forgotten once nothing requires it"""
+		dependency = self._dependencies[key]
+		dependency.remove_specifiers(requester)
+		if not dependency.specifiers:
+			del self._dependencies[key]
+
+	def requirement(self, key: Text) -> RequirementWrapper:
+		"""requirement combining constraints of all requesters"""
+		dependency = self._dependencies[key]
+		return RequirementWrapper(dependency.name, None, dependency.combined_extras, dependency.combined_specifiers, None)
+
+	def requirements(self) -> FrozenSet[RequirementWrapper]:
+		return frozenset(self.requirement(key) for key in self._dependencies)
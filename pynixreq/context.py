@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import time
+from typing import Any, Dict, List, Optional, Text, Tuple
+
+from . import nix
+from .cache import HashCache, MetadataCache, default_cache_dir
+from .data import Candidate, canonical_name
+from .hashing import SourceHasher
+from .metadata import CoreMetadataProvider, JSONAPIProvider, MetadataProvider, NixBuildProvider, WheelMetadataProvider
+from .pypi import PyPI
+
+
+class SharedContext:
+	"""Connections, caches and fetched data shared by solvers of all targets of a run
+
+	Index pages are fetched once per project and every solver gets its own copies of the
+	candidates, as metadata built by nix depends on the python version. So does the wheel
+	metadata is read from, providers of it are shared by solvers of a python version, while
+	the JSON API is asked once for all of them. Marker environments and metadata built by nix
+	are kept per python version, which lets a daemon answer later requests from memory."""
+
+	def __init__(self, config: Optional[Dict[str, Any]] = None) -> None:
+		config = config or {}
+
+		self.pypi = PyPI(config)
+		self.nix = nix.NixExecutor(config.get('nix-jobs'), config.get('nix-timeout'))
+
+		self.metadata_cache: Optional[MetadataCache] = None
+		hash_cache: Optional[HashCache] = None
+		if not config.get('no-cache'):
+			self.metadata_cache = MetadataCache(config.get('cache-dir') or default_cache_dir())
+			hash_cache = HashCache(config.get('cache-dir') or default_cache_dir())
+		self.hasher = SourceHasher(self.pypi.http, hash_cache)
+
+		self._json_api: Optional[JSONAPIProvider] = None
+		self._published_metadata: Dict[Text, List[MetadataProvider]] = {}
+		self._nix_metadata: Dict[Tuple[Text, int], NixBuildProvider] = {}
+		self._environments: Dict[Text, asyncio.Future] = {}
+		# index pages fetched in this run, a long running process refetches them after index-ttl seconds
+		self.index_ttl: Optional[float] = config.get('index-ttl')
+		self._versions: Dict[Text, Tuple[float, asyncio.Future]] = {}
+
+	def published_metadata_providers(self, python_version: Text, environment: Dict[Text, Text]) -> List[MetadataProvider]:
+		"""providers of published metadata, wheels are chosen by the marker environment of a python version"""
+		if self._json_api is None:
+			self._json_api = JSONAPIProvider(self.pypi)
+		if python_version not in self._published_metadata:
+			self._published_metadata[python_version] = [
+				CoreMetadataProvider(self.pypi, environment),
+				self._json_api,
+				WheelMetadataProvider(self.pypi, environment),
+			]
+		return self._published_metadata[python_version]
+
+	def nix_metadata_provider(self, python_version: Text, batch_size: int = 1) -> NixBuildProvider:
+		"""provider of metadata built by nix for a python version"""
+		key = (python_version, batch_size)
+		if key not in self._nix_metadata:
+			self._nix_metadata[key] = NixBuildProvider(python_version, self.nix, batch_size)
+		return self._nix_metadata[key]
+
+	@property
+	def projects(self) -> int:
+		"""number of projects whose index pages were asked for"""
+		return len(self._versions)
+
+	async def get_environment(self, python_version: Text) -> Dict[Text, Text]:
+		"""marker environment of a python version, built by nix once"""
+		future = self._environments.get(python_version)
+		if future is None or (future.done() and future.exception() is not None):
+			future = self._environments[python_version] = asyncio.ensure_future(nix.get_environment(self.nix, python_version))
+
+		return dict(await asyncio.shield(future))
+
+	async def get_package_versions(self, name: Text) -> Dict[Text, Candidate]:
+		"""candidates of a project from the index, fetched once however many solvers ask"""
+		key = canonical_name(name)
+		fetched, future = self._versions.get(key, (0.0, None))
+		if future is None or (future.done() and (future.exception() is not None or self._expired(fetched))):
+			fetched, future = self._versions[key] = time.monotonic(), asyncio.ensure_future(self.pypi.get_package_versions(name))
+
+		candidates = await asyncio.shield(future)
+		return {version: dataclasses.replace(candidate) for version, candidate in candidates.items()}
+
+	async def close(self) -> None:
+		await self.pypi.http.close()
+
+	def _expired(self, fetched: float) -> bool:
+		return self.index_ttl is not None and time.monotonic() - fetched > self.index_ttl
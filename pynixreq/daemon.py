@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import json
+import os
+import signal
+import tempfile
+from argparse import ArgumentParser
+from logging import getLogger
+from typing import Any, Dict, List, Optional, Text
+
+from .compile_requirements import DependencySolver
+from .context import SharedContext
+from .data import RequirementWrapper, TargetDetails
+from .exceptions import PyNixReqError
+from .main import add_resolver_arguments, config_from_arguments, generate
+
+# index pages older than this are fetched again by the daemon
+DEFAULT_INDEX_TTL = 600
+WATCH_INTERVAL = 1.0
+
+log = getLogger(__name__)
+
+
+def string_list(message: Dict[Text, Any], key: Text) -> Optional[List[Text]]:
+	"""value of a request field holding a list of strings, None if it is missing"""
+	value = message.get(key)
+	if value is not None and not (isinstance(value, list) and all(isinstance(x, str) for x in value)):
+		raise ValueError(f'{key!r} has to be a list of strings')
+
+	return value
+
+
+def default_socket() -> Text:
+	directory = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+	return os.path.join(directory, f'pynixreq-{os.getuid()}.sock')
+
+
+async def request(path: Text, message: Dict[Text, Any]) -> Dict[Text, Any]:
+	"""send a request to the daemon listening on path and return its response"""
+	reader, writer = await asyncio.open_unix_connection(path)
+	try:
+		writer.write(json.dumps(message).encode() + b'\n')
+		await writer.drain()
+		line = await reader.readline()
+	finally:
+		writer.close()
+
+	return json.loads(line) if line else {'error': 'daemon closed the connection'}
+
+
+class Daemon:
+	"""Answers resolve requests over a unix socket with caches kept warm between them
+
+	Marker environments, index pages and metadata stay in the SharedContext of the daemon,
+	every request gets fresh solvers. Requests and responses are JSON objects, one per line:
+
+		{"command": "resolve", "requirements": ["aiohttp~=3.3"], "python": ["37"]}
+		{"command": "generate", "directory": "/path/to/project", "python": ["37"], "upgrade": false}
+		{"command": "status"}
+		{"command": "shutdown"}"""
+
+	def __init__(self, config: Dict[Text, Any], python_versions: Optional[List[Text]] = None) -> None:
+		self.config = config
+		self.python_versions = python_versions or []
+		self.context = SharedContext(config)
+		self.requests = 0
+
+		self._stop = asyncio.Event()
+		# generating a project twice at the same time would interleave writes of its files
+		self._generating: Dict[Text, asyncio.Lock] = {}
+
+	def _requested_versions(self, message: Dict[Text, Any]) -> List[Text]:
+		python_versions = string_list(message, 'python') or self.python_versions
+		if not python_versions:
+			raise ValueError('python versions are neither in the request nor given to the daemon')
+
+		return python_versions
+
+	async def resolve(self, requirements: List[Text], python_versions: List[Text]) -> Dict[Text, Any]:
+		wrappers = [RequirementWrapper.from_requirement(requirement) for requirement in requirements]
+		solvers = [DependencySolver(wrappers, TargetDetails(python_version), self.config, self.context) for python_version in dict.fromkeys(python_versions)]
+		await asyncio.gather(*(solver.run() for solver in solvers))
+
+		return {
+			solver.target.python_version: {
+				key: {
+					'name': package.candidate.name,
+					'version': str(package.candidate.version),
+					'url': package.candidate.url,
+					'hash_type': package.candidate.hash_type,
+					'hash': package.candidate.hash,
+				} for key, package in sorted(solver.packages.items())
+			} for solver in solvers
+		}
+
+	async def generate(self, directory: Text, python_versions: List[Text], upgrade: bool = False) -> List[Text]:
+		directory = os.path.abspath(directory)
+		lock = self._generating.setdefault(directory, asyncio.Lock())
+		async with lock:
+			return await generate(directory, python_versions, self.config, self.context, upgrade)
+
+	async def handle(self, message: Any) -> Dict[Text, Any]:
+		if not isinstance(message, dict):
+			raise ValueError('Request has to be a JSON object')
+
+		command = message.get('command')
+		if command == 'resolve':
+			requirements = string_list(message, 'requirements')
+			if requirements is None:
+				raise ValueError("'requirements' is missing")
+			return {'packages': await self.resolve(requirements, self._requested_versions(message))}
+		if command == 'generate':
+			directory, upgrade = message.get('directory'), message.get('upgrade', False)
+			if not isinstance(directory, str):
+				raise ValueError("'directory' has to be a string")
+			if not isinstance(upgrade, bool):
+				raise ValueError("'upgrade' has to be a boolean")
+			return {'files': await self.generate(directory, self._requested_versions(message), upgrade)}
+		if command == 'status':
+			return {'requests': self.requests, 'projects': self.context.projects, 'nix_spawned': self.context.nix.spawned, 'http': dataclasses.asdict(self.context.pypi.http.stats)}
+		if command == 'shutdown':
+			self._stop.set()
+			return {}
+
+		raise ValueError(f'Unknown command {command!r}')
+
+	async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+		try:
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+
+				self.requests += 1
+				try:
+					response = await self.handle(json.loads(line))
+				except asyncio.CancelledError:
+					raise
+				except (PyNixReqError, ValueError, KeyError, OSError) as e:
+					log.error('Request failed: %s', e)
+					response = {'error': f'{type(e).__name__}: {e}'}
+				except Exception as e:
+					# a bug hit by one request must not take down the connection, let alone the daemon
+					log.exception('Request failed')
+					response = {'error': f'{type(e).__name__}: {e}'}
+
+				writer.write(json.dumps(response).encode() + b'\n')
+				await writer.drain()
+		finally:
+			writer.close()
+
+	async def watch(self, directory: Text, interval: float = WATCH_INTERVAL) -> None:
+		"""regenerate requirements of a project whenever its setup.cfg changes"""
+		filename = os.path.join(directory, 'setup.cfg')
+		last_modified = None
+		while True:
+			try:
+				modified: Optional[int] = os.stat(filename).st_mtime_ns
+			except FileNotFoundError:
+				modified = None
+
+			if modified is not None and modified != last_modified:
+				last_modified = modified
+				try:
+					log.info('Generated %s', ', '.join(await self.generate(directory, self.python_versions)))
+				except Exception:
+					# an invalid setup.cfg being edited must not stop the daemon
+					log.exception('Generating requirements of %s failed', directory)
+
+			await asyncio.sleep(interval)
+
+	async def serve(self, path: Text, watch: List[Text], interval: float = WATCH_INTERVAL) -> None:
+		if os.path.exists(path):
+			try:
+				await request(path, {'command': 'status'})
+			except OSError:
+				os.unlink(path)  # left behind by a daemon which didn't exit cleanly
+			else:
+				raise PyNixReqError(f'Another daemon is listening on {path}')
+
+		server = await asyncio.start_unix_server(self._serve_client, path=path)
+		os.chmod(path, 0o600)
+		log.info('Listening on %s', path)
+
+		loop = asyncio.get_event_loop()
+		for signum in (signal.SIGINT, signal.SIGTERM):
+			loop.add_signal_handler(signum, self._stop.set)
+
+		watchers = [asyncio.ensure_future(self.watch(directory, interval)) for directory in watch]
+		try:
+			await self._stop.wait()
+		finally:
+			for watcher in watchers:
+				watcher.cancel()
+			server.close()
+			await server.wait_closed()
+			os.unlink(path)
+			await self.context.close()
+
+
+async def async_serve_cli(argv: List[Text]) -> None:
+	parser = ArgumentParser(prog='pynixreq serve', description='Resolve requirements for clients connecting to a unix socket')
+	parser.add_argument('--python-target', '-V', action='append', help='Python version used when a request has none, and by --watch')
+	parser.add_argument('--socket', default=default_socket(), help='Path of the unix socket (default: %(default)s)')
+	parser.add_argument('--watch', action='append', default=[], metavar='DIRECTORY', help='Regenerate requirements of the project whenever its setup.cfg changes')
+	parser.add_argument('--watch-interval', type=float, default=WATCH_INTERVAL, help='Seconds between checks of watched files')
+	parser.add_argument('--index-ttl', type=float, default=DEFAULT_INDEX_TTL, help='Seconds after which index pages held in memory are fetched again')
+	add_resolver_arguments(parser)
+	args = parser.parse_args(argv)
+
+	if args.watch and not args.python_target:
+		parser.error('--watch requires --python-target')
+
+	config = config_from_arguments(args)
+	config['index-ttl'] = args.index_ttl
+
+	await Daemon(config, args.python_target).serve(args.socket, args.watch, args.watch_interval)
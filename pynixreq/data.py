@@ -1,15 +1,50 @@
 from __future__ import annotations
 
-import re
-from dataclasses import dataclass, field, InitVar, replace
+import sys
+from dataclasses import dataclass, field, fields, InitVar, replace
 from enum import Flag, auto
-from functools import reduce
-from typing import Dict, Set, Text, Tuple, Type, List, FrozenSet, Optional
+from functools import lru_cache, reduce
+from typing import Any, Dict, Set, Text, Tuple, Type, List, FrozenSet, Optional
 
 from packaging.markers import Marker
 from packaging.requirements import Requirement
 from packaging.specifiers import SpecifierSet
-from packaging.version import Version
+from packaging.utils import canonicalize_name
+from packaging.version import Version, parse as version_parse
+
+# entries of the caches sharing parsed values, bounded so a long running daemon doesn't grow without limit
+INTERN_CACHE_SIZE = 2 ** 16
+
+
+@lru_cache(maxsize=INTERN_CACHE_SIZE)
+def parse_version(text: Text) -> Version:
+	"""parse version, sharing the result between all candidates with the same version string"""
+	return version_parse(text)
+
+
+@lru_cache(maxsize=INTERN_CACHE_SIZE)
+def parse_specifier(text: Text) -> SpecifierSet:
+	return SpecifierSet(text)
+
+
+@lru_cache(maxsize=INTERN_CACHE_SIZE)
+def canonical_name(name: Text) -> Text:
+	"""canonicalize_name of a project, equal keys are the same interned string"""
+	return sys.intern(canonicalize_name(name))
+
+
+def slotted(*extra: Text):
+	"""recreate a dataclass with __slots__ for its fields and extra attributes
+
+	Instances lose their __dict__, which adds up for the candidates and requirements of
+	large graphs. Python 3.10 does the same with dataclass(slots=True)."""
+	def decorate(cls):
+		slots = tuple(f.name for f in fields(cls)) + extra
+		namespace = {key: value for key, value in cls.__dict__.items() if key not in slots + ('__dict__', '__weakref__')}
+		namespace['__slots__'] = slots
+		return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+	return decorate
 
 
 class DependencyMode(Flag):
@@ -27,6 +62,7 @@ class TargetDetails:
 	pre_release: bool = False  # TODO: probably not needed
 
 
+@slotted()
 @dataclass(frozen=True)
 class RequirementWrapper:
 	"""Individual requirement as specified in setup.py/setup.cfg/requirements.txt"""
@@ -38,12 +74,15 @@ class RequirementWrapper:
 	key: Text = field(init=False)
 
 	@classmethod
+	@lru_cache(maxsize=INTERN_CACHE_SIZE)
 	def from_requirement(cls, req_text: Text) -> RequirementWrapper:
+		"""parse a requirement, equal strings share the same immutable result"""
 		req = Requirement(req_text)
 		return RequirementWrapper(req.name, req.url, frozenset(req.extras), req.specifier, req.marker)
 
 	def __post_init__(self) -> None:
-		object.__setattr__(self, 'key', re.sub(r'[^A-Za-z0-9.]+', '-', self.name).lower())
+		object.__setattr__(self, 'name', sys.intern(self.name))
+		object.__setattr__(self, 'key', canonical_name(self.name))
 
 	def __and__(self, other):
 		if not isinstance(other, RequirementWrapper):
@@ -67,14 +106,16 @@ class RequirementWrapper:
 			parts.append(str(self.specifier))
 
 		if self.url:
-			parts.append("@ {0}".format(self.url))
+			parts.append(" @ {0}".format(self.url))
 
 		if self.marker:
-			parts.append("; {0}".format(self.marker))
+			# after an URL the separator needs to be preceded by whitespace
+			parts.append("{0}; {1}".format(" " if self.url else "", self.marker))
 
 		return "".join(parts)
 
 
+@slotted()
 @dataclass(frozen=True)
 class PackageTuple:
 	candidate: Candidate
@@ -89,6 +130,8 @@ class Dependency:
 	requested_by: Set[Text] = field(default_factory=set, compare=False)
 	candidates: Dict[Version, Candidate] = field(default=None, compare=False)
 	chosen_version: Version = None
+	extras: Dict[Text, FrozenSet[Text]] = field(default_factory=dict, compare=False)
+	_combined: Optional[SpecifierSet] = field(default=None, init=False, repr=False, compare=False)
 
 	@classmethod
 	def from_requirement(cls, text: Text) -> Dependency:
@@ -98,15 +141,30 @@ class Dependency:
 
 	@property
 	def combined_specifiers(self) -> SpecifierSet:
-		return reduce(lambda x, y: x[1] & y[1], self.specifiers.values())
+		# narrowed as specifiers are added, recomputed only after one is removed
+		if self._combined is None:
+			self._combined = reduce(lambda x, y: x & y, (specifiers for _, specifiers in self.specifiers.values()), SpecifierSet())
+		return self._combined
 
-	def add_specifiers(self, name: str, version: Version, specifiers: SpecifierSet) -> None:
+	@property
+	def combined_extras(self) -> FrozenSet[Text]:
+		return frozenset().union(*self.extras.values())
+
+	def add_specifiers(self, name: str, version: Version, specifiers: SpecifierSet, extras: FrozenSet[Text] = frozenset()) -> None:
 		assert name not in self.specifiers
 		self.specifiers[name] = (version, specifiers)
+		self.requested_by.add(name)
+		if self._combined is not None:
+			self._combined &= specifiers
+		if extras:
+			self.extras[name] = extras
 
 	def remove_specifiers(self, name: str) -> None:
 		assert name in self.specifiers
 		del self.specifiers[name]
+		self.requested_by.discard(name)
+		self._combined = None
+		self.extras.pop(name, None)
 
 
 # @dataclass(frozen=True)
@@ -115,16 +173,42 @@ class Dependency:
 # 	version: Version
 # 	add
 
+@slotted('_version')
 @dataclass
 class Candidate:
+	"""sdist of a single version of a project
+
+	Version and requires-python are kept as strings from the index and only parsed once accessed.
+	Strings repeated across candidates are interned."""
 	name: str
-	version: Version
+	raw_version: str
 	url: str
 	hash_type: str
 	hash: str
-	requires_python: SpecifierSet
+	raw_requires_python: str = ''
+	metadata_url: Optional[str] = None
+	# URLs of wheels of the release and whether their metadata is published (PEP 658)
+	wheels: Tuple[Tuple[str, bool], ...] = ()
 	info: CandidateInfo = None
 
+	def __post_init__(self) -> None:
+		self.name = sys.intern(self.name)
+		self.raw_requires_python = sys.intern(self.raw_requires_python)
+		if self.hash_type is not None:
+			self.hash_type = sys.intern(self.hash_type)
+
+	@property
+	def version(self) -> Version:
+		try:
+			return self._version
+		except AttributeError:
+			self._version = parse_version(self.raw_version)
+			return self._version
+
+	@property
+	def requires_python(self) -> SpecifierSet:
+		return parse_specifier(self.raw_requires_python)
+
 	def to_nix(self):
 		return [
 			f'"{self.name}" = setup {{',
@@ -145,6 +229,22 @@ class Candidate:
 		self.hash_type = hash_type
 		self.hash = hash
 
+	def to_json(self) -> Dict[Text, Optional[Text]]:
+		return {
+			'name': self.name,
+			'version': self.raw_version,
+			'url': self.url,
+			'hash_type': self.hash_type,
+			'hash': self.hash,
+			'requires_python': self.raw_requires_python,
+			'metadata_url': self.metadata_url,
+			'wheels': [list(wheel) for wheel in self.wheels],
+		}
+
+	@classmethod
+	def from_json(cls, data: Dict[Text, Optional[Text]]) -> Candidate:
+		return cls(data['name'], data['version'], data['url'], data['hash_type'], data['hash'], data['requires_python'], data.get('metadata_url'), tuple((url, bool(metadata)) for url, metadata in data.get('wheels', ())))
+
 	def _is_comparable(self, other):
 		return isinstance(other, type(self)) and self.name == other.name
 
@@ -191,3 +291,26 @@ class CandidateInfo:
 	dep_test: Set[RequirementWrapper]
 	dep_run: Set[RequirementWrapper]
 	extras: Dict[Text, Set[RequirementWrapper]]
+
+	def to_json(self) -> Dict[Text, Any]:
+		def requirements(reqs: Set[RequirementWrapper]) -> List[Text]:
+			return sorted(str(req) for req in reqs)
+
+		return {
+			'setup': requirements(self.dep_setup),
+			'test': requirements(self.dep_test),
+			'install': requirements(self.dep_run),
+			'extras': {key: requirements(value) for key, value in self.extras.items()},
+		}
+
+	@classmethod
+	def from_json(cls, data: Dict[Text, Any]) -> CandidateInfo:
+		def requirements(reqs: List[Text]) -> Set[RequirementWrapper]:
+			return set(RequirementWrapper.from_requirement(req) for req in reqs)
+
+		return cls(
+			requirements(data['setup']),
+			requirements(data['test']),
+			requirements(data['install']),
+			{key: requirements(value) for key, value in data['extras'].items()},
+		)
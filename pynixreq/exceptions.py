@@ -11,3 +11,27 @@ class PyPINotAvailableError(PyNixReqError):
 
 class NoSolutionError(PyNixReqError):
 	pass
+
+
+class HashMismatchError(PyNixReqError):
+	pass
+
+
+class NixError(PyNixReqError):
+	"""nix command which failed, stderr holds the end of its output"""
+
+	def __init__(self, message: str, arguments=(), returncode: int = None, stderr: str = '') -> None:
+		super().__init__(message)
+		self.arguments = tuple(arguments)
+		self.returncode = returncode
+		self.stderr = stderr
+
+	def __str__(self) -> str:
+		message = super().__str__()
+		if self.stderr:
+			message += '\n' + '\n'.join(self.stderr.rstrip().splitlines()[-20:])
+		return message
+
+
+class NixTimeoutError(NixError):
+	pass
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import os
+import pathlib
+import re
+from logging import getLogger
+from typing import Dict, Text
+from urllib.parse import quote, urlsplit
+from urllib.request import url2pathname
+
+from packaging.version import InvalidVersion, Version
+
+from . import trace
+from .data import Candidate, canonical_name
+from .pypiparser import SDIST_RANK, WHEEL_EXT, IndexParser
+
+# versions follow the project name, PEP 440 allows a leading v
+RE_VERSION_START = re.compile(r'^v?\d')
+
+log = getLogger(__name__)
+
+
+def is_version(text: Text) -> bool:
+	try:
+		Version(text)
+	except InvalidVersion:
+		return False
+	return True
+
+
+def url_to_path(url: Text) -> Text:
+	return url2pathname(urlsplit(url).path)
+
+
+class DirectoryParser(IndexParser):
+	"""Files of a find-links directory, versions of sdists are already known from the scan"""
+
+	def __init__(self, index_url: str, base_name: str, versions: Dict[str, str]):
+		super().__init__(index_url, base_name)
+		self._versions = versions
+
+	def get_version(self, filebase: str) -> str:
+		return self._versions[filebase]
+
+
+class FindLinks:
+	"""Directory of sdists and wheels used in place of a simple index
+
+	The directory is listed once. A file is registered under every project name its filename
+	can start with, as long as the rest of the name is a valid version. Candidates are created
+	by the parser used for index pages, with file:// URLs and without hashes, those are only
+	computed for the candidates a solver ends up using."""
+
+	def __init__(self, directory: Text) -> None:
+		self.directory = os.path.abspath(directory)
+		self.url = pathlib.Path(self.directory).as_uri() + '/'
+
+		# canonical project name -> file name -> version
+		self._files: Dict[Text, Dict[Text, Text]] = {}
+		self._scan()
+
+	def _scan(self) -> None:
+		for entry in os.scandir(self.directory):
+			if not entry.is_file():
+				continue
+
+			if entry.name.endswith(WHEEL_EXT):
+				# {distribution}-{version}(-{build tag})?-{python tag}-{abi tag}-{platform tag}.whl
+				parts = entry.name.split('-')
+				if len(parts) >= 5:
+					self._files.setdefault(canonical_name(parts[0]), {})[entry.name] = parts[1].lower()
+				continue
+
+			base, ext = IndexParser.splitext(entry.name)
+			if ext not in SDIST_RANK:
+				continue
+
+			# a file name doesn't tell where the project name ends, e.g. foo-bar-1.0.tar.gz or foo-2fa-0.3.tar.gz
+			parts = base.split('-')
+			for i in range(1, len(parts)):
+				if RE_VERSION_START.match(parts[i]) and is_version('-'.join(parts[i:])):
+					self._files.setdefault(canonical_name('-'.join(parts[:i])), {})[entry.name] = '-'.join(parts[i:]).lower()
+
+		log.debug('Found %d projects in %s', len(self._files), self.directory)
+
+	def __contains__(self, name: Text) -> bool:
+		return canonical_name(name) in self._files
+
+	async def get_package_versions(self, name: Text) -> Dict[Text, Candidate]:
+		files = self._files.get(canonical_name(name), {})
+
+		with trace.span('index.find-links', project=name, directory=self.directory):
+			versions = {IndexParser.splitext(filename)[0]: version for filename, version in files.items() if not filename.endswith(WHEEL_EXT)}
+			parser = DirectoryParser(self.url, name, versions)
+			for filename in sorted(files):
+				parser.add_file(filename, quote(filename), None, None, None)
+			parser.finish()
+
+		return parser.candidates
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+from logging import getLogger
+from typing import Dict, Iterable, Optional, Text, Tuple
+from urllib.parse import urlsplit
+from urllib.request import url2pathname
+
+from . import trace
+from .cache import HashCache
+from .data import Candidate
+from .exceptions import HashMismatchError
+from .http import IDENTITY, HTTPClient
+
+NIX_BASE32_ALPHABET = '0123456789abcdfghijklmnpqrsvwxyz'
+CHUNK_SIZE = 256 * 1024
+
+# hash put into requirements.nix for candidates whose published hash can't be used
+NIX_HASH_TYPE = 'sha512'
+COMPUTED_HASHES = ('sha256', 'sha512')
+
+log = getLogger(__name__)
+
+
+def nix_base32(digest: bytes) -> Text:
+	"""encode digest the way nix-hash --base32 does (least significant bits first, custom alphabet)"""
+	length = (len(digest) * 8 - 1) // 5 + 1
+	chars = []
+	for n in range(length - 1, -1, -1):
+		bit = n * 5
+		byte, offset = divmod(bit, 8)
+		value = digest[byte] >> offset
+		if byte + 1 < len(digest):
+			value |= digest[byte + 1] << (8 - offset)
+		chars.append(NIX_BASE32_ALPHABET[value & 0x1f])
+
+	return ''.join(chars)
+
+
+async def download_hashes(http: HTTPClient, url: Text, algorithms: Iterable[Text], expected: Optional[Tuple[Text, Text]] = None) -> Dict[Text, bytes]:
+	"""stream a file and return its digests, the published hash is verified in the same pass"""
+	hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+	if expected is not None and expected[0] not in hashes:
+		hashes[expected[0]] = hashlib.new(expected[0])
+
+	async with http.get(url, headers=IDENTITY) as response:
+		response.raise_for_status()
+		async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+			for hash in hashes.values():
+				hash.update(chunk)
+
+	if expected is not None and hashes[expected[0]].hexdigest() != expected[1]:
+		raise HashMismatchError(f'{url}: expected {expected[0]}={expected[1]}, got {hashes[expected[0]].hexdigest()}')
+
+	return {algorithm: hash.digest() for algorithm, hash in hashes.items()}
+
+
+def file_hashes(path: Text, algorithms: Iterable[Text]) -> Dict[Text, bytes]:
+	"""return digests of a local file"""
+	hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+	with open(path, 'rb') as fp:
+		for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+			for hash in hashes.values():
+				hash.update(chunk)
+
+	return {algorithm: hash.digest() for algorithm, hash in hashes.items()}
+
+
+class SourceHasher:
+	"""Computes hashes of candidate sources without going through the nix store
+
+	The file is only added to the store once nix builds the package. Files of find-links
+	directories are read in place and hashed again only after they change."""
+
+	def __init__(self, http: HTTPClient, cache: Optional[HashCache] = None) -> None:
+		self.http = http
+		self.cache = cache
+		self.downloads = 0
+		self.hashed = 0
+		# downloads in progress, solvers of several targets may need the same source
+		self._pending: Dict[Text, asyncio.Future] = {}
+
+	async def get_hashes(self, candidate: Candidate) -> Dict[Text, Text]:
+		"""return hex digests of the candidate source"""
+		future = self._pending.get(candidate.url)
+		if future is None:
+			future = self._pending[candidate.url] = asyncio.ensure_future(self._get_hashes(candidate))
+			future.add_done_callback(lambda _: self._pending.pop(candidate.url, None))
+
+		return await asyncio.shield(future)
+
+	async def _get_hashes(self, candidate: Candidate) -> Dict[Text, Text]:
+		if urlsplit(candidate.url).scheme == 'file':
+			return await self._get_file_hashes(candidate)
+
+		source = f'{candidate.hash_type}:{candidate.hash}'
+		hashes = self.cache.get(candidate.url, source) if self.cache else None
+		if hashes is not None:
+			return hashes
+
+		expected = (candidate.hash_type, candidate.hash) if candidate.hash_type and candidate.hash else None
+		with trace.span('hash.download', project=candidate.name, version=str(candidate.version), url=candidate.url):
+			digests = await download_hashes(self.http, candidate.url, COMPUTED_HASHES, expected)
+		self.downloads += 1
+
+		hashes = {algorithm: digests[algorithm].hex() for algorithm in COMPUTED_HASHES}
+		if self.cache:
+			self.cache.put(candidate.url, source, hashes)
+
+		return hashes
+
+	async def _get_file_hashes(self, candidate: Candidate) -> Dict[Text, Text]:
+		path = url2pathname(urlsplit(candidate.url).path)
+		stat = os.stat(path)
+		source = f'file:{stat.st_size}:{stat.st_mtime_ns}'
+		hashes = self.cache.get(candidate.url, source) if self.cache else None
+		if hashes is not None:
+			return hashes
+
+		with trace.span('hash.file', project=candidate.name, version=str(candidate.version), path=path):
+			digests = await asyncio.get_event_loop().run_in_executor(None, file_hashes, path, COMPUTED_HASHES)
+		self.hashed += 1
+
+		hashes = {algorithm: digests[algorithm].hex() for algorithm in COMPUTED_HASHES}
+		if self.cache:
+			self.cache.put(candidate.url, source, hashes)
+
+		return hashes
+
+	async def nix_hash(self, candidate: Candidate) -> Tuple[Text, Text]:
+		"""return hash type and nix base32 encoded hash usable by fetchurl"""
+		hashes = await self.get_hashes(candidate)
+		return NIX_HASH_TYPE, nix_base32(bytes.fromhex(hashes[NIX_HASH_TYPE]))
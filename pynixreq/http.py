@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from logging import getLogger
+from typing import Any, Dict, Optional, Text
+
+import aiohttp
+
+try:
+	# aiohttp decodes brotli only when the module is installed (extra "brotli" of pynixreq)
+	from aiohttp.http_parser import HAS_BROTLI
+except ImportError:
+	HAS_BROTLI = False
+
+ACCEPT_ENCODING = 'gzip, deflate, br' if HAS_BROTLI else 'gzip, deflate'
+# for downloads which are hashed or read in ranges, the bytes have to be those of the file
+IDENTITY = {'Accept-Encoding': 'identity'}
+
+# the server or a proxy in front of it is temporarily unable to answer
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+DEFAULT_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+# a server asking to wait longer than this gets its error passed on
+RETRY_AFTER_MAX = 120.0
+DNS_TTL = 300
+
+log = getLogger(__name__)
+
+
+@dataclass
+class HTTPStats:
+	requests: int = 0
+	retries: int = 0
+	connections_opened: int = 0
+	connections_reused: int = 0
+	dns_cache_hits: int = 0
+	dns_cache_misses: int = 0
+
+	def __str__(self) -> str:
+		return (
+			f'{self.requests} requests, {self.retries} retries, connections: {self.connections_opened} opened, '
+			f'{self.connections_reused} reused, DNS cache: {self.dns_cache_hits} hits, {self.dns_cache_misses} misses'
+		)
+
+
+def retry_after(value: Optional[Text]) -> Optional[float]:
+	"""seconds to wait according to a Retry-After header, which holds seconds or a date"""
+	if not value:
+		return None
+
+	try:
+		return max(0.0, float(value))
+	except ValueError:
+		pass
+
+	try:
+		return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+	except (TypeError, ValueError):
+		return None
+
+
+def backoff(attempt: int) -> float:
+	"""exponential backoff with full jitter, so clients failing together don't retry together"""
+	return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class _Request:
+	"""context manager returned by HTTPClient.get, the response is released on exit"""
+	__slots__ = ('client', 'url', 'kwargs', 'response')
+
+	def __init__(self, client: HTTPClient, url: Text, kwargs: Dict[Text, Any]) -> None:
+		self.client = client
+		self.url = url
+		self.kwargs = kwargs
+		self.response: Optional[aiohttp.ClientResponse] = None
+
+	async def __aenter__(self) -> aiohttp.ClientResponse:
+		self.response = await self.client.request(self.url, **self.kwargs)
+		return self.response
+
+	async def __aexit__(self, *args) -> None:
+		self.response.release()
+
+
+class HTTPClient:
+	"""aiohttp session used for all requests of a run, with retries and connection counters
+
+	The session is created on the first request, as aiohttp needs a running event loop, and
+	is closed by close() or by leaving "async with". GET requests failing to connect or
+	answered with 429 or 5xx are retried with exponential backoff, honouring Retry-After.
+	Failures while the body is being read are left to the caller."""
+
+	def __init__(self, config: Optional[Dict[Text, Any]] = None) -> None:
+		config = config or {}
+		self.limit: int = config.get('http-jobs', 8)
+		self.limit_per_host: int = config.get('http-jobs-per-host') or 0
+		self.retries: int = config.get('http-retries', DEFAULT_RETRIES)
+		# certificates are verified unless explicitly turned off, e.g. for an index behind an intercepting proxy
+		self.verify_ssl: bool = not config.get('insecure', False)
+
+		self.stats = HTTPStats()
+		self._session: Optional[aiohttp.ClientSession] = None
+		self._closed = False
+
+	@property
+	def session(self) -> aiohttp.ClientSession:
+		if self._closed:
+			raise RuntimeError('HTTP client is closed')
+
+		if self._session is None:
+			trace_config = aiohttp.TraceConfig()
+			trace_config.on_request_start.append(self._on_request_start)
+			trace_config.on_connection_create_end.append(self._on_connection_create_end)
+			trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+			trace_config.on_dns_cache_hit.append(self._on_dns_cache_hit)
+			trace_config.on_dns_cache_miss.append(self._on_dns_cache_miss)
+
+			# the default of ssl differs between aiohttp versions, it is only passed to turn verification off
+			insecure: Dict[Text, Any] = {} if self.verify_ssl else {'ssl': False}
+			connector = aiohttp.TCPConnector(
+				limit=self.limit,
+				limit_per_host=self.limit_per_host,
+				use_dns_cache=True,
+				ttl_dns_cache=DNS_TTL,
+				**insecure,
+			)
+			self._session = aiohttp.ClientSession(connector=connector, headers={'Accept-Encoding': ACCEPT_ENCODING}, trace_configs=[trace_config])
+
+		return self._session
+
+	def get(self, url: Text, **kwargs: Any) -> _Request:
+		"""GET url, used like ClientSession.get: async with client.get(url) as response"""
+		return _Request(self, url, kwargs)
+
+	async def request(self, url: Text, **kwargs: Any) -> aiohttp.ClientResponse:
+		"""GET url, retrying temporary failures, the caller has to release the response"""
+		attempt = 0
+		while True:
+			try:
+				response = await self.session.get(url, **kwargs)
+			except aiohttp.ClientSSLError:
+				# a certificate doesn't get valid by asking again
+				raise
+			except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+				if attempt >= self.retries:
+					raise
+				delay = backoff(attempt)
+				reason = repr(e)
+			else:
+				if response.status not in RETRY_STATUSES or attempt >= self.retries:
+					return response
+
+				delay = retry_after(response.headers.get('Retry-After'))
+				if delay is not None and delay > RETRY_AFTER_MAX:
+					return response
+				if delay is None:
+					delay = backoff(attempt)
+				reason = f'{response.status} {response.reason}'
+				response.release()
+
+			attempt += 1
+			self.stats.retries += 1
+			log.info('%s: %s, retrying in %.1fs (%d of %d)', url, reason, delay, attempt, self.retries)
+			await asyncio.sleep(delay)
+
+	async def close(self) -> None:
+		if self._session is not None:
+			await self._session.close()
+			log.info('HTTP: %s', self.stats)
+		self._session = None
+		self._closed = True
+
+	async def __aenter__(self) -> HTTPClient:
+		return self
+
+	async def __aexit__(self, *args) -> None:
+		await self.close()
+
+	async def _on_request_start(self, session, context, params) -> None:
+		self.stats.requests += 1
+
+	async def _on_connection_create_end(self, session, context, params) -> None:
+		self.stats.connections_opened += 1
+
+	async def _on_connection_reuseconn(self, session, context, params) -> None:
+		self.stats.connections_reused += 1
+
+	async def _on_dns_cache_hit(self, session, context, params) -> None:
+		self.stats.dns_cache_hits += 1
+
+	async def _on_dns_cache_miss(self, session, context, params) -> None:
+		self.stats.dns_cache_misses += 1
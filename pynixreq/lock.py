@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Text
+
+from .cache import write_atomic
+from .constraints import ROOT, ConstraintIndex
+from .data import Candidate, CandidateInfo, PackageTuple, RequirementWrapper
+
+LOCK_FORMAT = 1
+LOCK_FILE = 'requirements.lock.json'
+
+log = getLogger(__name__)
+
+
+def lock_filename(requirements_filename: Text) -> Text:
+	"""sidecar of a generated requirements.nix, requirements-python37.nix gets requirements-python37.lock.json"""
+	base = os.path.splitext(os.path.basename(requirements_filename))[0]
+	return os.path.join(os.path.dirname(requirements_filename), f'{base}.lock.json')
+
+
+@dataclass
+class LockedPackage:
+	"""candidate picked by an earlier resolution together with its metadata"""
+	candidate: Candidate
+	requirements: FrozenSet[RequirementWrapper]
+
+	def to_json(self) -> Dict[Text, Any]:
+		return {
+			'candidate': self.candidate.to_json(),
+			'info': self.candidate.info.to_json() if self.candidate.info is not None else None,
+			'requirements': sorted(str(requirement) for requirement in self.requirements),
+		}
+
+	@classmethod
+	def from_json(cls, data: Dict[Text, Any]) -> LockedPackage:
+		candidate = Candidate.from_json(data['candidate'])
+		if data['info'] is not None:
+			candidate.info = CandidateInfo.from_json(data['info'])
+
+		return cls(candidate, frozenset(RequirementWrapper.from_requirement(requirement) for requirement in data['requirements']))
+
+
+@dataclass
+class Lock:
+	"""Result of the previous resolution, written next to requirements.nix
+
+	Pins of the lock are preferred by the next resolution, only packages reachable from
+	starting requirements which no longer accept their pin are resolved again."""
+	python_version: Text
+	requirements: List[Text]
+	packages: Dict[Text, LockedPackage]
+
+	@classmethod
+	def create(cls, python_version: Text, requirements: Iterable[RequirementWrapper], packages: Dict[Text, PackageTuple]) -> Lock:
+		return cls(
+			python_version,
+			sorted(str(requirement) for requirement in requirements),
+			{key: LockedPackage(package.candidate, package.requirements) for key, package in packages.items()},
+		)
+
+	def to_json(self) -> Dict[Text, Any]:
+		return {
+			'format': LOCK_FORMAT,
+			'python': self.python_version,
+			'requirements': self.requirements,
+			'packages': {key: package.to_json() for key, package in sorted(self.packages.items())},
+		}
+
+	@classmethod
+	def from_json(cls, data: Dict[Text, Any]) -> Lock:
+		packages = {key: LockedPackage.from_json(package) for key, package in data['packages'].items()}
+		return cls(data['python'], data['requirements'], packages)
+
+	@classmethod
+	def load(cls, filename: Text) -> Optional[Lock]:
+		try:
+			with open(filename) as fp:
+				data = json.load(fp)
+		except FileNotFoundError:
+			return None
+		except ValueError as e:
+			log.warning('Ignoring invalid lock file %s: %s', filename, e)
+			return None
+
+		if data.get('format') != LOCK_FORMAT:
+			log.warning('Ignoring lock file %s of an unsupported format', filename)
+			return None
+
+		return cls.from_json(data)
+
+	def save(self, filename: Text) -> None:
+		write_atomic(os.path.abspath(filename), self.to_json())
+
+	def pinned(self, key: Text) -> Optional[Candidate]:
+		package = self.packages.get(key)
+		return package.candidate if package is not None else None
+
+	def unlocked(self, requirements: Iterable[RequirementWrapper]) -> Set[Text]:
+		"""packages which have to be resolved again: those reachable from requirements their pin doesn't satisfy"""
+		constraints = ConstraintIndex()
+		for requirement in requirements:
+			constraints.add(ROOT, None, requirement)
+
+		pending = [
+			key for key in constraints
+			if key in self.packages and not constraints[key].combined_specifiers.contains(self.packages[key].candidate.version, prereleases=True)
+		]
+
+		unlocked = set()
+		while pending:
+			key = pending.pop()
+			if key in unlocked or key not in self.packages:
+				continue
+
+			unlocked.add(key)
+			pending.extend(requirement.key for requirement in self.packages[key].requirements)
+
+		return unlocked
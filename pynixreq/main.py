@@ -1,23 +1,84 @@
 import asyncio
 import logging
-from argparse import ArgumentParser
+import os
+import sys
+import time
+from argparse import ArgumentParser, ArgumentTypeError
+from typing import Any, Dict, List, Set, Tuple
 
 from setuptools.config import read_configuration
 
 from pynixreq.data import RequirementWrapper, TargetDetails
 from .compile_requirements import DependencySolver
-from .requirements import write_requirements
+from . import trace
+from .context import SharedContext
+from .lock import LOCK_FILE, Lock, lock_filename
+from .requirements import requirements_filename, write_requirements
 
 
-async def async_cli():
-	parser = ArgumentParser(description='Generate requirements.nix from dependencies')
-	parser.add_argument('--python-target', '-V', required=True, help='Major python version')
-	args = parser.parse_args()
+def add_resolver_arguments(parser: ArgumentParser) -> None:
+	"""options shared by the command line and the daemon"""
+	parser.add_argument('--index-url', '-i', help='Base URL of the simple index (default: https://pypi.org/simple)')
+	parser.add_argument('--extra-index-url', action='append', help='Additional index queried at the same time, can be repeated')
+	parser.add_argument('--index-priority', action='append', type=parse_priority, metavar='URL=PRIORITY', help='A project found on several indexes comes from the one with the highest priority (default: 1 for extra indexes, 0 for the index)')
+	parser.add_argument('--merge-indexes', action='store_true', help='Take each version from the index with the highest priority which has it, instead of all versions from one index')
+	parser.add_argument('--hedge-percentile', type=float, help='Send a second request to an index which takes longer than this percentile of its recent requests')
+	parser.add_argument('--http-jobs', type=int, default=8, help='Maximum number of concurrent HTTP connections')
+	parser.add_argument('--http-jobs-per-host', type=int, help='Maximum number of concurrent HTTP connections to a single host (default: no limit besides --http-jobs)')
+	parser.add_argument('--http-retries', type=int, default=3, help='Attempts after a failed connection or a 429/5xx response, with exponential backoff')
+	parser.add_argument('--insecure', action='store_true', help='Do not verify TLS certificates of indexes and downloads')
+	parser.add_argument('--nix-jobs', type=int, help='Maximum number of concurrent nix processes (default: max-jobs of nix)')
+	parser.add_argument('--nix-timeout', type=float, help='Seconds after which a nix process is killed')
+	parser.add_argument('--nix-batch-size', type=int, default=8, help='Number of candidates whose metadata is built by a single nix-build')
+	parser.add_argument('--build-metadata', action='store_true', help='Always obtain metadata by running setup.py of sdists')
+	parser.add_argument('--greedy', action='store_true', help='Pick the newest version of every requirement without backtracking')
+	parser.add_argument('--serial', action='store_true', help='Resolve requirements one at a time')
+	parser.add_argument('--cache-dir', help='Directory for persistent caches (default: ~/.cache/pynixreq)')
+	parser.add_argument('--no-cache', action='store_true', help='Do not use persistent caches')
+	parser.add_argument('--cache-ttl', type=float, default=0, help='Seconds for which cached index pages are used without revalidation')
+	parser.add_argument('--offline', action='store_true', help='Only use cached index pages')
+	parser.add_argument('--find-links', '-f', action='append', metavar='DIRECTORY', help='Directory of sdists and wheels, projects found in it are not looked up on the index')
+
+
+def parse_priority(value: str) -> Tuple[str, int]:
+	url, separator, priority = value.rpartition('=')
+	try:
+		if not separator:
+			raise ValueError
+		return url, int(priority)
+	except ValueError:
+		raise ArgumentTypeError(f'expected URL=PRIORITY with an integer priority, got {value!r}')
+
+
+def config_from_arguments(args) -> Dict[str, Any]:
+	return {
+		'index-url': args.index_url,
+		'extra-index-url': args.extra_index_url or [],
+		'index-priority': dict(args.index_priority or []),
+		'merge-indexes': args.merge_indexes,
+		'hedge-percentile': args.hedge_percentile,
+		'http-jobs': args.http_jobs,
+		'http-jobs-per-host': args.http_jobs_per_host,
+		'http-retries': args.http_retries,
+		'insecure': args.insecure,
+		'nix-jobs': args.nix_jobs,
+		'nix-timeout': args.nix_timeout,
+		'nix-batch-size': args.nix_batch_size,
+		'build-metadata': args.build_metadata,
+		'greedy': args.greedy,
+		'serial': args.serial,
+		'cache-dir': args.cache_dir,
+		'no-cache': args.no_cache,
+		'cache-ttl': args.cache_ttl,
+		'offline': args.offline,
+		'find-links': args.find_links or [],
+	}
 
-	target = TargetDetails(args.python_target)
 
+def read_project_requirements(directory: str = '.') -> Set[RequirementWrapper]:
+	"""requirements of the project in directory, from its setup.cfg"""
 	requirements = set()
-	configuration = read_configuration('setup.cfg')
+	configuration = read_configuration(os.path.join(directory, 'setup.cfg'))
 
 	for dep in configuration['options'].get('setup_requires', []):
 		requirements.add(RequirementWrapper.from_requirement(dep))
@@ -32,16 +93,86 @@ async def async_cli():
 		for dep in extra:
 			requirements.add(RequirementWrapper.from_requirement(dep))
 
-	solver = DependencySolver(requirements, target)
-	await solver.run()
+	return requirements
+
+
+async def generate(directory: str, python_versions: List[str], config: Dict[str, Any], context: SharedContext, upgrade: bool = False) -> List[str]:
+	"""resolve requirements of a project for every python version and write them next to its setup.cfg"""
+	requirements = read_project_requirements(directory)
+
+	targets = [TargetDetails(python_version) for python_version in dict.fromkeys(python_versions)]
+	solvers = []
+	for target in targets:
+		filename = os.path.join(directory, requirements_filename(target.python_version, len(targets) > 1))
+		target_config = dict(config)
+
+		lock = None if upgrade else Lock.load(lock_filename(filename))
+		if lock is not None and lock.python_version == target.python_version:
+			target_config['lock'] = lock
+
+		solvers.append((filename, DependencySolver(requirements, target, target_config, context)))
+
+	await asyncio.gather(*(solver.run() for _, solver in solvers))
 
-	write_requirements('requirements.nix', solver.candidates)
+	for filename, solver in solvers:
+		write_requirements(filename, solver.candidates)
+		Lock.create(solver.target.python_version, solver.starting_requirements, solver.packages).save(lock_filename(filename))
+
+	return [filename for filename, _ in solvers]
+
+
+async def async_cli():
+	parser = ArgumentParser(description='Generate requirements.nix from dependencies (run "pynixreq serve --help" for the daemon)')
+	parser.add_argument('--python-target', '-V', required=True, action='append', help='Major python version, can be repeated to resolve for several versions')
+	parser.add_argument('--upgrade', action='store_true', help=f'Ignore pins of {LOCK_FILE} and resolve everything again')
+	parser.add_argument('--socket', help='Let the daemon listening on this socket do the work (see "pynixreq serve")')
+	parser.add_argument('--trace', metavar='FILE', help='Write timings of fetches, builds and solver passes to FILE in Chrome trace format and print their summary')
+	add_resolver_arguments(parser)
+	args = parser.parse_args()
+
+	if args.socket:
+		from .daemon import request
+
+		# the daemon resolves with the options it was started with
+		defaults = config_from_arguments(parser.parse_args(['--python-target', '']))
+		changed = [key for key, value in config_from_arguments(args).items() if value != defaults[key]]
+		if args.trace:
+			changed.append('trace')
+		if changed:
+			parser.error(f'--socket can not be combined with --{", --".join(changed)}, pass them to "pynixreq serve" instead')
+
+		response = await request(args.socket, {'command': 'generate', 'directory': os.getcwd(), 'python': args.python_target, 'upgrade': args.upgrade})
+		if 'error' in response:
+			sys.exit(f'pynixreq daemon: {response["error"]}')
+		return
+
+	# index pages, published metadata, hashes and nix job slots are shared by all targets
+	config = config_from_arguments(args)
+	if args.trace:
+		trace.tracer.enable()
+
+	start = time.perf_counter()
+	context = SharedContext(config)
+	try:
+		await generate('.', args.python_target, config, context, args.upgrade)
+	finally:
+		await context.close()
+		if args.trace:
+			trace.tracer.write_chrome_trace(args.trace)
+			print(trace.tracer.format_summary(time.perf_counter() - start), file=sys.stderr)
 
 
 def cli():
 	logging.basicConfig(level=logging.DEBUG)
+
+	if sys.argv[1:2] == ['serve']:
+		from .daemon import async_serve_cli
+		main = async_serve_cli(sys.argv[2:])
+	else:
+		main = async_cli()
+
 	loop = asyncio.get_event_loop()
-	loop.run_until_complete(async_cli())
+	loop.run_until_complete(main)
 	# loop.run_until_complete(loop.shutdown_asyncgens())
 	# loop.close()
 	# return asyncio.run(async_cli(), debug=True)
@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import asyncio
+import re
+import zipfile
+from abc import ABC, abstractmethod
+from email.parser import HeaderParser
+from logging import getLogger
+from typing import Any, Dict, Iterable, List, Optional, Text, Tuple
+from urllib.parse import urlsplit
+
+import aiohttp
+from packaging.markers import InvalidMarker, Marker
+from packaging.requirements import InvalidRequirement, Requirement
+
+from . import nix
+from .data import Candidate, CandidateInfo, RequirementWrapper
+from .findlinks import url_to_path
+from .pypi import PyPI
+from .wheel import LazyWheel, read_local_metadata, select_wheel
+
+# mode of metadata which only contains install requirements and extras (no setup_requires and tests_require)
+CORE_METADATA_MODE = 'core-metadata'
+# increased when published metadata is read differently, metadata cached by older versions is ignored
+CORE_METADATA_VERSION = '1'
+
+RE_EXTRA = re.compile(r'''\bextra\s*==\s*(['"])(.*?)\1''')
+RE_DANGLING_AND = re.compile(r'^\s*and\s+|\s+and\s*$')
+
+log = getLogger(__name__)
+
+
+def split_extra(text: Text) -> Tuple[Optional[Text], RequirementWrapper]:
+	"""separate the 'extra == "name"' part of a Requires-Dist marker from the requirement"""
+	requirement = Requirement(text)
+	marker = str(requirement.marker) if requirement.marker else ""
+
+	extras = RE_EXTRA.findall(marker)
+	if not extras:
+		return None, RequirementWrapper(requirement.name, requirement.url, frozenset(requirement.extras), requirement.specifier, requirement.marker)
+
+	if len(extras) > 1:
+		raise ValueError(f"Requirement {text!r} depends on multiple extras")
+
+	remaining = RE_DANGLING_AND.sub('', RE_EXTRA.sub('', marker).strip())
+	if remaining.startswith('(') and remaining.endswith(')') and remaining.count('(') == 1:
+		remaining = remaining[1:-1]
+
+	if 'extra' in remaining:
+		raise ValueError(f"Unsupported marker in {text!r}")
+
+	new_marker = Marker(remaining) if remaining else None
+	return extras[0][1], RequirementWrapper(requirement.name, requirement.url, frozenset(requirement.extras), requirement.specifier, new_marker)
+
+
+def requires_dist_to_info(requires_dist: Iterable[Text], provides_extra: Iterable[Text]) -> CandidateInfo:
+	"""convert core metadata requirements (PEP 566) to the form returned by setup.py"""
+	dep_run = set()
+	extras: Dict[Text, set] = {extra: set() for extra in provides_extra}
+
+	for text in requires_dist:
+		extra, requirement = split_extra(text)
+		if extra is None:
+			dep_run.add(requirement)
+		else:
+			extras.setdefault(extra, set()).add(requirement)
+
+	return CandidateInfo(set(), set(), dep_run, extras)
+
+
+def parse_metadata(text: Text) -> CandidateInfo:
+	"""parse METADATA/PKG-INFO file"""
+	message = HeaderParser().parsestr(text)
+	return requires_dist_to_info(message.get_all('Requires-Dist') or [], message.get_all('Provides-Extra') or [])
+
+
+class MetadataProvider(ABC):
+	"""Source of candidate dependencies
+
+	Providers are asked in order, each returns None for candidates it knows nothing about."""
+
+	name = 'abstract'
+	mode = nix.METADATA_MODE
+	# version of the code extracting metadata, part of the metadata cache key
+	version = nix.METADATA_VERSION
+
+	def __init__(self) -> None:
+		# metadata being obtained by candidate URL, a provider shared by several solvers asks for it once,
+		# finished results are kept by the metadata cache and the solvers
+		self._results: Dict[Text, asyncio.Future] = {}
+
+	def accepts(self, candidate: Candidate) -> bool:
+		return True
+
+	@abstractmethod
+	async def get(self, candidate: Candidate) -> Optional[CandidateInfo]:
+		"""metadata of a single candidate, None if the provider doesn't have it"""
+
+	async def get_many(self, candidates: List[Candidate]) -> List[Optional[CandidateInfo]]:
+		loop = asyncio.get_event_loop()
+		pending = []
+		for candidate in candidates:
+			if candidate.url not in self._results:
+				self._results[candidate.url] = loop.create_future()
+				pending.append(candidate)
+		futures = [self._results[candidate.url] for candidate in candidates]
+
+		if pending:
+			try:
+				results = await self._fetch_many(pending)
+			except Exception as e:
+				for candidate in pending:
+					future = self._results.pop(candidate.url)
+					future.set_exception(e)
+					future.exception()  # raised below, other solvers waiting for it get it as well
+				raise
+
+			for candidate, result in zip(pending, results):
+				self._results.pop(candidate.url).set_result(result)
+
+		return [await future for future in futures]
+
+	async def _fetch_many(self, candidates: List[Candidate]) -> List[Optional[CandidateInfo]]:
+		return await asyncio.gather(*(self.get(candidate) for candidate in candidates))
+
+
+class CoreMetadataProvider(MetadataProvider):
+	"""metadata file published next to the distribution on the simple index (PEP 658)
+
+	Metadata of the sdist is preferred, otherwise that of the wheel fitting the marker
+	environment best is used."""
+
+	name = 'PEP 658 metadata'
+	mode = CORE_METADATA_MODE
+	version = CORE_METADATA_VERSION
+
+	def __init__(self, pypi: PyPI, environment: Dict[Text, Text]) -> None:
+		super().__init__()
+		self.pypi = pypi
+		self.environment = environment
+
+	def metadata_url(self, candidate: Candidate) -> Optional[Text]:
+		if candidate.metadata_url is not None:
+			return candidate.metadata_url
+
+		wheel_url = select_wheel((url for url, metadata in candidate.wheels if metadata), self.environment)
+		return f'{wheel_url}.metadata' if wheel_url is not None else None
+
+	def accepts(self, candidate: Candidate) -> bool:
+		return self.metadata_url(candidate) is not None
+
+	async def get(self, candidate: Candidate) -> Optional[CandidateInfo]:
+		text = await self.pypi.fetch(self.metadata_url(candidate))
+		if text is None:
+			return None
+
+		try:
+			return parse_metadata(text)
+		except (ValueError, InvalidMarker, InvalidRequirement) as e:
+			log.warning('Unable to use metadata of %s %s: %s', candidate.name, candidate.version, e)
+			return None
+
+
+class JSONAPIProvider(MetadataProvider):
+	"""requires_dist reported by the PyPI JSON API"""
+
+	name = 'PyPI JSON API'
+	mode = CORE_METADATA_MODE
+	version = CORE_METADATA_VERSION
+
+	def __init__(self, pypi: PyPI, api_url: Text = 'https://pypi.org/pypi', files_host: Text = 'files.pythonhosted.org') -> None:
+		super().__init__()
+		self.pypi = pypi
+		self.api_url = api_url.rstrip('/')
+		self.files_host = files_host
+
+	def accepts(self, candidate: Candidate) -> bool:
+		# only ask about packages which actually come from PyPI
+		return urlsplit(candidate.url).hostname == self.files_host
+
+	async def get(self, candidate: Candidate) -> Optional[CandidateInfo]:
+		data: Optional[Dict[Text, Any]] = await self.pypi.fetch_json(f'{self.api_url}/{candidate.name}/{candidate.raw_version}/json')
+		if data is None:
+			return None
+
+		# PyPI reports null both when there are no requirements and when they are not known
+		info = data.get('info', {})
+		if info.get('requires_dist') is None:
+			return None
+
+		try:
+			return requires_dist_to_info(info['requires_dist'], info.get('provides_extra') or [])
+		except (ValueError, InvalidMarker, InvalidRequirement) as e:
+			log.warning('Unable to use requires_dist of %s %s: %s', candidate.name, candidate.version, e)
+			return None
+
+
+class WheelMetadataProvider(MetadataProvider):
+	"""METADATA file inside the wheel of the release fitting the marker environment best, read with
+	HTTP range requests or from a find-links directory"""
+
+	name = 'wheel metadata'
+	mode = CORE_METADATA_MODE
+	version = CORE_METADATA_VERSION
+
+	def __init__(self, pypi: PyPI, environment: Dict[Text, Text]) -> None:
+		super().__init__()
+		self.pypi = pypi
+		self.environment = environment
+		self.transferred = 0
+
+	def wheel_url(self, candidate: Candidate) -> Optional[Text]:
+		return select_wheel((url for url, _ in candidate.wheels), self.environment)
+
+	def accepts(self, candidate: Candidate) -> bool:
+		return self.wheel_url(candidate) is not None
+
+	async def _read_metadata(self, url: Text) -> Optional[Text]:
+		if urlsplit(url).scheme == 'file':
+			return await asyncio.get_event_loop().run_in_executor(None, read_local_metadata, url_to_path(url))
+
+		wheel = LazyWheel(self.pypi.http, url)
+		try:
+			return await wheel.read_metadata()
+		finally:
+			self.transferred += wheel.transferred
+
+	async def get(self, candidate: Candidate) -> Optional[CandidateInfo]:
+		wheel_url = self.wheel_url(candidate)
+		try:
+			text = await self._read_metadata(wheel_url)
+		except (aiohttp.ClientError, OSError, zipfile.BadZipFile, ValueError) as e:
+			log.warning('Unable to read metadata from wheel %s: %r', wheel_url, e)
+			return None
+
+		if text is None:
+			return None
+
+		try:
+			return parse_metadata(text)
+		except (ValueError, InvalidMarker, InvalidRequirement) as e:
+			log.warning('Unable to use metadata of %s %s: %s', candidate.name, candidate.version, e)
+			return None
+
+
+class NixBuildProvider(MetadataProvider):
+	"""executes setup.py of the sdist inside nix-build, the only provider knowing setup and test requirements"""
+
+	name = 'nix-build'
+	mode = nix.METADATA_MODE
+	version = nix.METADATA_VERSION
+
+	def __init__(self, python_version: Text, executor: nix.NixExecutor, batch_size: int = 1) -> None:
+		super().__init__()
+		self.python_version = python_version
+		self.executor = executor
+		self.batch_size = batch_size
+
+	async def get(self, candidate: Candidate) -> Optional[CandidateInfo]:
+		return await nix.get_package_dependencies(self.executor, self.python_version, candidate)
+
+	async def _get_batch(self, candidates: List[Candidate]) -> List[Optional[CandidateInfo]]:
+		log.debug('Building metadata of %s', ', '.join(f'{x.name} {x.version}' for x in candidates))
+		return await nix.get_batch_dependencies(self.executor, self.python_version, candidates)
+
+	async def _fetch_many(self, candidates: List[Candidate]) -> List[Optional[CandidateInfo]]:
+		if self.batch_size < 2 or len(candidates) < 2:
+			return await super()._fetch_many(candidates)
+
+		batches = [candidates[i:i + self.batch_size] for i in range(0, len(candidates), self.batch_size)]
+		results = [result for batch in await asyncio.gather(*map(self._get_batch, batches)) for result in batch]
+
+		# candidates which failed in a batch are retried individually
+		failed = [candidate for candidate, result in zip(candidates, results) if result is None]
+		retried = iter(await super()._fetch_many(failed))
+
+		return [result if result is not None else next(retried) for result in results]
@@ -1,97 +1,259 @@
 from __future__ import annotations
 
 import asyncio.subprocess
+import collections
+import hashlib
 import json
-from typing import Text, Dict, Tuple
+import os.path
+import re
+import tempfile
+import time
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Text, Dict, List, Optional, Tuple
 
 from packaging.requirements import Requirement
 from pkg_resources import resource_filename
 
+from . import trace
 from .data import Candidate, CandidateInfo, RequirementWrapper
+from .exceptions import NixError, NixTimeoutError
 
+# attribute of package.nix producing unfiltered requirements of a package
+METADATA_MODE = 'metadata'
+METADATA_SUFFIX = '-setup.py-metadata'
+# files extracting metadata in the build, cached metadata is only used if they didn't change
+EXTRACTOR_FILES = ('nix/package.nix', 'nix/package.py')
 
-async def nix_hash(candidate: Candidate) -> Tuple[str, str, str]:
-	proc = await asyncio.create_subprocess_exec('nix-prefetch-url', '--print-path',
-		'--type', candidate.hash_type, candidate.url, candidate.hash,
-		stdout=asyncio.subprocess.PIPE)
+DEFAULT_JOBS = 4
+SHOW_CONFIG_TIMEOUT = 10
+# amount of stderr kept for error messages
+STDERR_TAIL = 64 * 1024
+RE_MAX_JOBS = re.compile(r'^max-jobs\s*=\s*(\S+)\s*$', re.M)
 
-	stdout = await proc.stdout.read()
-	await proc.wait()
+log = getLogger(__name__)
 
-	output = stdout.splitlines()
-	assert output[0].decode() == candidate.hash
-	nix_path = output[1].decode()
 
-	proc = await asyncio.create_subprocess_exec('nix-hash', '--flat', '--base32',
-		'--type', 'sha512', nix_path, stdout=asyncio.subprocess.PIPE)
-	stdout = await proc.stdout.read()
-	await proc.wait()
+def extractor_version() -> Text:
+	digest = hashlib.sha256()
+	for name in EXTRACTOR_FILES:
+		with open(resource_filename(__name__, name), 'rb') as fp:
+			digest.update(fp.read())
+	return digest.hexdigest()[:16]
 
-	output = stdout.splitlines()
-	return 'sha512', output[0].decode(), nix_path
 
+METADATA_VERSION = extractor_version()
 
-async def prefetch(candidate: Candidate) -> Text:
-	proc = await asyncio.create_subprocess_exec('nix-prefetch-url', '--print-path',
-		'--type', candidate.hash_type, candidate.url, candidate.hash,
-		stdout=asyncio.subprocess.PIPE)
 
-	stdout = await proc.stdout.read()
-	await proc.wait()
+async def default_jobs() -> int:
+	"""number of concurrent builds nix is configured for (max-jobs)"""
+	try:
+		proc = await asyncio.create_subprocess_exec(
+			'nix', '--extra-experimental-features', 'nix-command', 'show-config',
+			stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+		)
+	except OSError:
+		return DEFAULT_JOBS
 
-	output = stdout.splitlines()
-	return output[1].decode()
+	try:
+		stdout, _ = await asyncio.wait_for(proc.communicate(), SHOW_CONFIG_TIMEOUT)
+	except asyncio.TimeoutError:
+		proc.kill()
+		await proc.wait()
+		return DEFAULT_JOBS
 
+	if proc.returncode != 0:
+		return DEFAULT_JOBS
+	output = stdout.decode()
 
-async def get_hash(nix_path: Text) -> Tuple[Text, Text]:
-	proc = await asyncio.create_subprocess_exec('nix-hash', '--flat', '--base32', '--type',
-		'sha512', nix_path, stdout=asyncio.subprocess.PIPE)
+	match = RE_MAX_JOBS.search(output)
+	if match is None:
+		return DEFAULT_JOBS
 
-	stdout = await proc.stdout.read()
-	await proc.wait()
+	value = match.group(1)
+	if value == 'auto':
+		return os.cpu_count() or DEFAULT_JOBS
 
-	output = stdout.splitlines()
-	return 'sha512', output[0].decode()
+	return max(int(value), 1) if value.isdigit() else DEFAULT_JOBS
 
 
-async def get_environment(python_version: Text) -> Dict[Text, Text]:
-	arguments = (
-		'nix-build', '-Q', '--no-out-link', "-A", "environment",
-		'--argstr', 'python_version', 'python%s' % python_version,
-		resource_filename(__name__, 'nix/package.nix')
-	)
-	proc = await asyncio.create_subprocess_exec(*arguments, stdout=asyncio.subprocess.PIPE)
+@dataclass
+class NixResult:
+	arguments: Tuple[Text, ...]
+	returncode: int
+	stdout: Text
+	stderr: Text
+	duration: float
 
-	await proc.wait()
-	stdout = await proc.stdout.read()
+	@property
+	def lines(self) -> List[Text]:
+		return self.stdout.splitlines()
 
-	output = stdout.splitlines()
-	filename = output[0].decode()
 
-	with open(filename) as fp:
+class JobSlots:
+	"""Counting semaphore whose holders take several slots at once, granted in FIFO order
+
+	A nix-build building a batch runs as many builds as slots it got, so it takes that many."""
+
+	def __init__(self, total: int) -> None:
+		self.total = total
+		self.free = total
+		self._waiters: collections.deque = collections.deque()
+
+	async def acquire(self, count: int = 1) -> int:
+		"""wait for count slots (at most all of them) and return how many were taken"""
+		count = max(1, min(count, self.total))
+		if not self._waiters and self.free >= count:
+			self.free -= count
+			return count
+
+		future = asyncio.get_event_loop().create_future()
+		self._waiters.append((count, future))
+		try:
+			await future
+		except asyncio.CancelledError:
+			if future.done() and not future.cancelled():
+				self.release(count)  # granted, but the waiting task was cancelled
+			else:
+				self._wake()
+			raise
+
+		return count
+
+	def release(self, count: int) -> None:
+		self.free += count
+		self._wake()
+
+	def _wake(self) -> None:
+		while self._waiters:
+			count, future = self._waiters[0]
+			if future.cancelled():
+				self._waiters.popleft()
+				continue
+			if count > self.free:
+				break
+
+			self._waiters.popleft()
+			self.free -= count
+			future.set_result(None)
+
+
+class NixExecutor:
+	"""Runs nix commands within a limited number of job slots
+
+	Output of both stdout and stderr is read while the process runs, so a chatty build can't
+	block on a full pipe, and every call has a deadline after which the process is killed.
+	A command running several builds takes a slot for each of them."""
+
+	def __init__(self, jobs: Optional[int] = None, timeout: Optional[float] = None) -> None:
+		# max-jobs of nix unless given, only asked for once a command is run
+		self.jobs = jobs
+		self.timeout = timeout
+		self._jobs: Optional[asyncio.Future] = None
+		self._slots: Optional[JobSlots] = None
+
+		self.spawned = 0
+
+	async def get_jobs(self) -> int:
+		if self.jobs is None:
+			if self._jobs is None:
+				self._jobs = asyncio.ensure_future(default_jobs())
+			self.jobs = await asyncio.shield(self._jobs)
+		return self.jobs
+
+	async def get_slots(self) -> JobSlots:
+		# created on first use, so it belongs to the running event loop
+		jobs = await self.get_jobs()
+		if self._slots is None:
+			self._slots = JobSlots(jobs)
+		return self._slots
+
+	@staticmethod
+	async def _read_tail(stream: asyncio.StreamReader, limit: int) -> bytes:
+		tail = b''
+		while True:
+			chunk = await stream.read(64 * 1024)
+			if not chunk:
+				return tail
+			tail = (tail + chunk)[-limit:]
+
+	async def _communicate(self, proc: asyncio.subprocess.Process) -> Tuple[bytes, bytes]:
+		stdout, stderr, _ = await asyncio.gather(proc.stdout.read(), self._read_tail(proc.stderr, STDERR_TAIL), proc.wait())
+		return stdout, stderr
+
+	async def run(self, *arguments: Text, timeout: Optional[float] = None, check: bool = True, jobs: int = 1) -> NixResult:
+		"""run a command in jobs slots, NixError is raised if it fails and check is set"""
+		timeout = timeout if timeout is not None else self.timeout
+
+		queued = time.perf_counter()
+		slots = await self.get_slots()
+		taken = await slots.acquire(jobs)
+		try:
+			start = time.monotonic()
+			trace.tracer.record('nix.queue', queued, time.perf_counter() - queued, command=arguments[0])
+			try:
+				proc = await asyncio.create_subprocess_exec(*arguments, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+			except OSError as e:
+				raise NixError(f'Unable to execute {arguments[0]}: {e}', arguments)
+			self.spawned += 1
+
+			try:
+				stdout, stderr = await asyncio.wait_for(self._communicate(proc), timeout)
+			except asyncio.TimeoutError:
+				proc.kill()
+				await proc.wait()
+				raise NixTimeoutError(f'{arguments[0]} did not finish within {timeout} seconds', arguments)
+		finally:
+			slots.release(taken)
+
+		result = NixResult(arguments, proc.returncode, stdout.decode(), stderr.decode(errors='replace'), time.monotonic() - start)
+		trace.tracer.record('nix.process', time.perf_counter() - result.duration, result.duration, command=arguments[0], returncode=result.returncode)
+		log.debug('%s finished with %d in %.1fs', ' '.join(arguments[:4]), result.returncode, result.duration)
+
+		if check and result.returncode != 0:
+			raise NixError(f'{arguments[0]} failed with exit code {result.returncode}', arguments, result.returncode, result.stderr)
+
+		return result
+
+	async def build(self, *arguments: Text, timeout: Optional[float] = None, check: bool = True) -> List[Text]:
+		"""run nix-build and return the store paths it printed"""
+		result = await self.run('nix-build', *arguments, timeout=timeout, check=check)
+		if check and not result.lines:
+			raise NixError('nix-build did not produce any output', result.arguments, result.returncode, result.stderr)
+
+		return result.lines
+
+
+async def get_environment(executor: NixExecutor, python_version: Text) -> Dict[Text, Text]:
+	with trace.span('nix.environment', python=python_version):
+		output = await executor.build(
+			'-Q', '--no-out-link', "-A", "environment",
+			'--argstr', 'python_version', 'python%s' % python_version,
+			resource_filename(__name__, 'nix/package.nix')
+		)
+
+	with open(output[0]) as fp:
 		return json.load(fp)
 
 
-async def get_package_dependencies(python_version: Text, candidate: Candidate) -> CandidateInfo:
-	arguments = (
-		'nix-build', '-Q', '--no-out-link', '-A', 'metadata',
-		'--argstr', 'python_version', 'python%s' % python_version,
-		'--argstr', 'name', f'{candidate.name}-{candidate.version}',
-		'--arg', 'src', '(import <nixpkgs> {}).fetchurl { url = "%(url)s"; %(hash_type)s = "%(hash)s"; }' % {
-			'url': candidate.url,
-			'hash_type': candidate.hash_type,
-			'hash': candidate.hash,
-		},
-		resource_filename(__name__, 'nix/package.nix')
-	)
-	proc = await asyncio.create_subprocess_exec(*arguments, stdout=asyncio.subprocess.PIPE)
+async def get_package_dependencies(executor: NixExecutor, python_version: Text, candidate: Candidate) -> CandidateInfo:
+	with trace.span('nix.metadata', python=python_version, project=candidate.name, version=str(candidate.version)):
+		output = await executor.build(
+			'-Q', '--no-out-link', '-A', METADATA_MODE,
+			'--argstr', 'python_version', 'python%s' % python_version,
+			'--argstr', 'name', f'{candidate.name}-{candidate.version}',
+			'--arg', 'src', '(import <nixpkgs> {}).fetchurl { url = "%(url)s"; %(hash_type)s = "%(hash)s"; }' % {
+				'url': candidate.url,
+				'hash_type': candidate.hash_type,
+				'hash': candidate.hash,
+			},
+			resource_filename(__name__, 'nix/package.nix')
+		)
 
-	await proc.wait()
-	stdout = await proc.stdout.read()
+	return read_metadata(output[0])
 
-	output = stdout.splitlines()
-	filename = output[0].decode()
 
+def read_metadata(filename: Text) -> CandidateInfo:
 	with open(filename) as fp:
 		metadata = json.load(fp)
 
@@ -105,3 +267,41 @@ async def get_package_dependencies(python_version: Text, candidate: Candidate) -
 	}
 
 	return CandidateInfo(req_setup, req_test, req_install, extras)
+
+
+async def get_batch_dependencies(executor: NixExecutor, python_version: Text, candidates: List[Candidate]) -> List[Optional[CandidateInfo]]:
+	"""build metadata of several candidates with a single nix-build, None is returned for failed builds"""
+	names = [f'{candidate.name}-{candidate.version}' for candidate in candidates]
+	batch = [
+		{'name': name, 'url': candidate.url, 'hash_type': candidate.hash_type, 'hash': candidate.hash}
+			for name, candidate in zip(names, candidates)
+	]
+
+	with tempfile.NamedTemporaryFile('w', prefix='pynixreq-batch-', suffix='.json') as fp:
+		json.dump(batch, fp)
+		fp.flush()
+
+		# the builds of the batch run in parallel, each taking one of the executor's job slots
+		jobs = min(len(candidates), await executor.get_jobs())
+		with trace.span('nix.metadata-batch', python=python_version, candidates=len(candidates), packages=' '.join(names)):
+			result = await executor.run(
+				'nix-build', '-Q', '--no-out-link', '--keep-going', '--max-jobs', str(jobs),
+				'-A', f'batch_{METADATA_MODE}',
+				'--argstr', 'python_version', 'python%s' % python_version,
+				'--arg', 'batch', os.path.abspath(fp.name),
+				resource_filename(__name__, 'nix/package.nix'),
+				check=False,
+				jobs=jobs,
+			)
+
+	if result.returncode != 0:
+		log.warning('Building metadata of %d candidates failed for some of them', len(candidates))
+
+	# store paths are named <hash>-<name>-setup.py-metadata
+	outputs = {}
+	for line in result.lines:
+		basename = os.path.basename(line)
+		if basename.endswith(METADATA_SUFFIX):
+			outputs[basename.split('-', 1)[1][:-len(METADATA_SUFFIX)]] = line
+
+	return [read_metadata(outputs[name]) if name in outputs else None for name in names]
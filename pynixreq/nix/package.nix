@@ -3,6 +3,7 @@
     python_version,
     src ? null,
     name ? null,
+    batch ? null, # JSON file with a list of { name, url, hash_type, hash } of sdists
     nativeBuildInputs ? [],
     buildInputs ? []
 }:
@@ -19,8 +20,18 @@ let
         else nixpkgs.runCommand "${name}-setup.py-metadata" {
             inherit src buildInputs nativeBuildInputs nix_mode;
         } "${bare_python.interpreter} ${./package.py}";
+
+    batch_candidates = if batch == null
+        then abort "batch argument is required"
+        else builtins.fromJSON (builtins.readFile batch);
+
+    get_batch_metadata = nix_mode: map (candidate: get_metadata nix_mode candidate.name (nixpkgs.fetchurl {
+        url = candidate.url;
+        ${candidate.hash_type} = candidate.hash;
+    }) buildInputs) batch_candidates;
 in {
     environment = get_environment;
     metadata = get_metadata "f" name src buildInputs;
     dependencies = get_metadata "t" name src buildInputs;
+    batch_metadata = get_batch_metadata "f";
 }
@@ -1,9 +1,13 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import ast
 import atexit
 import distutils.core
+import glob
+import io
 import json
 import os.path
+import re
 import shutil
 import stat
 import sys
@@ -12,12 +16,63 @@ import tempfile
 import zipfile
 from distutils.dist import Distribution
 from distutils.util import strtobool
+from email.parser import HeaderParser
 
 from packaging.markers import default_environment
 from pkg_resources import parse_requirements
 
-if False:
-	from typing import Text, Union, cast
+try:
+	from configparser import Error as ConfigError, RawConfigParser
+except ImportError:  # Python 2
+	from ConfigParser import Error as ConfigError, RawConfigParser  # type: ignore
+
+try:
+	from typing import TYPE_CHECKING
+except ImportError:  # Python 2 without the typing backport
+	TYPE_CHECKING = False
+
+if TYPE_CHECKING:
+	# names used by the type comments
+	from typing import Any, Callable, Dict, List, Optional, Set, Text, Tuple, Union
+
+# setup() keywords holding requirements, in the order of the output
+REQUIREMENT_KEYWORDS = ('install_requires', 'setup_requires', 'tests_require', 'extras_require')
+METADATA_FIELDS = (
+	# output, setup() keyword, PKG-INFO field
+	('name', 'name', 'Name'),
+	('version', 'version', 'Version'),
+	('author', 'author', 'Author'),
+	('author_email', 'author_email', 'Author-email'),
+	('description', 'description', 'Summary'),
+	('license', 'license', 'License'),
+)
+
+RE_EXTRA = re.compile(r'''\bextra\s*==\s*(['"])(.*?)\1''')
+RE_DANGLING_AND = re.compile(r'^\s*and\s+|\s+and\s*$')
+RE_PROJECT_TABLE = re.compile(r'^\[project\]\s*$', re.M)
+
+# keywords of distutils and setuptools, others are handled by plugins which may change the metadata
+SETUP_KEYWORDS = frozenset((
+	'name', 'version', 'author', 'author_email', 'maintainer', 'maintainer_email', 'url', 'download_url',
+	'project_urls', 'license', 'license_file', 'license_files', 'description', 'long_description',
+	'long_description_content_type', 'keywords', 'platforms', 'classifiers', 'python_requires',
+	'requires', 'provides', 'obsoletes', 'packages', 'py_modules', 'package_dir', 'package_data',
+	'exclude_package_data', 'include_package_data', 'data_files', 'scripts', 'entry_points', 'ext_modules',
+	'ext_package', 'headers', 'libraries', 'cmdclass', 'options', 'zip_safe', 'namespace_packages',
+	'eager_resources', 'dependency_links', 'test_suite', 'test_loader', 'use_2to3', 'use_2to3_fixers',
+	'use_2to3_exclude_fixers', 'convert_2to3_doctests',
+) + REQUIREMENT_KEYWORDS)
+# setup_requires which compute requirements themselves, e.g. pbr reads requirements.txt
+METADATA_PLUGINS = frozenset(('pbr', 'd2to1'))
+
+# distutils requires=: a module or package name with an optional version in parentheses
+RE_DISTUTILS_REQUIRES = re.compile(r'^([\w.]+)\s*(?:\((.*)\))?$')
+
+# modules setup.py commonly reads the version from, extracted along with the files of the root
+VERSION_MODULES = ('__init__.py', 'version.py', '_version.py', '__version__.py', '__about__.py', 'about.py', '__pkginfo__.py')
+
+# value of a setup() keyword or setup.cfg option which is only known after running code
+DYNAMIC = object()
 
 
 if sys.version_info.major < 3:
@@ -30,7 +85,7 @@ if sys.version_info.major < 3:
 
 	def u(text):
 		# type: (Union[Text, str]) -> Text
-		return cast(bytes, text).decode('utf-8') if isinstance(text, bytes) else text
+		return text.decode('utf-8') if isinstance(text, bytes) else text  # type: ignore
 else:
 	def s(data):
 		# type: (Union[Text, str]) -> str
@@ -43,55 +98,119 @@ else:
 		return text
 
 
-def change_permissions(dest):
+def make_writeable(path):
 	# type: (Text) -> None
-
-	def make_writeable(path):
-		# type: (Text) -> None
-		statinfo = os.stat(path)
-		os.chmod(path, statinfo.st_mode | stat.S_IWUSR)
-
-	make_writeable(dest)
-	for root, dirs, files in os.walk(dest):
-		for dir in dirs:
-			make_writeable(os.path.join(root, dir))
-		for file in files:
-			make_writeable(os.path.join(root, file))
-
-
-def extract_source(src):
-	# type: (str) -> Text
-	tmp = tempfile.mkdtemp()
-
-	def cleanup():
-		print('Removing %s ...' % tmp)
-		shutil.rmtree(tmp)
-	atexit.register(cleanup)
-
-	if os.path.isdir(src):
-		dest = os.path.join(tmp, 'src')
-		print('Copying source to %s ...' % dest)
-		shutil.copytree(src, dest)
-	elif tarfile.is_tarfile(src):
-		print('Extracting tar source to %s ...' % tmp)
-		with tarfile.open(src) as tar_fp:
-			dirs = set(map(lambda x: x.split('/', 1)[0], tar_fp.getnames()))
-			if len(dirs) != 1:
-				raise RuntimeError('Expected a single directory, got: %s' % dirs)
-			tar_fp.extractall(tmp)
-			dest = os.path.join(tmp, dirs.pop())
-	elif zipfile.is_zipfile(src):
-		print('Extracting zip source to %s ...' % tmp)
-		with zipfile.ZipFile(src) as zip_fp:
-			dirs = set(map(lambda x: x.split('/', 1)[0], zip_fp.namelist()))
-			if len(dirs) != 1:
-				raise RuntimeError('Expected a single directory, got: %s' % dirs)
-			zip_fp.extractall(tmp)
-			dest = os.path.join(tmp, dirs.pop())
-	else:
-		raise RuntimeError('%s is of unknown format' % src)
-
-	return dest
+	statinfo = os.stat(path)
+	os.chmod(path, statinfo.st_mode | stat.S_IWUSR)
+
+
+def is_metadata_file(path):
+	# type: (Text) -> bool
+	"""whether a file (relative to the source root) is likely needed to get metadata
+
+	These are files in the root (setup.py, setup.cfg, PKG-INFO, READMEs and requirements
+	files setup.py reads), egg-info and modules holding the version of a package."""
+	parts = path.split('/')
+	if len(parts) == 1:
+		return True
+	if any(part.endswith('.egg-info') for part in parts[:2]):
+		return True
+
+	return len(parts) <= 3 and (parts[-1] in VERSION_MODULES or parts[-1].upper().startswith('VERSION'))
+
+
+class Source(object):
+	"""sdist extracted into a temporary directory on demand
+
+	Only files selected by extract() are written, so metadata of a large sdist can be obtained
+	without unpacking its sources and test data."""
+
+	def __init__(self, src):
+		# type: (str) -> None
+		self.src = src
+		self.tmp = tempfile.mkdtemp()
+		self.extracted = set()  # type: Set[Text]
+		atexit.register(self.cleanup)
+
+		if os.path.isdir(src):
+			self.kind = 'directory'
+			self.root = None  # type: Optional[Text]
+			self.dest = os.path.join(self.tmp, 'src')
+			self.names = [
+				os.path.relpath(os.path.join(root, name), src).replace(os.sep, '/')
+				for root, _, files in os.walk(src) for name in files
+			]
+		elif tarfile.is_tarfile(src):
+			self.kind = 'tar'
+			with tarfile.open(src) as tar_fp:
+				names = [member.name for member in tar_fp.getmembers() if not member.isdir()]
+			self.root, self.names = self._split_root(names)
+			self.dest = os.path.join(self.tmp, self.root)
+		elif zipfile.is_zipfile(src):
+			self.kind = 'zip'
+			with zipfile.ZipFile(src) as zip_fp:
+				names = [name for name in zip_fp.namelist() if not name.endswith('/')]
+			self.root, self.names = self._split_root(names)
+			self.dest = os.path.join(self.tmp, self.root)
+		else:
+			raise RuntimeError('%s is of unknown format' % src)
+
+	@staticmethod
+	def _split_root(names):
+		# type: (List[Text]) -> Tuple[Text, List[Text]]
+		dirs = set(map(lambda x: x.split('/', 1)[0], names))
+		if len(dirs) != 1:
+			raise RuntimeError('Expected a single directory, got: %s' % dirs)
+
+		return dirs.pop(), [name.split('/', 1)[1] for name in names if '/' in name]
+
+	def cleanup(self):
+		# type: () -> None
+		print('Removing %s ...' % self.tmp)
+		shutil.rmtree(self.tmp)
+
+	@property
+	def complete(self):
+		# type: () -> bool
+		return len(self.extracted) == len(self.names)
+
+	def extract(self, predicate=None):
+		# type: (Optional[Callable[[Text], bool]]) -> int
+		"""extract files matching predicate (all by default) which aren't extracted yet, return their number"""
+		names = [name for name in self.names if name not in self.extracted and (predicate is None or predicate(name))]
+		if not names and os.path.isdir(self.dest):
+			return 0
+
+		print('Extracting %d of %d files of %s to %s ...' % (len(names), len(self.names), self.kind, self.dest))
+		if self.kind == 'directory':
+			for name in names:
+				path = os.path.join(self.dest, *name.split('/'))
+				if not os.path.isdir(os.path.dirname(path)):
+					os.makedirs(os.path.dirname(path))
+				shutil.copy(os.path.join(self.src, *name.split('/')), path)
+		elif self.kind == 'tar':
+			wanted = set('%s/%s' % (self.root, name) for name in names)
+			with tarfile.open(self.src) as tar_fp:
+				tar_fp.extractall(self.tmp, [member for member in tar_fp.getmembers() if member.name in wanted])
+		else:
+			with zipfile.ZipFile(self.src) as zip_fp:
+				for name in names:
+					zip_fp.extract('%s/%s' % (self.root, name), self.tmp)
+
+		if not os.path.isdir(self.dest):
+			os.makedirs(self.dest)
+
+		# only files written now (and their directories) are made writeable, not the whole tree
+		paths = set([self.dest])
+		for name in names:
+			parts = name.split('/')
+			paths.update(os.path.join(self.dest, *parts[:end]) for end in range(1, len(parts) + 1))
+		for path in sorted(paths):
+			if os.path.exists(path) and not os.path.islink(path):
+				make_writeable(path)
+
+		self.extracted.update(names)
+		return len(names)
 
 
 def get_distro(src):
@@ -126,6 +245,302 @@ def get_distro(src):
 	return distutils.core._setup_distribution
 
 
+def run_setup(source):
+	# type: (Source) -> Distribution
+	"""run setup.py of a partially extracted source, the rest is extracted if setup.py misses something"""
+	try:
+		return get_distro(source.dest)
+	except (ImportError, IOError, OSError) as e:
+		if source.complete:
+			raise
+		print('setup.py failed with partially extracted source (%s: %s), extracting the rest ...' % (type(e).__name__, e))
+
+	# modules of the source imported by the failed attempt could be incomplete
+	for name, module in list(sys.modules.items()):
+		if os.path.abspath(getattr(module, '__file__', None) or '/').startswith(source.dest + os.sep):
+			del sys.modules[name]
+
+	source.extract()
+	return get_distro(source.dest)
+
+
+class DynamicMetadata(Exception):
+	"""requirements can't be known without executing setup.py"""
+
+
+def read_text(path):
+	# type: (Text) -> Optional[Text]
+	if not os.path.isfile(path):
+		return None
+
+	with io.open(path, encoding='utf-8', errors='replace') as fp:
+		return fp.read()
+
+
+def split_lines(value):
+	# type: (Any) -> List[Text]
+	if isinstance(value, (list, tuple)):
+		return [u(x).strip() for x in value if u(x).strip()]
+
+	return [line.strip() for line in u(value).splitlines() if line.strip() and not line.strip().startswith('#')]
+
+
+def analyze_setup_py(src):
+	# type: (Text) -> Dict[str, Any]
+	"""literal keywords of the setup() call, requirement keywords set by code are DYNAMIC"""
+	with open(os.path.join(src, 'setup.py'), 'rb') as fp:
+		try:
+			tree = ast.parse(fp.read(), 'setup.py')
+		except SyntaxError as e:
+			raise DynamicMetadata('setup.py can not be parsed: %s' % e)
+
+	calls = [
+		node for node in ast.walk(tree)
+		if isinstance(node, ast.Call) and getattr(node.func, 'id', getattr(node.func, 'attr', None)) == 'setup'
+	]
+	if len(calls) != 1:
+		raise DynamicMetadata('setup.py calls setup() %d times' % len(calls))
+
+	call = calls[0]
+	if getattr(call, 'starargs', None) or getattr(call, 'kwargs', None) \
+			or any(keyword.arg is None for keyword in call.keywords) \
+			or any(type(arg).__name__ == 'Starred' for arg in call.args):
+		raise DynamicMetadata('setup() is called with unpacked arguments')
+
+	unknown = sorted(keyword.arg for keyword in call.keywords if keyword.arg not in SETUP_KEYWORDS)
+	if unknown:
+		raise DynamicMetadata('setup() is called with keywords of plugins: %s' % ', '.join(unknown))
+
+	keywords = {}
+	for keyword in call.keywords:
+		try:
+			keywords[keyword.arg] = ast.literal_eval(keyword.value)
+		except (ValueError, TypeError, SyntaxError):
+			keywords[keyword.arg] = DYNAMIC
+
+	return keywords
+
+
+def read_setup_cfg(src):
+	# type: (Text) -> Dict[str, Any]
+	"""declarative metadata and requirements of setup.cfg, options using file: or attr: are DYNAMIC"""
+	text = read_text(os.path.join(src, 'setup.cfg'))
+	if text is None:
+		return {}
+
+	parser = RawConfigParser()
+	parser.optionxform = str  # type: ignore  # setuptools keeps case of extras
+	try:
+		if hasattr(parser, 'read_string'):
+			parser.read_string(text)
+		else:
+			parser.readfp(io.StringIO(text))
+	except ConfigError as e:
+		raise DynamicMetadata('setup.cfg can not be parsed: %s' % e)
+
+	def parse_list(value):
+		# type: (Text) -> Any
+		if value.strip().startswith(('file:', 'attr:')):
+			return DYNAMIC
+		if '\n' not in value.strip() and ';' in value:
+			# either a list separated by semicolons or a requirement with a marker
+			return DYNAMIC
+		return split_lines(value)
+
+	result = {}  # type: Dict[str, Any]
+	if parser.has_section('metadata'):
+		for _, keyword, _ in METADATA_FIELDS:
+			if parser.has_option('metadata', keyword):
+				value = parser.get('metadata', keyword)
+				result[keyword] = DYNAMIC if value.strip().startswith(('file:', 'attr:')) else value.strip()
+
+	if parser.has_section('options'):
+		for keyword in REQUIREMENT_KEYWORDS[:-1]:
+			if parser.has_option('options', keyword):
+				result[keyword] = parse_list(parser.get('options', keyword))
+
+	if parser.has_section('options.extras_require'):
+		result['extras_require'] = {
+			extra: parse_list(value) for extra, value in parser.items('options.extras_require')
+		}
+		if any(value is DYNAMIC for value in result['extras_require'].values()):
+			result['extras_require'] = DYNAMIC
+
+	return result
+
+
+def read_requires_txt(text):
+	# type: (Text) -> Tuple[List[Text], Dict[Text, List[Text]]]
+	"""requirements of an egg-info, sections are named [extra:marker]"""
+	install = []  # type: List[Text]
+	extras = {}  # type: Dict[Text, List[Text]]
+	extra, marker = None, None
+
+	for line in split_lines(text):
+		if line.startswith('[') and line.endswith(']'):
+			extra, _, marker = line[1:-1].partition(':')
+			extra = extra.strip() or None
+			marker = marker.strip() or None
+			if extra is not None:
+				extras.setdefault(extra, [])
+			continue
+
+		requirement = '%s; %s' % (line, marker) if marker else line
+		if extra is None:
+			install.append(requirement)
+		else:
+			extras[extra].append(requirement)
+
+	return install, extras
+
+
+def convert_distutils_requires(requires):
+	# type: (Any) -> List[Text]
+	"""turn requires= of distutils, e.g. "foo (>1.0, <2.0)", into requirements"""
+	result = []
+	for text in split_lines(requires):
+		match = RE_DISTUTILS_REQUIRES.match(text)
+		if match is None:
+			raise DynamicMetadata('Unsupported requires entry %r' % text)
+
+		name, version = match.group(1), (match.group(2) or '').strip()
+		if version and version[0].isdigit():
+			version = '==' + version
+		result.append(name + version)
+
+	return result
+
+
+def normalize_requirements(requirements):
+	# type: (List[Text]) -> Set[Text]
+	try:
+		return set(u(str(requirement)) for requirement in parse_requirements(requirements))
+	except ValueError as e:
+		raise DynamicMetadata('Invalid requirement: %s' % e)
+
+
+def check_requires_txt(egg_info, install, extras):
+	# type: (Text, List[Text], Dict[Text, Any]) -> None
+	"""egg-info of the sdist was written by setup.py, its requirements have to be the literal ones"""
+	egg_install, egg_extras = read_requires_txt(read_text(os.path.join(egg_info, 'requires.txt')) or '')
+
+	def key(extra):
+		# type: (Text) -> Text
+		return re.sub('[^A-Za-z0-9.-]+', '_', u(extra)).lower()
+
+	if normalize_requirements(egg_install) != normalize_requirements(split_lines(install)) or \
+			{key(extra): normalize_requirements(value) for extra, value in egg_extras.items()} != \
+			{key(extra): normalize_requirements(split_lines(value)) for extra, value in extras.items()}:
+		raise DynamicMetadata('requirements of setup.py differ from %s' % os.path.basename(egg_info))
+
+
+def split_requires_dist(requires_dist, provides_extra):
+	# type: (List[Text], List[Text]) -> Tuple[List[Text], Dict[Text, List[Text]]]
+	"""turn Requires-Dist of PKG-INFO into install requirements and extras"""
+	install = []  # type: List[Text]
+	extras = {extra: [] for extra in provides_extra}  # type: Dict[Text, List[Text]]
+
+	for text in requires_dist:
+		requirement, _, marker = text.partition(';')
+		found = RE_EXTRA.findall(marker)
+		if not found:
+			install.append(text.strip())
+			continue
+
+		remaining = RE_DANGLING_AND.sub('', RE_EXTRA.sub('', marker).strip())
+		if remaining.startswith('(') and remaining.endswith(')') and remaining.count('(') == 1:
+			remaining = remaining[1:-1]
+		if len(found) > 1 or 'extra' in remaining or (remaining and ' or ' in marker):
+			raise DynamicMetadata('Unsupported marker in %r' % text)
+
+		requirement = requirement.strip()
+		extras.setdefault(found[0][1], []).append('%s; %s' % (requirement, remaining) if remaining else requirement)
+
+	return install, extras
+
+
+def metadata_version(pkg_info):
+	# type: (Any) -> Tuple[int, ...]
+	try:
+		return tuple(int(x) for x in (pkg_info.get('Metadata-Version') or '').split('.'))
+	except ValueError:
+		return ()
+
+
+def read_static_metadata(src):
+	# type: (Text) -> Dict[str, Any]
+	"""metadata and requirements from PKG-INFO, egg-info and setup.cfg without running setup.py
+
+	DynamicMetadata is raised unless all requirements are known from the files. With a setup.py
+	this requires its setup() call to only pass literal requirements and keywords of setuptools,
+	without plugins like pbr, which agree with the egg-info if there is one; PKG-INFO is trusted
+	when it declares requirements static (metadata 2.2) or when there is no setup.py to run."""
+	pkg_info_text = read_text(os.path.join(src, 'PKG-INFO'))
+	pkg_info = HeaderParser().parsestr(pkg_info_text) if pkg_info_text is not None else None
+	has_setup_py = os.path.isfile(os.path.join(src, 'setup.py'))
+
+	if not has_setup_py and pkg_info is None:
+		raise DynamicMetadata('there is neither setup.py nor PKG-INFO')
+
+	keywords = analyze_setup_py(src) if has_setup_py else {}
+	config = read_setup_cfg(src)
+
+	values = {}  # type: Dict[str, Any]
+	for keyword in set(keywords) | set(config):
+		if keyword in keywords and keyword in config and keywords[keyword] != config[keyword]:
+			values[keyword] = DYNAMIC
+		else:
+			values[keyword] = keywords.get(keyword, config.get(keyword))
+
+	requires_dist = None  # type: Optional[Tuple[List[Text], Dict[Text, List[Text]]]]
+	if pkg_info is not None:
+		dynamic = [field.lower() for field in pkg_info.get_all('Dynamic') or []]
+		if (not has_setup_py and pkg_info.get_all('Requires-Dist')) or (metadata_version(pkg_info) >= (2, 2) and 'requires-dist' not in dynamic):
+			requires_dist = split_requires_dist(pkg_info.get_all('Requires-Dist') or [], pkg_info.get_all('Provides-Extra') or [])
+
+	egg_info = sorted(glob.glob(os.path.join(src, '*.egg-info')) + glob.glob(os.path.join(src, '*', '*.egg-info')))
+	if requires_dist is None and not has_setup_py and egg_info:
+		requires_dist = read_requires_txt(read_text(os.path.join(egg_info[0], 'requires.txt')) or '')
+
+	if requires_dist is not None:
+		values['install_requires'], values['extras_require'] = requires_dist
+	elif has_setup_py and RE_PROJECT_TABLE.search(read_text(os.path.join(src, 'pyproject.toml')) or ''):
+		# setuptools reads dependencies of the [project] table, there is no TOML parser to do the same
+		raise DynamicMetadata('requirements may come from pyproject.toml')
+
+	for keyword in REQUIREMENT_KEYWORDS + ('requires',):
+		if values.get(keyword) is DYNAMIC:
+			raise DynamicMetadata('%s is set by code' % keyword)
+
+	plugins = METADATA_PLUGINS.intersection(re.split('[^A-Za-z0-9._-]', requirement, 1)[0].lower() for requirement in split_lines(values.get('setup_requires') or []))
+	if plugins:
+		raise DynamicMetadata('setup_requires %s, which computes the metadata' % ', '.join(sorted(plugins)))
+
+	if requires_dist is None:
+		if egg_info:
+			check_requires_txt(egg_info[0], values.get('install_requires') or [], values.get('extras_require') or {})
+		if values.get('requires'):
+			values['install_requires'] = split_lines(values.get('install_requires') or []) + convert_distutils_requires(values['requires'])
+
+	def field(keyword, header):
+		# type: (str, str) -> Text
+		if pkg_info is not None and pkg_info.get(header):
+			return u(pkg_info.get(header))
+		value = values.get(keyword)
+		return u(value) if value is not None and value is not DYNAMIC else 'UNKNOWN'
+
+	extras = values.get('extras_require') or {}
+	return {
+		'metadata': {name: field(keyword, header) for name, keyword, header in METADATA_FIELDS},
+		'requirements': {
+			'install': split_lines(values.get('install_requires') or []),
+			'test': split_lines(values.get('tests_require') or []),
+			'setup': split_lines(values.get('setup_requires') or []),
+			'extras': {u(extra): split_lines(value) for extra, value in extras.items()},
+		}
+	}
+
+
 def is_nix_mode():
 	# type: () -> bool
 	return strtobool(os.environ.get('nix_mode', 'f'))
@@ -158,26 +573,37 @@ def main():
 			fp.write(json.dumps(default_environment(), indent=4, ensure_ascii=False, sort_keys=True).encode('utf-8'))
 		return
 
-	dest = extract_source(os.environ['src'])
-	change_permissions(dest)
-	distro = get_distro(dest)
-
-	output = {
-		'metadata': {
-			'name': u(distro.get_name()),
-			'version': u(distro.get_version()),
-			'author': u(distro.get_author()),
-			'author_email': u(distro.get_author_email()),
-			'description': u(distro.get_description()),
-			'license': u(distro.get_license())
-		},
-		'requirements': {
-			'install': [u(x) for x in req_names(getattr(distro, 'install_requires', distro.get_requires()))],
-			'test': [u(x) for x in req_names(getattr(distro, 'tests_require', []) or [])],
-			'setup': [u(x) for x in req_names(getattr(distro, 'setup_requires', []))],
-			'extras': req_names_extras(getattr(distro, 'extras_require', {}))
+	source = Source(os.environ['src'])
+	source.extract(is_metadata_file)
+
+	try:
+		output = read_static_metadata(source.dest)
+		print('Using static metadata of %s' % source.dest)
+	except DynamicMetadata as e:
+		print('Running setup.py, static metadata is incomplete: %s' % e)
+		distro = run_setup(source)
+		output = {
+			'metadata': {
+				'name': u(distro.get_name()),
+				'version': u(distro.get_version()),
+				'author': u(distro.get_author()),
+				'author_email': u(distro.get_author_email()),
+				'description': u(distro.get_description()),
+				'license': u(distro.get_license())
+			},
+			'requirements': {
+				'install': [u(x) for x in getattr(distro, 'install_requires', distro.get_requires())],
+				'test': [u(x) for x in getattr(distro, 'tests_require', []) or []],
+				'setup': [u(x) for x in getattr(distro, 'setup_requires', [])],
+				'extras': getattr(distro, 'extras_require', {})
+			}
 		}
-	}
+
+	requirements = output['requirements']
+	requirements['install'] = [u(x) for x in req_names(requirements['install'])]
+	requirements['test'] = [u(x) for x in req_names(requirements['test'])]
+	requirements['setup'] = [u(x) for x in req_names(requirements['setup'])]
+	requirements['extras'] = req_names_extras(requirements['extras'])
 
 	with open(os.environ['out'], 'wb') as fp:
 		fp.write(json.dumps(output, indent=4, ensure_ascii=False, sort_keys=True).encode('utf-8'))
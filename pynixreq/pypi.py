@@ -1,26 +1,91 @@
 from __future__ import annotations
 
 import asyncio
-from typing import Any, Dict, List, Optional
+import codecs
+import json
+import math
+import time
+from collections import deque
+from logging import getLogger
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
 from urllib.parse import urljoin
 
 import aiohttp
 from packaging.utils import canonicalize_name
-from packaging.version import Version
 
+from . import trace
+from .cache import IndexCache, IndexEntry, default_cache_dir
 from .data import Candidate
 from .exceptions import PyPINotAvailableError
-from .pypiparser import PyPIParser
+from .findlinks import FindLinks
+from .http import HTTPClient
+from .pypiparser import ACCEPT, get_parser
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_INDEX = 'https://pypi.org/simple'
+
+# response times remembered per index, hedging starts once there are enough of them
+LATENCY_SAMPLES = 200
+MIN_LATENCY_SAMPLES = 20
+
+T = TypeVar('T')
+
+log = getLogger(__name__)
+
+
+class LatencyTracker:
+	"""Recent response times of an index"""
+
+	def __init__(self, size: int = LATENCY_SAMPLES) -> None:
+		self.samples: Deque[float] = deque(maxlen=size)
+
+	def add(self, seconds: float) -> None:
+		self.samples.append(seconds)
+
+	def percentile(self, percent: float) -> Optional[float]:
+		"""response time not exceeded by percent of the samples, None until there are enough of them"""
+		if len(self.samples) < MIN_LATENCY_SAMPLES:
+			return None
+
+		ordered = sorted(self.samples)
+		return ordered[min(len(ordered) - 1, max(0, math.ceil(percent / 100 * len(ordered)) - 1))]
 
 
 class PyPI:
 	def __init__(self, config: Dict[str, Any]):
-		self.index: str = config.get('index-url', 'https://pypi.org/simple')
-		self.extra_index: Optional[str] = config.get('extra-index-url')
+		self.index: str = config.get('index-url') or DEFAULT_INDEX
+		extra_index = config.get('extra-index-url') or []
+		self.extra_indexes: List[str] = [extra_index] if isinstance(extra_index, str) else list(extra_index)
+		self.priorities: Dict[str, int] = config.get('index-priority') or {}
+		# by default the index with the highest priority which has a project shadows the others
+		self.merge_indexes: bool = config.get('merge-indexes', False)
+		self.offline: bool = config.get('offline', False)
 
-		self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=8, verify_ssl=False))
+		# a request to an index slower than this percentile of its recent requests is sent once more
+		self.hedge_percentile: Optional[float] = config.get('hedge-percentile')
+		self.latencies: Dict[str, LatencyTracker] = {}
+		self.hedged = 0
 
-	def get_urls(self, name: str) -> List[str]:
+		self.cache: Optional[IndexCache] = None
+		if not config.get('no-cache'):
+			self.cache = IndexCache(config.get('cache-dir') or default_cache_dir(), config.get('cache-ttl', 0))
+
+		# local directories of sdists and wheels, projects found in them are never looked up on indexes
+		self.find_links: List[FindLinks] = [FindLinks(directory) for directory in config.get('find-links') or []]
+
+		self.http = HTTPClient(config)
+
+	def get_priority(self, index: str) -> int:
+		"""priority of an index, extra indexes are preferred unless configured otherwise"""
+		return self.priorities.get(index, 0 if index == self.index else 1)
+
+	def get_indexes(self) -> List[str]:
+		"""indexes ordered by priority, the highest first"""
+		indexes = list(dict.fromkeys(self.extra_indexes + [self.index]))
+		return sorted(indexes, key=lambda index: -self.get_priority(index))
+
+	@staticmethod
+	def get_url(index: str, name: str) -> str:
 		def ensure_slash(url: str) -> str:
 			return f'{url.rstrip("/")}/'
 
@@ -29,34 +94,154 @@ class PyPI:
 		# zc.buildout -> zc-buildout/
 		normalized_name = ensure_slash(canonicalize_name(name))
 
-		urls = []
-		if self.extra_index:
-			urls.append(urljoin(ensure_slash(self.extra_index), normalized_name))
-		urls.append(urljoin(ensure_slash(self.index), normalized_name))
+		return urljoin(ensure_slash(index), normalized_name)
+
+	def get_urls(self, name: str) -> List[str]:
+		return [self.get_url(index, name) for index in self.get_indexes()]
+
+	async def fetch(self, url: str) -> Optional[str]:
+		"""return body of a small document, or None if it is not available"""
+		try:
+			async with self.http.get(url) as response:  # type: aiohttp.ClientResponse
+				if response.status != 200:
+					return None
+
+				return await response.text()
+		except (aiohttp.ClientError, aiohttp.ClientConnectionError) as e:
+			log.warning('Unable to fetch %s: %r', url, e)
+			return None
+
+	async def fetch_json(self, url: str) -> Optional[Any]:
+		text = await self.fetch(url)
+		try:
+			return json.loads(text) if text is not None else None
+		except ValueError:
+			log.warning('Invalid JSON in %s', url)
+			return None
 
-		return urls
+	async def get_package_versions(self, name: str) -> Dict[str, Candidate]:
+		"""candidates of a project from the index with the highest priority which has it
 
-	async def get_package_versions(self, name: str) -> Dict[Version, Candidate]:
-		urls = self.get_urls(name)
+		With merge-indexes, versions of all indexes are combined and a version found on several
+		comes from the one with the highest priority."""
+		local: Dict[str, Candidate] = {}
+		directories = [find_links for find_links in self.find_links if name in find_links]
+		for find_links in directories:
+			for version, candidate in (await find_links.get_package_versions(name)).items():
+				local.setdefault(version, candidate)
+		if local:
+			return local
+		if directories:
+			# candidates are sdists, wheels alone only provide metadata
+			log.warning('Only wheels of %s found in %s, looking for sdists on the indexes', name, ', '.join(find_links.directory for find_links in directories))
 
-		for url in urls:
+		indexes = self.get_indexes()
+		pages = await asyncio.gather(*(self.get_index_versions(index, name) for index in indexes))
+		if all(page is None for page in pages):
+			raise PyPINotAvailableError(f"Error obtaining data from PyPI for {name}; tried { ', '.join(self.get_urls(name)) }")
+
+		if not self.merge_indexes:
+			return next(page for page in pages if page is not None)
+
+		candidates: Dict[str, Candidate] = {}
+		for page in pages:
+			for version, candidate in (page or {}).items():
+				candidates.setdefault(version, candidate)
+
+		return candidates
+
+	async def get_index_versions(self, index: str, name: str) -> Optional[Dict[str, Candidate]]:
+		"""candidates of a project on a single index, None if the index doesn't have it"""
+		url = self.get_url(index, name)
+
+		entry = self.cache.get(index, name) if self.cache else None
+		if entry is not None and (self.offline or entry.is_fresh(self.cache.ttl)):
+			trace.tracer.record('index.fetch', time.perf_counter(), 0.0, project=name, url=url, source='cache')
+			return entry.candidates
+
+		if self.offline:
+			return None
+
+		fetched = await self._hedged(index, lambda hedge: self._fetch_page(url, name, entry, hedge))
+		if fetched is None:
+			return None
+
+		if self.cache:
+			if fetched is entry:
+				self.cache.touch(index, name, entry)
+			else:
+				self.cache.put(index, name, fetched)
+
+		return fetched.candidates
+
+	async def _hedged(self, index: str, fetch: Callable[[bool], Awaitable[Optional[T]]]) -> Optional[T]:
+		"""call fetch, and once more when the index takes longer than usual, the first result wins"""
+		latencies = self.latencies.setdefault(index, LatencyTracker())
+		delay = latencies.percentile(self.hedge_percentile) if self.hedge_percentile else None
+		start = time.monotonic()
+
+		if delay is None:
+			result = await fetch(False)
+		else:
+			first = asyncio.ensure_future(fetch(False))
+			done, _ = await asyncio.wait({first}, timeout=delay)
+			if done:
+				result = first.result()
+			else:
+				self.hedged += 1
+				pending = {first, asyncio.ensure_future(fetch(True))}
+				result = None
+				try:
+					while pending and result is None:
+						done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+						result = next((task.result() for task in done if task.result() is not None), None)
+				finally:
+					for task in pending:
+						task.cancel()
+
+		if result is not None:
+			latencies.add(time.monotonic() - start)
+
+		return result
+
+	async def _fetch_page(self, url: str, name: str, entry: Optional[IndexEntry], hedge: bool = False) -> Optional[IndexEntry]:
+		"""download and parse an index page, the cached entry is returned if it is still valid"""
+		headers = {'Accept': ACCEPT}
+		if entry is not None and entry.etag:
+			headers['If-None-Match'] = entry.etag
+		if entry is not None and entry.last_modified:
+			headers['If-Modified-Since'] = entry.last_modified
+
+		with trace.span('index.fetch', project=name, url=url, hedge=hedge) as span:
 			try:
-				async with self.session.get(url) as response:  # type: aiohttp.ClientResponse
+				async with self.http.get(url, headers=headers) as response:  # type: aiohttp.ClientResponse
+					span.set(status=response.status)
+					if response.status == 304 and entry is not None:
+						return entry
+
 					if response.status != 200:
 						print(f'{url}: {response.status} error - {response.reason}')
-						continue
+						return None
+
+					# parse the page while it is being downloaded, time spent parsing is summed up
+					parser = get_parser(response.content_type, url, name)
+					decoder = codecs.getincrementaldecoder(response.charset or 'utf-8')(errors='replace')
+					parsing = 0.0
+					async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+						start = time.perf_counter()
+						parser.feed(decoder.decode(chunk))
+						parsing += time.perf_counter() - start
+					start = time.perf_counter()
+					parser.feed(decoder.decode(b'', final=True))
+					parser.close()
+					parsing += time.perf_counter() - start
+					# parsing interleaves with the download, it is recorded as one span ending with it
+					trace.tracer.record('index.parse', time.perf_counter() - parsing, parsing, project=name, candidates=len(parser.candidates))
 
-					html = await response.text()
+					return IndexEntry(url, parser.candidates, response.headers.get('ETag'), response.headers.get('Last-Modified'), time.time())
 			except (aiohttp.ClientError, aiohttp.ClientConnectionError) as e:
 				print(f'{url}: {repr(e)}')
-				continue
-			else:
-				parser = PyPIParser(url, name)
-				parser.feed(html)
-				parser.close()
-				return parser.candidates
-
-		raise PyPINotAvailableError(f"Error obtaining data from PyPI for {name}; tried { ', '.join(urls) }")
+				return None
 
 	# async def get_requirement(self, session: aiohttp.ClientSession, requirement: Requirement) -> Package:
 	# 	print(f'Fetching {requirement}')
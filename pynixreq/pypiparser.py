@@ -1,39 +1,55 @@
 from __future__ import annotations
 
+import json
 import posixpath
 import re
-from html.parser import HTMLParser
-from typing import Dict, List, Tuple, Optional
-from urllib.parse import urljoin, urlsplit
-
-from packaging.specifiers import SpecifierSet
-from packaging.version import parse as version_parse, Version
+from html import unescape
+from typing import Any, Dict, List, Tuple, Optional
+from urllib.parse import urljoin
 
 from pynixreq.data import Candidate
 
 RE_HASH = re.compile(r'(sha1|sha224|sha384|sha256|sha512|md5)=([a-f0-9]+)')
 SDIST_EXTS = ('.tar.xz', '.txz', '.tar.lz', '.tlz', '.tar.lzma', '.tar.bz2', '.tbz', '.tar.gz', '.tgz', '.zip', '.tar')
+SDIST_RANK = {ext: rank for rank, ext in enumerate(SDIST_EXTS)}
+WHEEL_EXT = '.whl'
+FILE_EXTS = SDIST_EXTS + (WHEEL_EXT,)
+HASH_PREFERENCE = ('sha256', 'sha512', 'sha384', 'sha224', 'sha1', 'md5')
+
+CONTENT_TYPE_JSON = 'application/vnd.pypi.simple.v1+json'
+ACCEPT = f'{CONTENT_TYPE_JSON}, application/vnd.pypi.simple.v1+html;q=0.2, text/html;q=0.1'
+
+NAME_SEPARATORS = str.maketrans('_.', '--')
+
+RE_ANCHOR = re.compile(r'<a\s((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>([^<]*)</a\s*>', re.I)
+RE_ANCHOR_END = re.compile(r'</a\s*>', re.I)
+RE_ATTRIBUTE = re.compile(r'([^\s=]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))')
 
+RE_JSON_FILES = re.compile(r'"files"\s*:\s*\[')
+RE_JSON_SEPARATOR = re.compile(r'[\s,]*')
+
+
+class IndexParser:
+	"""Common logic turning files listed on a simple index page into candidates"""
 
-class PyPIParser(HTMLParser):
 	def __init__(self, index_url: str, base_name: str):
 		self.index_url = index_url
 		self.base_name = base_name
 
-		self._attrs: List[Tuple[str, str]] = None
-		self._data: str = None
-
 		basename_version = re.sub(r'[-_.]', r'[-_.]', base_name.lower()) + r'-([a-z0-9_.!+-]+)'
 		self._re_version = re.compile(basename_version)
+		self._prefix = base_name.lower().translate(NAME_SEPARATORS)
 
-		self.candidates: Dict[Version, Candidate] = {}
+		self._ranks: Dict[str, int] = {}
+		self._metadata: Dict[str, str] = {}
+		self._wheels: Dict[str, List[Tuple[str, bool]]] = {}
+		self.candidates: Dict[str, Candidate] = {}
 
 		super().__init__()
 
 	@staticmethod
 	def get_hash(url: str) -> Tuple[Optional[str], Optional[str]]:
-		parts = urlsplit(url)
-		match = RE_HASH.search(parts.fragment)
+		match = RE_HASH.search(url.partition('#')[2])
 		if match:
 			name = match.group(1)
 			value = match.group(2)
@@ -43,9 +59,7 @@ class PyPIParser(HTMLParser):
 		return None, None
 
 	def get_url(self, url: str) -> str:
-		new_url = urljoin(self.index_url, url)
-		pos = new_url.find('#')
-		return new_url[:pos if pos > -1 else len(new_url)]
+		return urljoin(self.index_url, url.partition('#')[0])
 
 	@staticmethod
 	def splitext(path: str) -> Tuple[str, str]:
@@ -56,55 +70,205 @@ class PyPIParser(HTMLParser):
 
 		return base, ext
 
-	def get_version(self, filebase: str) -> Version:
+	def get_version(self, filebase: str) -> str:
+		"""return the version string of a file, it is parsed only once the candidate is examined"""
+		length = len(self._prefix)
+		if filebase[length:length + 1] == '-' and filebase[:length].lower().translate(NAME_SEPARATORS) == self._prefix:
+			return filebase[length + 1:].lower()
+
 		match = self._re_version.search(filebase.lower())
 		assert match, "Couldn't find version in %r" % filebase
-		return version_parse(match.group(1))
+		return match.group(1)
 
-	def process_package(self):
-		assert self._attrs is not None
-		assert self._data is not None
+	@staticmethod
+	def get_wheel_version(filename: str) -> str:
+		# {distribution}-{version}(-{build tag})?-{python tag}-{abi tag}-{platform tag}.whl
+		return filename.split('-')[1].lower()
+
+	def add_file(self, filename: str, url: str, hash_type: Optional[str], hash: Optional[str], requires_python: Optional[str], core_metadata: bool = False):
+		if filename.endswith(WHEEL_EXT):
+			# the wheel fitting a target is only chosen by the solver, which knows its environment
+			self._wheels.setdefault(self.get_wheel_version(filename), []).append((self.get_url(url), core_metadata))
+			return
 
-		base, ext = self.splitext(self._data)
+		base, ext = self.splitext(filename)
 
-		if ext not in SDIST_EXTS:
+		rank = SDIST_RANK.get(ext)
+		if rank is None:
 			return
 
-		attrs = dict(self._attrs)
 		version = self.get_version(base)
-		url = self.get_url(attrs['href'])
-		hash_type, hash = self.get_hash(attrs['href'])
-		requires_python = SpecifierSet(attrs.get('data-requires-python', ""))
+		if core_metadata:
+			# metadata of the sdist doesn't depend on the target
+			self._metadata.setdefault(version, f'{self.get_url(url)}.metadata')
 
 		# Prefer extensions in the order given in SDIST_EXT
-		if version in self.candidates:
-			old_ext = self.splitext(self.candidates[version].url)[1]
-			if SDIST_EXTS.index(old_ext) < SDIST_EXTS.index(ext):
-				return
+		if self._ranks.get(version, rank) < rank:
+			return
 
-		self.candidates[version] = Candidate(self.base_name, version, url, hash_type, hash, requires_python)
+		self._ranks[version] = rank
+		self.candidates[version] = Candidate(self.base_name, version, self.get_url(url), hash_type, hash, requires_python or "")
 
-	def handle_starttag(self, tag: str, attrs: List[Tuple[str, str]]):
-		if tag != 'a':
-			return
+	def finish(self):
+		"""attach information collected from all files of a release to its candidate"""
+		for version, metadata_url in self._metadata.items():
+			if version in self.candidates:
+				self.candidates[version].metadata_url = metadata_url
+
+		for version, wheels in self._wheels.items():
+			if version in self.candidates:
+				self.candidates[version].wheels = tuple(wheels)
+
+
+class PyPIParser(IndexParser):
+	"""Parser for the HTML simple API (PEP 503)
+
+	Anchors are pulled out of the page in bulk with a regular expression, attributes are only
+	parsed for links which point to an sdist or a wheel."""
+
+	def __init__(self, index_url: str, base_name: str):
+		self._buffer = ""
+
+		super().__init__(index_url, base_name)
+
+	@staticmethod
+	def get_attributes(text: str) -> Dict[str, str]:
+		attrs = {}
+		for match in RE_ATTRIBUTE.finditer(text):
+			name, double_quoted, single_quoted, unquoted = match.groups()
+			value = next(x for x in (double_quoted, single_quoted, unquoted) if x is not None)
+			attrs[name.lower()] = unescape(value) if '&' in value else value
+
+		return attrs
+
+	def process_anchors(self):
+		buffer = self._buffer
+		end = 0
+
+		for match in RE_ANCHOR.finditer(buffer):
+			end = match.end()
+
+			filename = match.group(2).strip()
+			if not filename.endswith(FILE_EXTS):
+				continue
+
+			if '&' in filename:
+				filename = unescape(filename)
+
+			attrs = self.get_attributes(match.group(1))
+			hash_type, hash = self.get_hash(attrs['href'])
+			core_metadata = attrs.get('data-core-metadata', attrs.get('data-dist-info-metadata', 'false')) != 'false'
+			self.add_file(filename, attrs['href'], hash_type, hash, attrs.get('data-requires-python'), core_metadata)
 
-		assert self._attrs is None
-		assert self._data is None
-		self._attrs = attrs
+		# keep only the part of the page which can still turn out to be an anchor
+		rest = buffer[end:]
+		start = rest.lower().rfind('<a')
+		if start >= 0 and not RE_ANCHOR_END.search(rest, start):
+			self._buffer = rest[start:]
+		else:
+			start = rest.rfind('<')
+			self._buffer = rest[start:] if start >= 0 and rest.find('>', start) < 0 else ""
 
-	def handle_endtag(self, tag: str):
-		if tag != 'a':
+	def feed(self, data: str):
+		self._buffer += data
+		self.process_anchors()
+
+	def close(self):
+		self.process_anchors()
+		self._buffer = ""
+		self.finish()
+
+
+class PyPIJSONParser(IndexParser):
+	"""Parser for the JSON simple API (PEP 691)
+
+	Entries of the "files" list are decoded as soon as they are complete, so only the entry
+	which is currently being received is kept in memory."""
+
+	def __init__(self, index_url: str, base_name: str):
+		self._buffer = ""
+		self._in_files = False
+		self._done = False
+		self._decoder = json.JSONDecoder()
+
+		super().__init__(index_url, base_name)
+
+	@staticmethod
+	def get_hash_from_dict(hashes: Dict[str, str]) -> Tuple[Optional[str], Optional[str]]:
+		for hash_type in HASH_PREFERENCE:
+			if hash_type in hashes:
+				return hash_type, hashes[hash_type]
+
+		return None, None
+
+	def process_file(self, file: Dict[str, Any]):
+		hash_type, hash = self.get_hash_from_dict(file.get('hashes', {}))
+		core_metadata = bool(file.get('core-metadata', file.get('dist-info-metadata', False)))
+		self.add_file(file['filename'], file['url'], hash_type, hash, file.get('requires-python'), core_metadata)
+
+	def process_project(self, project: Dict[str, Any]):
+		for file in project['files']:
+			self.process_file(file)
+
+	def process_files(self):
+		buffer = self._buffer
+		pos = 0
+
+		while True:
+			pos = RE_JSON_SEPARATOR.match(buffer, pos).end()
+			if pos == len(buffer):
+				break
+
+			if buffer[pos] == ']':
+				self._done = True
+				pos = len(buffer)
+				break
+
+			try:
+				file, pos = self._decoder.raw_decode(buffer, pos)
+			except ValueError:
+				break  # entry is not complete yet
+
+			self.process_file(file)
+
+		self._buffer = buffer[pos:]
+
+	def feed(self, data: str):
+		if self._done:
 			return
 
-		self.process_package()
-		self._attrs = None
-		self._data = None
+		self._buffer += data
+
+		if not self._in_files:
+			match = RE_JSON_FILES.search(self._buffer)
+			if match is None:
+				return
+
+			self._buffer = self._buffer[match.end():]
+			self._in_files = True
+
+		self.process_files()
+
+	def close(self):
+		buffer, self._buffer = self._buffer, ""
+
+		if self._in_files:
+			if not self._done:
+				raise RuntimeError("Unable to parse JSON: list of files is truncated")
+		else:
+			try:
+				project = json.loads(buffer)
+			except ValueError as e:
+				raise RuntimeError(f"Unable to parse JSON: {e}")
+
+			self.process_project(project)
+
+		self.finish()
 
-	def handle_data(self, data: str):
-		if self._attrs is None:
-			return  # ignore non-relevant tags
 
-		self._data = data
+def get_parser(content_type: str, index_url: str, base_name: str) -> IndexParser:
+	"""return parser matching the negotiated content type of an index response"""
+	if content_type == CONTENT_TYPE_JSON:
+		return PyPIJSONParser(index_url, base_name)
 
-	def error(self, message):
-		raise RuntimeError(f"Unable to parse HTML: {message}")
+	return PyPIParser(index_url, base_name)
@@ -1,4 +1,5 @@
-from typing import Dict, List, Set, Tuple
+import re
+from typing import Any, Dict, List, Set, Tuple
 
 from packaging.requirements import Requirement
 
@@ -7,6 +8,11 @@ from . import __version__
 from .fetch import Package
 
 
+# a comment starts the line or follows whitespace, URLs may contain #sha256=...
+RE_COMMENT = re.compile(r'(^|\s)#.*$')
+RE_OPTION = re.compile(r'\s*=\s*|\s+')
+SHORT_OPTIONS = {'i': 'index-url', 'f': 'find-links'}
+
 req_template = {
 	'header': [
 		f'# Generated by pynixreq {__version__}\n',
@@ -19,20 +25,25 @@ req_template = {
 }
 
 
-def read_requirements(filename: str) -> Tuple[Set[Requirement], Dict[str, str]]:
+def read_requirements(filename: str) -> Tuple[Set[Requirement], Dict[str, Any]]:
 	config = {}
 	requirements = set()
 	with open(filename) as fp:
 		for line in fp:
-			line = line[:line.find('#')].strip()
+			line = RE_COMMENT.sub('', line).strip()
 			if line == '':
 				continue
 
-			if line[:2] == '--':
-				command, arg = line[2:].split(maxsplit=1)
+			if line[:1] == '-':
+				# --option value, --option=value or -o value
+				command, *arg = RE_OPTION.split(line.lstrip('-'), maxsplit=1)
+				command = SHORT_OPTIONS.get(command, command)
+				arg = arg[0] if arg else None
 
-				if command in ('index-url', 'extra-index-url'):
+				if command == 'index-url':
 					config[command] = arg
+				elif command in ('extra-index-url', 'find-links'):
+					config.setdefault(command, []).append(arg)
 				else:
 					print(f'TODO: parse {line}')
 				continue
@@ -42,6 +53,11 @@ def read_requirements(filename: str) -> Tuple[Set[Requirement], Dict[str, str]]:
 	return requirements, config
 
 
+def requirements_filename(python_version: str, multiple_targets: bool = False) -> str:
+	"""requirements.nix, or requirements-python37.nix when several targets are resolved (picked by setup.nix)"""
+	return f'requirements-python{python_version}.nix' if multiple_targets else 'requirements.nix'
+
+
 def write_requirements(filename: str, packages: List[Candidate]):
 	def format(lines, level=1):
 		return map(lambda x: '%s%s\n' % ('\t' * level, x), lines)
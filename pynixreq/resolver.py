@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from logging import getLogger
+from typing import TYPE_CHECKING, Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Text, Tuple
+
+from packaging.version import Version
+
+from . import trace
+from .constraints import ROOT, ConstraintIndex
+from .data import Candidate, PackageTuple, RequirementWrapper
+from .exceptions import NoSolutionError
+from .versions import VersionTable
+
+if TYPE_CHECKING:
+	from .compile_requirements import DependencySolver
+
+# a package chosen in a specific version
+Assignment = Tuple[Text, Version]
+
+# packages whose metadata is requested together in a round
+PREFETCH = 8
+
+log = getLogger(__name__)
+
+
+class Conflict(Exception):
+	"""assignments which can't be part of a solution together"""
+
+	def __init__(self, assignments: FrozenSet[Assignment], key: Optional[Text] = None) -> None:
+		super().__init__(assignments)
+		self.assignments = assignments
+		# package which ran out of candidates
+		self.key = key
+
+
+@dataclass
+class Decision:
+	"""candidate chosen at a decision level"""
+	key: Text
+	candidate: Candidate
+	extras: Set[Text] = field(default_factory=set)
+	requirements: Set[RequirementWrapper] = field(default_factory=set)
+
+
+def merge_requirements(requirements: Iterable[RequirementWrapper]) -> Dict[Text, RequirementWrapper]:
+	merged: Dict[Text, RequirementWrapper] = {}
+	for requirement in requirements:
+		if requirement.key in merged:
+			merged[requirement.key] &= requirement
+		else:
+			merged[requirement.key] = requirement
+
+	return merged
+
+
+class Resolver:
+	"""Backtracking resolver with learned incompatibilities
+
+	Packages are decided one at a time, the one with the fewest remaining candidates first.
+	Every constraint remembers which assignments caused it, so when a package runs out of
+	candidates the responsible assignments are recorded as a nogood and the resolver jumps
+	back to the most recent of them instead of undoing decisions one by one. Nogoods stay
+	valid for the rest of the resolution, a combination which failed once is never tried again.
+
+	Metadata is requested in rounds: the best remaining candidates of the next PREFETCH
+	packages to be decided are examined concurrently, decisions are then applied until a
+	candidate without metadata is needed. Every decision adds constraints which can rule out
+	candidates examined for packages decided later, so a larger prefetch overlaps more
+	downloads and builds but also wastes more of them; packages further down the queue wait
+	for a later round."""
+
+	def __init__(self, solver: DependencySolver) -> None:
+		self.solver = solver
+
+		self.dependencies = ConstraintIndex()
+		self.decisions: List[Decision] = []
+		self.levels: Dict[Text, int] = {}
+
+		# undo actions of every decision level, level 0 holds the starting requirements
+		self._trail: List[List[Callable[[], None]]] = [[]]
+		# assignments which caused the requirements of a requester
+		self._causes: Dict[Text, FrozenSet[Assignment]] = {ROOT: frozenset()}
+		self._nogoods: Dict[Assignment, List[FrozenSet[Assignment]]] = {}
+		self._versions: Dict[Text, VersionTable] = {}
+
+		self.backtracks = 0
+
+	@property
+	def level(self) -> int:
+		return len(self.decisions)
+
+	def is_assigned(self, assignment: Assignment) -> bool:
+		key, version = assignment
+		return key in self.levels and self.decisions[self.levels[key] - 1].candidate.version == version
+
+	def _push_undo(self, action: Callable[[], None]) -> None:
+		self._trail[-1].append(action)
+
+	def _excluded_by(self, key: Text, candidate: Candidate) -> Optional[FrozenSet[Assignment]]:
+		"""return a nogood which rules out the candidate given the current assignments"""
+		assignment = (key, candidate.version)
+		for nogood in self._nogoods.get(assignment, ()):
+			if all(other == assignment or self.is_assigned(other) for other in nogood):
+				return nogood
+
+		return None
+
+	def viable(self, key: Text) -> List[Candidate]:
+		"""candidates of an undecided package which are allowed by all constraints"""
+		return [candidate for candidate in self.matching(key) if self._excluded_by(key, candidate) is None]
+
+	def matching(self, key: Text) -> List[Candidate]:
+		"""candidates of a package allowed by the constraints, ignoring learned nogoods"""
+		return self.solver.matching_candidates(self._versions[key], self.dependencies[key].combined_specifiers)
+
+	def _conflict_of(self, key: Text) -> FrozenSet[Assignment]:
+		"""assignments responsible for a package having no viable candidate"""
+		dependency = self.dependencies[key]
+		culprits = set()
+		for requester in dependency.specifiers:
+			culprits |= self._causes[requester]
+
+		for candidate in self.matching(key):
+			culprits |= self._excluded_by(key, candidate) - {(key, candidate.version)}
+
+		return frozenset(culprits)
+
+	def _learn(self, nogood: FrozenSet[Assignment]) -> None:
+		for assignment in nogood:
+			self._nogoods.setdefault(assignment, []).append(nogood)
+
+	def _backjump(self, level: int) -> None:
+		"""undo all decisions made after the given level"""
+		while self.level > level:
+			for action in reversed(self._trail.pop()):
+				action()
+			decision = self.decisions.pop()
+			del self.levels[decision.key]
+			self.dependencies[decision.key].chosen_version = None
+
+	def _handle_conflict(self, conflict: Conflict) -> None:
+		if not conflict.assignments:
+			raise NoSolutionError(self._describe_conflict(conflict.key))
+
+		self._learn(conflict.assignments)
+		self.backtracks += 1
+
+		level = max(self.levels[key] for key, _ in conflict.assignments)
+		log.debug('Conflict between %s, backjumping to level %d', ', '.join(f'{key} {version}' for key, version in sorted(conflict.assignments)), level - 1)
+		self._backjump(level - 1)
+
+	def _describe_conflict(self, key: Optional[Text]) -> Text:
+		if key is None:
+			return 'Unable to find a solution'
+
+		dependency = self.dependencies[key]
+		constraints = ', '.join(f'{requester or "<root>"} requires {dependency.name}{specifier or ""}' for requester, (_, specifier) in sorted(dependency.specifiers.items()))
+		message = f'Unable to find a version of {dependency.name} satisfying all requirements: {constraints}'
+
+		rejected = [str(candidate.version) for candidate in self.matching(key)]
+		if rejected:
+			message += f'; versions {", ".join(rejected)} conflict with other requirements'
+
+		return message
+
+	def _add_requirement(self, requester: Text, version: Optional[Version], requirement: RequirementWrapper) -> None:
+		self.dependencies.add(requester, version, requirement)
+		self._push_undo(lambda: self.dependencies.remove(requester, requirement.key))
+
+		if requirement.key not in self.levels:
+			return
+
+		decision = self.decisions[self.levels[requirement.key] - 1]
+		if not requirement.specifier.contains(decision.candidate.version, prereleases=True):
+			raise Conflict(self._causes[requester] | {(requirement.key, decision.candidate.version)})
+
+		for extra in sorted(requirement.extras - decision.extras):
+			self._apply_extra(decision, extra, requester)
+
+	def _add_requirements(self, requester: Text, version: Optional[Version], cause: FrozenSet[Assignment], requirements: Iterable[RequirementWrapper]) -> None:
+		self._causes[requester] = cause
+		for requirement in merge_requirements(requirements).values():
+			self._add_requirement(requester, version, requirement)
+
+	def _apply_extra(self, decision: Decision, extra: Text, requester: Text) -> None:
+		"""add requirements of an extra of a decided package"""
+		decision.extras.add(extra)
+		self._push_undo(lambda: decision.extras.discard(extra))
+
+		requirements = frozenset(self.solver._evaluate_markers(decision.candidate.info.extras.get(extra, ())))
+		decision.requirements |= requirements
+		self._push_undo(lambda: decision.requirements.difference_update(requirements))
+
+		version = decision.candidate.version
+		cause = self._causes[requester] | {(decision.key, version)}
+		self._add_requirements(f'{decision.key}[{extra}]', version, cause, requirements)
+
+	def _decide(self, key: Text, candidate: Candidate) -> None:
+		dependency = self.dependencies[key]
+		decision = Decision(key, candidate)
+
+		self.decisions.append(decision)
+		self._trail.append([])
+		self.levels[key] = self.level
+		dependency.chosen_version = candidate.version
+		log.debug('Decided %s %s at level %d', candidate.name, candidate.version, self.level)
+
+		base = RequirementWrapper(dependency.name, None, frozenset(), None, None)
+		decision.requirements = set(self.solver._get_dependencies(base, candidate.info))
+		self._add_requirements(key, candidate.version, frozenset({(key, candidate.version)}), decision.requirements)
+
+		for requester, extras in sorted(dependency.extras.items()):
+			for extra in sorted(extras - decision.extras):
+				self._apply_extra(decision, extra, requester)
+
+	async def _fetch_versions(self, keys: Iterable[Text], complete: bool = False) -> None:
+		async def fetch(key: Text) -> None:
+			self._versions[key] = await self.solver.get_version_table(self.dependencies.requirement(key), complete)
+
+		await self.solver._gather([fetch(key) for key in keys if key not in self._versions or complete])
+
+	async def _round(self) -> bool:
+		"""make decisions until new metadata is needed, return False once all packages are decided"""
+		pending = [key for key in sorted(self.dependencies) if key not in self.levels]
+		if not pending:
+			return False
+
+		await self._fetch_versions(pending)
+
+		# a pin which is no longer viable is replaced by all versions of the package
+		outdated = [key for key in pending if not self._versions[key].complete and not self.viable(key)]
+		if outdated:
+			await self._fetch_versions(outdated, complete=True)
+
+		viable = {key: self.viable(key) for key in pending}
+		pending.sort(key=lambda x: len(viable[x]))
+		# candidates with known metadata are decided without waiting, they don't count
+		unknown = [viable[key][0] for key in pending if viable[key] and self.solver._get_known_metadata(viable[key][0]) is None]
+		await self.solver.get_candidates_info(unknown[:PREFETCH])
+
+		try:
+			for key in pending:
+				if key in self.levels or key not in self.dependencies:
+					continue
+
+				candidates = self.viable(key)
+				if not candidates and not self._versions[key].complete:
+					break  # all versions are needed, they are fetched by the next round
+				if not candidates:
+					raise Conflict(self._conflict_of(key), key)
+
+				if candidates[0].info is None:
+					break  # constraints changed during this round
+
+				self._decide(key, candidates[0])
+		except Conflict as conflict:
+			self._handle_conflict(conflict)
+
+		return True
+
+	async def resolve(self, requirements: Iterable[RequirementWrapper]) -> Dict[Text, PackageTuple]:
+		self._add_requirements(ROOT, None, frozenset(), requirements)
+
+		rounds = 0
+		while True:
+			rounds += 1
+			with trace.span('solver.pass', python=self.solver.target.python_version, number=rounds) as span:
+				if not await self._round():
+					break
+				span.set(decisions=self.level, backjumps=self.backtracks)
+
+		log.info('Resolution finished after %d decisions and %d backjumps', self.level, self.backtracks)
+		return {decision.key: PackageTuple(decision.candidate, frozenset(decision.requirements)) for decision in self.decisions}
@@ -0,0 +1,165 @@
+"""Spans timing the phases of a resolution
+
+Tracing is disabled by default, span() then returns a shared object doing nothing. Once
+enabled, every span is recorded with its attributes on a track of the asyncio task it ran
+in, so concurrent fetches and builds show up side by side in chrome://tracing or Perfetto.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import os
+import time
+import weakref
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Text, Tuple
+
+
+@dataclass
+class Span:
+	name: Text
+	start: float  # seconds since the tracer was enabled
+	duration: float
+	track: int
+	attributes: Dict[Text, Any]
+
+
+class _NullSpan:
+	"""stands in for every span while tracing is disabled"""
+	__slots__ = ()
+
+	def __enter__(self) -> _NullSpan:
+		return self
+
+	def __exit__(self, *args) -> None:
+		pass
+
+	def set(self, **attributes: Any) -> None:
+		pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _ActiveSpan:
+	__slots__ = ('tracer', 'name', 'attributes', 'start')
+
+	def __init__(self, tracer: Tracer, name: Text, attributes: Dict[Text, Any]) -> None:
+		self.tracer = tracer
+		self.name = name
+		self.attributes = attributes
+		self.start = 0.0
+
+	def __enter__(self) -> _ActiveSpan:
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc, tb) -> None:
+		if exc_type is not None:
+			self.attributes['error'] = exc_type.__name__
+		self.tracer.record(self.name, self.start, time.perf_counter() - self.start, **self.attributes)
+
+	def set(self, **attributes: Any) -> None:
+		"""add attributes only known once the span is running"""
+		self.attributes.update(attributes)
+
+
+class Tracer:
+	def __init__(self) -> None:
+		self.enabled = False
+		self.spans: List[Span] = []
+		self.origin = time.perf_counter()
+		self._tracks: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+		# tasks are forgotten once collected, numbers are never handed out twice
+		self._track_numbers = itertools.count(1)
+
+	def enable(self) -> None:
+		"""start recording, spans recorded earlier are dropped"""
+		self.enabled = True
+		self.spans = []
+		self.origin = time.perf_counter()
+		self._tracks = weakref.WeakKeyDictionary()
+		self._track_numbers = itertools.count(1)
+
+	def disable(self) -> None:
+		self.enabled = False
+
+	def span(self, name: Text, **attributes: Any):
+		"""context manager timing the code it wraps"""
+		if not self.enabled:
+			return NULL_SPAN
+		return _ActiveSpan(self, name, attributes)
+
+	def record(self, name: Text, start: float, duration: float, **attributes: Any) -> None:
+		"""record a span measured by the caller, start is a time.perf_counter() value"""
+		if self.enabled:
+			self.spans.append(Span(name, start - self.origin, duration, self._track(), attributes))
+
+	def _track(self) -> int:
+		"""number of the asyncio task the caller runs in, 0 outside of tasks"""
+		try:
+			task = asyncio.current_task()
+		except RuntimeError:
+			task = None
+		if task is None:
+			return 0
+
+		track = self._tracks.get(task)
+		if track is None:
+			track = self._tracks[task] = next(self._track_numbers)
+		return track
+
+	def chrome_trace(self) -> Dict[Text, Any]:
+		"""spans as complete events of the trace event format"""
+		pid = os.getpid()
+		return {
+			'traceEvents': [
+				{
+					'name': span.name,
+					'cat': span.name.split('.')[0],
+					'ph': 'X',
+					'ts': round(span.start * 1e6, 1),
+					'dur': round(span.duration * 1e6, 1),
+					'pid': pid,
+					'tid': span.track,
+					'args': {key: value if isinstance(value, (int, float, bool, str)) or value is None else str(value) for key, value in span.attributes.items()},
+				} for span in self.spans
+			],
+			'displayTimeUnit': 'ms',
+		}
+
+	def write_chrome_trace(self, filename: Text) -> None:
+		with open(filename, 'w') as fp:
+			json.dump(self.chrome_trace(), fp)
+
+	def summary(self) -> List[Tuple[Text, int, float, float]]:
+		"""name, count, total and longest duration of spans, the most expensive first"""
+		totals: Dict[Text, List] = {}
+		for span in self.spans:
+			entry = totals.setdefault(span.name, [0, 0.0, 0.0])
+			entry[0] += 1
+			entry[1] += span.duration
+			entry[2] = max(entry[2], span.duration)
+
+		return sorted(((name, count, total, longest) for name, (count, total, longest) in totals.items()), key=lambda x: -x[2])
+
+	def format_summary(self, wall: Optional[float] = None) -> Text:
+		"""summary as a table, totals of concurrent spans may exceed the wall time"""
+		rows = self.summary()
+		width = max([len('span')] + [len(name) for name, *_ in rows])
+		lines = [f'{"span":<{width}} {"count":>7} {"total [s]":>10} {"mean [ms]":>10} {"max [ms]":>10}']
+		for name, count, total, longest in rows:
+			lines.append(f'{name:<{width}} {count:>7} {total:>10.3f} {total / count * 1000:>10.1f} {longest * 1000:>10.1f}')
+		if wall is not None:
+			lines.append(f'wall time {wall:.3f}s')
+
+		return '\n'.join(lines)
+
+
+tracer = Tracer()
+
+
+def span(name: Text, **attributes: Any):
+	"""span of the global tracer, see Tracer.span"""
+	return tracer.span(name, **attributes) if tracer.enabled else NULL_SPAN
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import re
+from bisect import bisect_left, bisect_right
+from typing import Iterable, Iterator, List, Optional, Text, Tuple
+
+from packaging.specifiers import Specifier, SpecifierSet
+from packaging.version import InvalidVersion, Version
+
+from .data import Candidate, parse_version
+
+
+RE_RELEASE_PREFIX = re.compile(r'^(?:(\d+)!)?(\d+(?:\.\d+)*)\.\*$')
+
+# when a specifier has to be checked by Specifier.contains for a candidate in its range
+NEVER, POST_OR_LOCAL, ALWAYS = range(3)
+
+
+def next_release(epoch: int, release: Tuple[int, ...]) -> Version:
+	"""smallest version which doesn't start with the release, incremented in its last part"""
+	upper = '.'.join(map(str, release[:-1] + (release[-1] + 1,)))
+	return Version(f'{epoch}!{upper}.dev0')
+
+
+def compatible_upper_bound(version: Version) -> Optional[Version]:
+	"""smallest version which no longer matches '~=version'"""
+	if len(version.release) < 2:
+		return None
+
+	return next_release(version.epoch, version.release[:-1])
+
+
+class VersionTable:
+	"""Candidates of a project sorted by version once
+
+	Specifiers are turned into index ranges with binary search over the public versions,
+	which are ordered the same way as the full versions. Only what can't be expressed as a
+	range ('===', local versions, post-releases and local versions excluded by '>') is
+	checked with Specifier.contains, and only for the candidates left in the range.
+	Pre-releases are rare, they are checked against the whole specifier set."""
+
+	def __init__(self, candidates: Iterable[Candidate], complete: bool = True) -> None:
+		# incomplete table only holds candidates known up front (e.g. pins of a lock file)
+		self.complete = complete
+		self.candidates: List[Candidate] = []
+		# candidates whose version isn't PEP 440 compliant, they are always checked one by one
+		self.legacy: List[Candidate] = []
+
+		for candidate in candidates:
+			if isinstance(candidate.version, Version):
+				self.candidates.append(candidate)
+			else:
+				self.legacy.append(candidate)
+
+		self.candidates.sort(key=lambda x: x.version)
+		self.public = [parse_version(candidate.version.public) for candidate in self.candidates]
+		self.prerelease = [candidate.version.is_prerelease for candidate in self.candidates]
+		self.special = [candidate.version.is_postrelease or candidate.version.local is not None for candidate in self.candidates]
+
+	def __len__(self) -> int:
+		return len(self.candidates) + len(self.legacy)
+
+	def _prefix_range(self, text: Text) -> Optional[Tuple[int, int]]:
+		"""indexes of versions matching a 'release.*' prefix"""
+		match = RE_RELEASE_PREFIX.match(text)
+		if match is None:
+			return None
+
+		epoch = int(match.group(1) or 0)
+		release = tuple(map(int, match.group(2).split('.')))
+		lower = Version(f'{epoch}!{match.group(2)}.dev0')
+		return bisect_left(self.public, lower), bisect_left(self.public, next_release(epoch, release))
+
+	def _range(self, specifier: Specifier, lo: int, hi: int, excluded: List[Tuple[int, int]]) -> Tuple[int, int, int]:
+		"""narrow [lo, hi) by the specifier, return when the specifier still has to be checked
+
+		Pre-releases are always checked with the whole specifier set, so special cases which only
+		concern them are ignored here."""
+		operator, text = specifier.operator, specifier.version
+		if operator == '===':
+			return lo, hi, ALWAYS
+
+		if text.endswith('.*'):
+			bounds = self._prefix_range(text) if operator in ('==', '!=') else None
+			if bounds is None:
+				return lo, hi, ALWAYS
+			if operator == '==':
+				return max(lo, bounds[0]), min(hi, bounds[1]), NEVER
+			excluded.append(bounds)
+			return lo, hi, NEVER
+
+		try:
+			version = parse_version(text)
+		except InvalidVersion:
+			return lo, hi, ALWAYS
+
+		if operator == '>=':
+			return max(lo, bisect_left(self.public, version)), hi, NEVER
+		if operator == '<=':
+			return lo, min(hi, bisect_right(self.public, version)), NEVER
+		if operator == '>':
+			# post-releases and local versions of the version itself are excluded by '>'
+			return max(lo, bisect_right(self.public, version)), hi, POST_OR_LOCAL
+		if operator == '<':
+			return lo, min(hi, bisect_left(self.public, version)), NEVER
+		if operator == '~=':
+			upper = compatible_upper_bound(version)
+			lo = max(lo, bisect_left(self.public, version))
+			if upper is None:
+				return lo, hi, ALWAYS
+			return lo, min(hi, bisect_left(self.public, upper)), NEVER
+		if operator in ('==', '!=') and version.local is None:
+			start, end = bisect_left(self.public, version), bisect_right(self.public, version)
+			if operator == '==':
+				return max(lo, start), min(hi, end), NEVER
+			excluded.append((start, end))
+			return lo, hi, NEVER
+
+		return lo, hi, ALWAYS
+
+	def matching(self, specifier: SpecifierSet, allow_prereleases: bool = True) -> List[Candidate]:
+		"""candidates matching the specifier, newest first
+
+		Pre-releases are included when the specifier allows them, unless disabled by allow_prereleases."""
+		lo, hi = 0, len(self.candidates)
+		excluded: List[Tuple[int, int]] = []
+		leftovers: List[Tuple[Specifier, int]] = []
+		for item in specifier:
+			lo, hi, check = self._range(item, lo, hi, excluded)
+			if check != NEVER:
+				leftovers.append((item, check))
+
+		result = []
+		for index in self._indexes(lo, hi, excluded):
+			candidate = self.candidates[index]
+			if self.prerelease[index]:
+				# whether pre-releases are accepted depends on the whole set (and packaging version)
+				if allow_prereleases and specifier.contains(candidate.version):
+					result.append(candidate)
+				continue
+
+			if leftovers and not all(
+				item.contains(candidate.version, prereleases=True)
+				for item, check in leftovers if check == ALWAYS or self.special[index]
+			):
+				continue
+
+			result.append(candidate)
+
+		if self.legacy:
+			result.extend(candidate for candidate in self.legacy if specifier.contains(candidate.version))
+
+		return result
+
+	@staticmethod
+	def _indexes(lo: int, hi: int, excluded: List[Tuple[int, int]]) -> Iterator[int]:
+		"""indexes of [lo, hi) outside of excluded ranges, from the highest"""
+		index = hi - 1
+		for start, end in sorted(excluded, key=lambda x: x[1], reverse=True):
+			while index >= max(end, lo):
+				yield index
+				index -= 1
+			index = min(index, start - 1)
+
+		while index >= lo:
+			yield index
+			index -= 1
@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import bisect
+import io
+import posixpath
+import re
+import zipfile
+from logging import getLogger
+from typing import Callable, Dict, Iterable, List, Optional, Text, Tuple, TypeVar
+from urllib.parse import unquote, urlsplit
+
+import aiohttp
+
+from .http import IDENTITY, HTTPClient
+
+# size of the first request from the end of the file, it usually covers the central directory and
+# the dist-info directory which wheel builders place at the end of the archive
+TAIL_SIZE = 16 * 1024
+# smallest range requested when reading a part of the file which wasn't downloaded yet
+MIN_FETCH = 4 * 1024
+# local file header is 30 bytes followed by the file name and extra field
+LOCAL_HEADER_SIZE = 30
+LOCAL_EXTRA_SLACK = 1024
+
+RE_CONTENT_RANGE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+)')
+RE_METADATA = re.compile(r'^[^/]+\.dist-info/METADATA$')
+
+# python tags of wheels built for an implementation (PEP 425)
+IMPLEMENTATION_TAGS = {'cpython': 'cp', 'pypy': 'pp', 'ironpython': 'ip', 'jython': 'jy'}
+
+T = TypeVar('T')
+
+log = getLogger(__name__)
+
+
+class MissingRange(Exception):
+	"""part of a sparse file which is needed, but wasn't downloaded yet"""
+
+	def __init__(self, start: int, end: int) -> None:
+		super().__init__(f'bytes {start}-{end} are not available')
+		self.start = start
+		self.end = end
+
+
+class SparseFile(io.RawIOBase):
+	"""Seekable file of a known size of which only some ranges are available
+
+	Reading from a missing part raises MissingRange, so a synchronous reader (zipfile) can be
+	retried once the range is downloaded."""
+
+	def __init__(self, size: int) -> None:
+		super().__init__()
+		self.size = size
+		self._pos = 0
+		# non-overlapping ranges sorted by their start
+		self._starts: List[int] = []
+		self._chunks: List[bytes] = []
+
+	def readable(self) -> bool:
+		return True
+
+	def seekable(self) -> bool:
+		return True
+
+	def tell(self) -> int:
+		return self._pos
+
+	def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+		if whence == io.SEEK_SET:
+			self._pos = offset
+		elif whence == io.SEEK_CUR:
+			self._pos += offset
+		elif whence == io.SEEK_END:
+			self._pos = self.size + offset
+		else:
+			raise ValueError(f'Invalid whence: {whence}')
+
+		if self._pos < 0:
+			raise ValueError('Negative seek position')
+
+		return self._pos
+
+	def missing(self, start: int, end: int) -> Optional[Tuple[int, int]]:
+		"""return the part of [start, end) which isn't available, or None if all of it is"""
+		end = min(end, self.size)
+		index = bisect.bisect_right(self._starts, start) - 1
+		if index >= 0:
+			start = max(start, self._starts[index] + len(self._chunks[index]))
+
+		if start >= end:
+			return None
+
+		# stop at the next available range
+		index = bisect.bisect_right(self._starts, start)
+		if index < len(self._starts):
+			end = min(end, self._starts[index])
+
+		return start, end
+
+	def read(self, size: int = -1) -> bytes:
+		end = self.size if size is None or size < 0 else min(self._pos + size, self.size)
+		if self._pos >= end:
+			return b''
+
+		index = bisect.bisect_right(self._starts, self._pos) - 1
+		if index < 0 or self._starts[index] + len(self._chunks[index]) < end:
+			raise MissingRange(self._pos, end)
+
+		offset = self._pos - self._starts[index]
+		data = self._chunks[index][offset:offset + end - self._pos]
+		self._pos = end
+		return data
+
+	def readinto(self, buffer) -> int:
+		data = self.read(len(buffer))
+		buffer[:len(data)] = data
+		return len(data)
+
+	def add(self, start: int, data: bytes) -> None:
+		"""make a range available, merging it with the adjacent ones"""
+		end = start + len(data)
+		first = bisect.bisect_left(self._starts, start)
+		if first > 0 and self._starts[first - 1] + len(self._chunks[first - 1]) >= start:
+			first -= 1
+
+		last = bisect.bisect_right(self._starts, end)
+		if first < last:
+			head = self._chunks[first][:max(start - self._starts[first], 0)]
+			tail_start, tail = self._starts[last - 1], self._chunks[last - 1]
+			data = head + data + tail[end - tail_start:]
+			start = min(start, self._starts[first])
+
+		self._starts[first:last] = [start]
+		self._chunks[first:last] = [data]
+
+
+class LazyWheel:
+	"""Wheel on a remote server read with HTTP range requests
+
+	Only the central directory and the members which are actually read are downloaded. If the
+	server doesn't support ranges, the whole wheel is downloaded instead."""
+
+	def __init__(self, http: HTTPClient, url: Text) -> None:
+		self.http = http
+		self.url = url
+		self.file: Optional[SparseFile] = None
+		self.transferred = 0
+		self.requests = 0
+
+	async def _get(self, headers) -> Tuple[int, Optional[Text], bytes]:
+		async with self.http.get(self.url, headers=dict(IDENTITY, **headers)) as response:  # type: aiohttp.ClientResponse
+			if response.status not in (200, 206):
+				raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status, message=response.reason)
+
+			data = await response.read()
+			self.requests += 1
+			self.transferred += len(data)
+			return response.status, response.headers.get('Content-Range'), data
+
+	def _add_response(self, status: int, content_range: Optional[Text], data: bytes) -> None:
+		if status == 200:
+			# ranges were ignored, the whole file is available
+			self.file = SparseFile(len(data))
+			self.file.add(0, data)
+			return
+
+		match = RE_CONTENT_RANGE.match(content_range or '')
+		if match is None:
+			raise ValueError(f'{self.url}: invalid Content-Range: {content_range!r}')
+
+		start, _, size = map(int, match.groups())
+		if self.file is None:
+			self.file = SparseFile(size)
+		self.file.add(start, data)
+
+	async def fetch(self, start: int, end: int) -> None:
+		"""download range [start, end) unless it is already available"""
+		missing = self.file.missing(start, max(end, start + MIN_FETCH))
+		if missing is not None:
+			self._add_response(*await self._get({'Range': f'bytes={missing[0]}-{missing[1] - 1}'}))
+
+	async def open(self) -> None:
+		self._add_response(*await self._get({'Range': f'bytes=-{TAIL_SIZE}'}))
+
+	async def call(self, function: Callable[[], T]) -> T:
+		"""call a reader of the file, downloading ranges it needs until it succeeds"""
+		while True:
+			try:
+				self.file.seek(0)
+				return function()
+			except MissingRange as e:
+				await self.fetch(e.start, e.end)
+
+	async def read_member(self, pattern: re.Pattern) -> Optional[bytes]:
+		"""return content of the first member matching the pattern"""
+		if self.file is None:
+			await self.open()
+
+		archive = await self.call(lambda: zipfile.ZipFile(self.file))
+		info = next((x for x in archive.infolist() if pattern.match(x.filename)), None)
+		if info is None:
+			return None
+
+		# download the member at once instead of letting zipfile discover it piece by piece
+		header_size = LOCAL_HEADER_SIZE + len(info.filename.encode()) + len(info.extra) + LOCAL_EXTRA_SLACK
+		await self.fetch(info.header_offset, info.header_offset + header_size + info.compress_size)
+
+		return await self.call(lambda: zipfile.ZipFile(self.file).read(info))
+
+	async def read_metadata(self) -> Optional[Text]:
+		"""return content of the *.dist-info/METADATA file"""
+		data = await self.read_member(RE_METADATA)
+		log.debug('%s: %d bytes in %d requests', self.url, self.transferred, self.requests)
+		return data.decode('utf-8', errors='replace') if data is not None else None
+
+
+def read_local_metadata(path: Text) -> Optional[Text]:
+	"""return content of the *.dist-info/METADATA file of a wheel on disk"""
+	with zipfile.ZipFile(path) as archive:
+		info = next((x for x in archive.infolist() if RE_METADATA.match(x.filename)), None)
+		return archive.read(info).decode('utf-8', errors='replace') if info is not None else None
+
+
+def python_tag_rank(tag: Text, abi_tags: List[Text], environment: Dict[Text, Text]) -> Optional[int]:
+	"""0 for a tag of the exact python version, 1 for one of its major version, None if it doesn't match"""
+	major, minor = environment['python_version'].split('.')[:2]
+	implementation = IMPLEMENTATION_TAGS.get(environment.get('implementation_name', ''), 'py')
+
+	if tag in (f'py{major}{minor}', f'{implementation}{major}{minor}'):
+		return 0
+	if tag == f'py{major}':
+		return 1
+	# stable ABI wheels work on the version they were built for and later ones
+	if 'abi3' in abi_tags and implementation == 'cp' and tag[:3] == f'cp{major}' and tag[3:].isdigit() and int(tag[3:]) <= int(minor):
+		return 1
+
+	return None
+
+
+def platform_tag_rank(tag: Text, environment: Dict[Text, Text]) -> Optional[int]:
+	"""0 for pure wheels, 1 for wheels built for the platform, None if it doesn't match"""
+	if tag == 'any':
+		return 0
+
+	platform, machine = environment.get('sys_platform', ''), environment.get('platform_machine', '')
+	if platform.startswith('linux') and tag.startswith(('linux_', 'manylinux', 'musllinux')) and tag.endswith(f'_{machine}'):
+		return 1
+	if platform == 'darwin' and tag.startswith('macosx_') and tag.endswith((f'_{machine}', '_universal', '_universal2')):
+		return 1
+
+	return None
+
+
+def wheel_rank(filename: Text, environment: Dict[Text, Text]) -> Optional[Tuple[int, int]]:
+	"""rank of a wheel by how well it fits the marker environment, lower is better
+
+	Wheels built for other pythons or platforms may list other requirements, None is returned
+	for them. Pure python wheels come first, their metadata doesn't depend on the platform."""
+	# {distribution}-{version}(-{build tag})?-{python tag}-{abi tag}-{platform tag}.whl
+	parts = posixpath.splitext(filename)[0].split('-')
+	if len(parts) < 5:
+		return None
+
+	python_tags, abi_tags, platform_tags = (part.lower().split('.') for part in parts[-3:])
+	python_ranks = [rank for rank in (python_tag_rank(tag, abi_tags, environment) for tag in python_tags) if rank is not None]
+	platform_ranks = [rank for rank in (platform_tag_rank(tag, environment) for tag in platform_tags) if rank is not None]
+	if not python_ranks or not platform_ranks:
+		return None
+
+	return min(platform_ranks), min(python_ranks)
+
+
+def select_wheel(urls: Iterable[Text], environment: Dict[Text, Text]) -> Optional[Text]:
+	"""URL of the wheel which fits the marker environment best, None if none of them does"""
+	ranked = []
+	for url in urls:
+		rank = wheel_rank(unquote(posixpath.basename(urlsplit(url).path)), environment)
+		if rank is not None:
+			ranked.append((rank, url))
+
+	return min(ranked)[1] if ranked else None
@@ -28,8 +28,10 @@ let
 		buildPython = if application then pythonPackages.buildPythonApplication else pythonPackages.buildPythonPackage;
 
 		# Import requirements
+		# requirements-python37.nix etc. are generated when resolving for several python versions
 		requirements = let
-			requirements_path = src + "/requirements.nix";
+			target_requirements_path = src + "/requirements-${python}.nix";
+			requirements_path = if pathExists target_requirements_path then target_requirements_path else src + "/requirements.nix";
 		in if pathExists requirements_path then import requirements_path {
 			inherit setup args;
 			inherit (nixpkgs) fetchurl;